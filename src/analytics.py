@@ -0,0 +1,97 @@
+"""Headless statistics over a whole history directory, grouped by model nickname.
+
+Per-game metadata comes from the directory's GameIndex, which reads new and changed files in
+a process pool and caches the rest by mtime, so reruns only pay for the games added since.
+
+    python analytics.py history --workers 8
+    python analytics.py history --json stats.json
+"""
+import argparse
+from collections import OrderedDict
+import json
+import os
+import re
+import numpy as np
+from game_index import GameIndex, SUMMARY_COLUMNS
+
+
+PERCENTILES = (50, 90, 99)
+# {nickname}_game_{id} from VecEnv, with _worker_{i} in between for self-play workers
+_GAME_NAME = re.compile(r"^(?P<nickname>.+?)(?:_worker_\d+)?_game_\d+\.")
+OTHER_NICKNAME = "other"
+
+
+def nickname(filename):
+    """Model nickname of a history file, OTHER_NICKNAME for files not written by VecEnv (e.g. human games)."""
+    match = _GAME_NAME.match(filename)
+    return match.group("nickname") if match else OTHER_NICKNAME
+
+
+def distribution(values):
+    """Mean, min, max and PERCENTILES of some numbers."""
+    values = np.asarray(values, dtype=float)
+    summary = OrderedDict(mean=float(values.mean()), min=float(values.min()), max=float(values.max()))
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{percentile}"] = float(value)
+    return summary
+
+
+def group_stats(rows):
+    """Statistics of the games of one group, rows holding SUMMARY_COLUMNS."""
+    columns = {name: [row[k] for row in rows] for k, name in enumerate(SUMMARY_COLUMNS)}
+    moves = np.array(columns["moves"])
+    directions = np.array([columns[f"{direction}_moves"] for direction in ("left", "up", "right", "down")]).sum(axis=1)
+    tiles, counts = np.unique(columns["max_tile"], return_counts=True)
+    outcomes = columns["outcome"]
+    total_moves = int(moves.sum())
+    return OrderedDict(
+        games=len(rows),
+        win_rate=outcomes.count("win") / len(rows),
+        loss_rate=outcomes.count("lose") / len(rows),
+        length=distribution(moves),
+        score=distribution(columns["score"]),
+        max_tile=distribution(columns["max_tile"]),
+        max_tile_counts={int(tile): int(count) for tile, count in zip(tiles, counts)},
+        move_frequencies=dict(zip("LURD", (directions / max(total_moves, 1)).tolist())),
+        noop_rate=sum(columns["noop_moves"]) / max(total_moves, 1),
+    )
+
+
+def analyze(history_dir, workers=None, progress=None):
+    """Bring the index of history_dir up to date, reading new games in workers processes (all
+    cores by default), and return statistics per nickname."""
+    index = GameIndex(history_dir)
+    try:
+        index.update(progress=progress, workers=workers or os.cpu_count())
+        rows = index.rows()
+    finally:
+        index.close()
+    groups = OrderedDict()
+    for row in rows:
+        groups.setdefault(nickname(row[0]), []).append(row[1:])
+    return OrderedDict((name, group_stats(group)) for name, group in sorted(groups.items()))
+
+
+def print_stats(stats):
+    header = f"{'nickname':<24}{'games':>8}{'win %':>8}{'noop %':>8}{'len p50':>9}{'score mean':>12}" \
+             f"{'tile p50':>10}{'tile max':>10}  moves L/U/R/D"
+    print(header)
+    print("-" * len(header))
+    for name, group in stats.items():
+        frequencies = "/".join(f"{frequency:.2f}" for frequency in group["move_frequencies"].values())
+        print(f"{name:<24}{group['games']:>8}{100 * group['win_rate']:>8.1f}{100 * group['noop_rate']:>8.1f}"
+              f"{group['length']['p50']:>9.0f}{group['score']['mean']:>12.0f}{group['max_tile']['p50']:>10.0f}"
+              f"{group['max_tile']['max']:>10.0f}  {frequencies}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Statistics over a history directory, per model nickname")
+    parser.add_argument("history_dir", nargs="?", default="history")
+    parser.add_argument("--workers", type=int, default=None, help="processes reading new games, all cores by default")
+    parser.add_argument("--json", default=None, help="also write the full statistics to this file")
+    args = parser.parse_args()
+    stats = analyze(args.history_dir, workers=args.workers)
+    print_stats(stats)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(stats, f, indent=2)
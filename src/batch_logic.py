@@ -0,0 +1,133 @@
+"""Batched versions of the logic module. Every function takes an (N, 4, 4) array of boards
+and steps all of them with a handful of NumPy calls instead of a Python loop per board.
+
+Actions use the same encoding as model.INDEX_TO_ACTION: 0 == L, 1 == U, 2 == R, 3 == D.
+"""
+import numpy as np
+import constants as c
+import logic
+
+
+WIN_TILE = 2048
+
+# Used when no generator is given
+_rng = np.random.default_rng()
+
+
+def _orient(boards, action):
+    """Turn the boards so that the given action becomes a move to the left."""
+    if action == 1:
+        return boards.transpose(0, 2, 1)
+    if action == 2:
+        return boards[:, :, ::-1]
+    if action == 3:
+        return boards.transpose(0, 2, 1)[:, :, ::-1]
+    return boards
+
+
+def _unorient(boards, action):
+    """Inverse of _orient."""
+    if action == 1:
+        return boards.transpose(0, 2, 1)
+    if action == 2:
+        return boards[:, :, ::-1]
+    if action == 3:
+        return boards[:, :, ::-1].transpose(0, 2, 1)
+    return boards
+
+
+def _compress(rows):
+    """Slide the non-zero cells of every row to the left, keeping their order."""
+    order = np.argsort(rows == 0, axis=-1, kind="stable")
+    return np.take_along_axis(rows, order, axis=-1)
+
+
+def _left(boards):
+    """Move all boards to the left. Returns new boards and merge scores."""
+    boards = _compress(boards)
+    scores = np.zeros(len(boards), dtype=np.int64)
+    for j in range(boards.shape[2] - 1):
+        mask = (boards[:, :, j] == boards[:, :, j+1]) & (boards[:, :, j] != 0)
+        boards[:, :, j][mask] *= 2
+        boards[:, :, j+1][mask] = 0
+        scores += np.where(mask, boards[:, :, j], 0).sum(axis=1)
+    return _compress(boards), scores
+
+
+def move_batch(boards, actions):
+    """Apply one action per board. Returns new boards, changed flags and merge scores."""
+    boards = np.asarray(boards)
+    actions = np.broadcast_to(np.asarray(actions), (len(boards),))
+    new_boards = np.empty_like(boards)
+    scores = np.zeros(len(boards), dtype=np.int64)
+    for action in range(4):
+        idx = np.flatnonzero(actions == action)
+        if len(idx) == 0:
+            continue
+        moved, scores[idx] = _left(np.ascontiguousarray(_orient(boards[idx], action)))
+        new_boards[idx] = _unorient(moved, action)
+    changed = (new_boards != boards).any(axis=(1, 2))
+    return new_boards, changed, scores
+
+
+def legal_moves(boards):
+    """(N, 4) mask of the actions that change each board."""
+    boards = np.asarray(boards)
+    n = len(boards)
+    _, changed, _ = move_batch(np.repeat(boards, 4, axis=0), np.tile(np.arange(4), n))
+    return changed.reshape(n, 4)
+
+
+def game_states(boards):
+    """1 == win, 0 == not over, -1 == lose, one entry per board."""
+    boards = np.asarray(boards)
+    win = (boards == WIN_TILE).any(axis=(1, 2))
+    empty = (boards == 0).any(axis=(1, 2))
+    pairs = (boards[:, :, 1:] == boards[:, :, :-1]).any(axis=(1, 2)) | \
+        (boards[:, 1:, :] == boards[:, :-1, :]).any(axis=(1, 2))
+    states = np.where(empty | pairs, 0, -1).astype(np.int8)
+    states[win] = 1
+    return states
+
+
+def add_two_batch(boards, mask=None, rng=None, four_probability=c.FOUR_PROBABILITY):
+    """Batched logic.add_two, in place: a new tile on a random empty cell of every board (or only
+    where mask is True). Boards without an empty cell are left alone. Returns the boards.
+
+    rng is either one numpy.random.Generator shared by the whole batch (fully vectorized) or a
+    sequence with one Generator per board, which draws exactly like logic.add_two so every game
+    can be replayed on its own from its seed."""
+    if mask is None:
+        mask = np.ones(len(boards), dtype=bool)
+    if rng is not None and not isinstance(rng, np.random.Generator):
+        for k in np.flatnonzero(mask):
+            logic.add_two(boards[k], rng[k], four_probability)
+        return boards
+
+    rng = _rng if rng is None else rng
+    flat = boards.reshape(len(boards), -1)
+    empty = (flat == 0) & np.asarray(mask)[:, None]
+    n_empty = empty.sum(axis=1)
+    rows = np.flatnonzero(n_empty)
+    # Pick the i-th empty cell of every board, i uniform over its empty cells
+    picks = (rng.random(len(rows)) * n_empty[rows]).astype(int)
+    ranks = np.cumsum(empty[rows], axis=1) - 1
+    cells = np.argmax((ranks == picks[:, None]) & empty[rows], axis=1)
+    flat[rows, cells] = np.where(rng.random(len(rows)) < four_probability, 4, 2)
+    return boards
+
+
+def new_games(n, size=4, rng=None):
+    """Batched logic.new_game: n boards with two tiles each."""
+    boards = np.zeros((n, size, size), dtype=int)
+    add_two_batch(boards, rng=rng)
+    add_two_batch(boards, rng=rng)
+    return boards
+
+
+def step_batch(boards, actions, rng=None):
+    """Move every board, spawn a tile where the move changed something and evaluate the result.
+    rng is passed on to add_two_batch. Returns new boards, changed flags, merge scores and game states."""
+    new_boards, changed, scores = move_batch(boards, actions)
+    add_two_batch(new_boards, changed, rng)
+    return new_boards, changed, scores, game_states(new_boards)
@@ -0,0 +1,416 @@
+"""Benchmark suite with JSON baselines.
+
+Every benchmark builds its inputs from a fixed seed, is warmed up, then timed over several
+repeats of enough calls to last at least min_time seconds each. Results can be saved as a
+baseline and later runs compared against it on the same machine:
+
+    python benchmark.py --save baselines/laptop.json
+    python benchmark.py --compare baselines/laptop.json --threshold 0.1
+    python benchmark.py --filter history
+
+The choose_action and update_qtable benchmarks need Keras and are skipped without it.
+"""
+import argparse
+from contextlib import redirect_stdout
+from datetime import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+from time import perf_counter_ns
+import numpy as np
+import batch_logic as bl
+import bitboard as bb
+import experience
+import logic
+from env import VecEnv, INDEX_TO_ACTION
+from history import open_history, TEXT_EXTENSION, BINARY_EXTENSION, SEED_EXTENSION
+
+
+SEED = 2048
+BASELINE_VERSION = 1
+
+# name -> (group, setup). setup(rng) returns (operation, units of work per call) and may
+# return a cleanup function as third item.
+BENCHMARKS = {}
+
+
+def benchmark(name, group):
+    def register(setup):
+        BENCHMARKS[name] = (group, setup)
+        return setup
+    return register
+
+
+class Skip(Exception):
+    """Raised by a setup whose requirements are missing."""
+
+
+def random_boards(rng, n, max_rank=10, fill=0.6):
+    """n plausible boards: a fill share of the cells hold tiles up to 2**max_rank."""
+    ranks = rng.integers(1, max_rank + 1, size=(n, 4, 4))
+    ranks[rng.random((n, 4, 4)) > fill] = 0
+    return np.where(ranks > 0, 1 << ranks, 0)
+
+
+def _cycle(items):
+    """Zero-argument function returning the next item of items on every call, round robin."""
+    state = {"i": -1}
+
+    def next_item():
+        state["i"] = (state["i"] + 1) % len(items)
+        return items[state["i"]]
+    return next_item
+
+
+# Engine
+
+def _logic_move(name):
+    def setup(rng):
+        boards = _cycle(list(random_boards(rng, 256)))
+        move = getattr(logic, name)
+        return (lambda: move(boards())), 1
+    return setup
+
+
+for _name in ("left", "up", "right", "down"):
+    benchmark(f"logic.{_name}", "engine")(_logic_move(_name))
+
+
+@benchmark("logic.game_state", "engine")
+def _setup_game_state(rng):
+    boards = _cycle(list(random_boards(rng, 256)))
+    return (lambda: logic.game_state(boards())), 1
+
+
+@benchmark("bitboard.move", "engine")
+def _setup_bitboard_move(rng):
+    boards = _cycle([(bb.to_bitboard(board), int(action)) for board, action in
+                     zip(random_boards(rng, 256), rng.integers(0, 4, 256))])
+
+    def operation():
+        board, action = boards()
+        return bb.move(board, action)
+    return operation, 1
+
+
+@benchmark("batch_logic.step_batch[1024]", "engine")
+def _setup_step_batch(rng):
+    boards = random_boards(rng, 1024)
+    actions = rng.integers(0, 4, 1024)
+    return (lambda: bl.step_batch(boards, actions, rng)), 1024
+
+
+@benchmark("symmetry.canonicalize[1024]", "engine")
+def _setup_canonicalize(rng):
+    import symmetry
+    boards = random_boards(rng, 1024)
+    return (lambda: symmetry.canonicalize(boards)), 1024
+
+
+# History I/O
+
+def _history_writes(extension, background=False, n_boards=200):
+    def setup(rng):
+        directory = tempfile.mkdtemp(prefix="benchmark_history_")
+        boards = random_boards(rng, n_boards)
+        moves = [INDEX_TO_ACTION[int(action)] for action in rng.integers(0, 4, n_boards)]
+        counter = {"n": 0}
+
+        def operation():
+            counter["n"] += 1
+            filename = f"game_{counter['n']}{extension}"
+            history = open_history("w", filename=filename, dir=directory, background=background)
+            for board, move in zip(boards, moves):
+                history.saveMatrix(board)
+                history.saveMove(move)
+            history.close()
+        return operation, n_boards, lambda: shutil.rmtree(directory, ignore_errors=True)
+    return setup
+
+
+for _extension, _label in ((TEXT_EXTENSION, "text"), (BINARY_EXTENSION, "binary"), (SEED_EXTENSION, "seed")):
+    benchmark(f"history.write[{_label}]", "history")(_history_writes(_extension))
+benchmark("history.write[text, background]", "history")(_history_writes(TEXT_EXTENSION, background=True))
+
+
+def _history_random_reads(extension, n_boards=2000):
+    def setup(rng):
+        directory = tempfile.mkdtemp(prefix="benchmark_history_")
+        filename = f"game{extension}"
+        writer = open_history("w", filename=filename, dir=directory)
+        if extension == SEED_EXTENSION:
+            # Seed histories only hold games played with their own generator
+            board = writer.new_game()
+            writer.saveMatrix(board)
+            for action in rng.integers(0, 4, n_boards - 1):
+                new, _ = bb.move(bb.to_bitboard(board), int(action))
+                if new != bb.to_bitboard(board):
+                    board = logic.add_two(bb.from_bitboard(new), writer.rng)
+                writer.saveMatrix(board)
+                writer.saveMove(INDEX_TO_ACTION[int(action)])
+        else:
+            for board, action in zip(random_boards(rng, n_boards), rng.integers(0, 4, n_boards)):
+                writer.saveMatrix(board)
+                writer.saveMove(INDEX_TO_ACTION[int(action)])
+        writer.close()
+        reader = open_history("r", filename=filename, dir=directory)
+        indexes = _cycle(rng.integers(0, reader.n_of_matrices, 4096).tolist())
+
+        def cleanup():
+            reader.close()
+            shutil.rmtree(directory, ignore_errors=True)
+        return (lambda: reader.loadMatrix(indexes())), 1, cleanup
+    return setup
+
+
+for _extension, _label in ((TEXT_EXTENSION, "text"), (BINARY_EXTENSION, "binary"), (SEED_EXTENSION, "seed")):
+    benchmark(f"history.random_read[{_label}]", "history")(_history_random_reads(_extension))
+
+
+# Full games
+
+@benchmark("game.vecenv[64 games]", "game")
+def _setup_vecenv(rng):
+    env = VecEnv(64, 500, seed=int(rng.integers(2**31)))
+    return (lambda: env.step(rng.integers(0, 4, 64))), 64, env.close
+
+
+@benchmark("game.random_playout", "game")
+def _setup_random_playout(rng):
+    def operation():
+        board = bb.to_bitboard(logic.new_game(4, rng))
+        moves = 0
+        while bb.can_move(board):
+            new, _ = bb.move(board, int(rng.integers(4)))
+            if new != board:
+                new = bb.to_bitboard(logic.add_two(bb.from_bitboard(new), rng))
+            board = new
+            moves += 1
+        return moves
+    return operation, 1
+
+
+# Training step
+
+_trainer = None
+
+
+def _training():
+    """model.Trainer with a fresh network and the default config, or Skip without Keras."""
+    global _trainer
+    if _trainer is None:
+        import model
+        try:
+            _trainer = model.Trainer(model.load_config())
+        except ImportError as error:
+            raise Skip(f"needs Keras ({error})")
+    return _trainer
+
+
+def _numpy_network(rng):
+    from network import NumpyNetwork, WEIGHT_SHAPES
+    return NumpyNetwork([rng.normal(0, 0.1, shape) for layer in WEIGHT_SHAPES for shape in layer])
+
+
+@benchmark("network.numpy_predict[1]", "train")
+def _setup_numpy_predict_single(rng):
+    network = _numpy_network(rng)
+    boards = _cycle(list(random_boards(rng, 256)))
+    return (lambda: network.predict(boards())), 1
+
+
+@benchmark("network.numpy_predict[64]", "train")
+def _setup_numpy_predict_batch(rng):
+    network = _numpy_network(rng)
+    states = random_boards(rng, 64)
+    return (lambda: network.predict(states)), 64
+
+
+@benchmark("ntuple.td_step[1024]", "train")
+def _setup_ntuple_step(rng):
+    from ntuple import NTupleNetwork
+    network = NTupleNetwork()
+    ranks = bb.to_ranks(random_boards(rng, 1024))
+    errors = rng.normal(0, 1, 1024)
+
+    def operation():
+        _, _, _, indices, _, _ = network._greedy(ranks)
+        network.update(indices, errors, 0.1)
+    return operation, 1024
+
+
+@benchmark("train.choose_action[8]", "train")
+def _setup_choose_action(rng):
+    trainer = _training()
+    states = random_boards(rng, 8)
+
+    def operation():
+        trainer.inference.clear()
+        return trainer.choose_action(states, 0.0)
+    return operation, 8
+
+
+@benchmark("train.do_action", "train")
+def _setup_do_action(rng):
+    from model import do_action
+    boards = _cycle([(board, int(action)) for board, action in zip(random_boards(rng, 256), rng.integers(0, 4, 256))])
+
+    def operation():
+        board, action = boards()
+        return do_action(board, action)
+    return operation, 1
+
+
+@benchmark("train.update_qtable[64]", "train")
+def _setup_update_qtable(rng):
+    trainer = _training()
+    batch = (random_boards(rng, 64), rng.integers(0, 4, 64), rng.choice([-1, 0, 5, -5], 64).astype(np.float32),
+             random_boards(rng, 64), rng.random(64) < 0.05)
+    return (lambda: trainer.update_qtable(*batch)), 64
+
+
+def _calibrate(operation, min_time):
+    """Calls per repeat so that one repeat lasts at least min_time seconds."""
+    calls = 1
+    while True:
+        start = perf_counter_ns()
+        for _ in range(calls):
+            operation()
+        elapsed = (perf_counter_ns() - start) / 1e9
+        if elapsed >= min_time or calls >= 1 << 24:
+            return calls
+        calls = max(calls * 2, int(calls * min_time / max(elapsed, 1e-9)))
+
+
+def _seed_globals(seed):
+    """Seed the module generators that code called without an rng falls back to."""
+    np.random.seed(seed)
+    logic._rng = np.random.default_rng(seed)
+    bl._rng = np.random.default_rng(seed)
+    experience._rng = np.random.default_rng(seed)
+
+
+def run_benchmark(name, warmup=1, repeats=5, min_time=0.2, seed=SEED):
+    """Stats of one benchmark: seconds per call (mean, stdev, min, median, max) and units per second.
+    The setup gets a generator seeded with seed, and the global generators are reseeded with it."""
+    _, setup = BENCHMARKS[name]
+    _seed_globals(seed)
+    made = setup(np.random.default_rng(seed))
+    operation, units = made[:2]
+    cleanup = made[2] if len(made) > 2 else None
+    # Some of the timed code prints on every call, keep it off the report
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            for _ in range(warmup):
+                operation()
+            calls = _calibrate(operation, min_time)
+            times = []
+            for _ in range(repeats):
+                start = perf_counter_ns()
+                for _ in range(calls):
+                    operation()
+                times.append((perf_counter_ns() - start) / 1e9 / calls)
+    finally:
+        if cleanup is not None:
+            cleanup()
+    median = statistics.median(times)
+    return {
+        "calls_per_repeat": calls,
+        "repeats": repeats,
+        "mean": statistics.fmean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "min": min(times),
+        "median": median,
+        "max": max(times),
+        "units_per_second": units / median if median else float("inf"),
+    }
+
+
+def run_suite(filter=None, warmup=1, repeats=5, min_time=0.2, seed=SEED, report=print):
+    """Run every benchmark whose name contains filter. Returns a baseline dict."""
+    results = {}
+    skipped = {}
+    for name, (group, _) in BENCHMARKS.items():
+        if filter is not None and filter not in name:
+            continue
+        try:
+            results[name] = dict(group=group, **run_benchmark(name, warmup, repeats, min_time, seed))
+        except Skip as reason:
+            skipped[name] = str(reason)
+            report(f"{name:<36} skipped: {reason}")
+            continue
+        stats = results[name]
+        report(f"{name:<36} {format_seconds(stats['median']):>10} median  ±{100 * stats['stdev'] / stats['mean']:4.1f}%"
+               f"  {stats['units_per_second']:>14,.0f} /s")
+    return {
+        "version": BASELINE_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": {"platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(),
+                    "python": platform.python_version(), "numpy": np.__version__},
+        "settings": {"warmup": warmup, "repeats": repeats, "min_time": min_time, "seed": seed},
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def format_seconds(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def compare(baseline, current, threshold=0.1, report=print):
+    """Compare the medians of two runs. A benchmark more than threshold (relative) slower than its
+    baseline is a regression. Returns the names of the regressions."""
+    if baseline["machine"] != current["machine"]:
+        report("Warning: the baseline was recorded on another machine, timings may not be comparable")
+    regressions = []
+    for name, stats in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            report(f"{name:<36} new")
+            continue
+        change = stats["median"] / before["median"] - 1
+        if change > threshold:
+            verdict = "REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            verdict = "faster"
+        else:
+            verdict = ""
+        report(f"{name:<36} {format_seconds(before['median']):>10} -> {format_seconds(stats['median']):>10}"
+               f"  {100 * change:+6.1f}%  {verdict}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--filter", default=None, help="only benchmarks whose name contains this")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat, at least")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--save", default=None, help="write the results as a JSON baseline")
+    parser.add_argument("--compare", default=None, help="JSON baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown counted as a regression")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args()
+    if args.list:
+        for name, (group, _) in BENCHMARKS.items():
+            print(f"{group:<10} {name}")
+        raise SystemExit(0)
+    current = run_suite(args.filter, args.warmup, args.repeats, args.min_time, args.seed)
+    if args.save is not None:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if compare(baseline, current, args.threshold):
+            raise SystemExit(1)
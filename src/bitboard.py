@@ -0,0 +1,261 @@
+"""Bitboard move engine. A 4x4 board is packed into one 64-bit integer of log2 nibbles
+and every move is served from precomputed 65536-entry row tables.
+
+Cell (i, j) lives in nibble 4*i + j, so row i occupies bits [16*i, 16*i + 16) and the
+lowest nibble of a row is its leftmost cell. A nibble of 0 is an empty cell, k is 2**k.
+Tiles above 32768 (2**15) cannot be represented, so two 32768 tiles never merge.
+"""
+import numpy as np
+from metrics import timer
+
+
+ROW_MASK = 0xFFFF
+MAX_RANK = 15
+
+# Filled by _build_tables() on first use, so importing this module stays cheap
+ROW_LEFT = None
+ROW_RIGHT = None
+ROW_LEFT_SCORE = None
+ROW_RIGHT_SCORE = None
+ROW_LEFT_CHANGED = None
+ROW_RIGHT_CHANGED = None
+# The row and score tables as arrays, for the batched rank moves
+_ROW_ARRAYS = None
+
+
+def _build_tables():
+    """Compute the result row, merge score and changed flag for all 65536 rows."""
+    global ROW_LEFT, ROW_RIGHT, ROW_LEFT_SCORE, ROW_RIGHT_SCORE, ROW_LEFT_CHANGED, ROW_RIGHT_CHANGED
+    rows = np.arange(65536, dtype=np.int64)
+    cells = np.stack([(rows >> (4 * j)) & 0xF for j in range(4)], axis=1)
+
+    # compress -> merge -> compress, the same way logic.left does it
+    cells = _compress(cells)
+    score = np.zeros(len(rows), dtype=np.int64)
+    for j in range(3):
+        mask = (cells[:, j] == cells[:, j+1]) & (cells[:, j] != 0) & (cells[:, j] < MAX_RANK)
+        cells[mask, j] += 1
+        cells[mask, j+1] = 0
+        score[mask] += 1 << cells[mask, j]
+    cells = _compress(cells)
+
+    left = cells[:, 0] | (cells[:, 1] << 4) | (cells[:, 2] << 8) | (cells[:, 3] << 12)
+    # Moving right is moving the mirrored row left and mirroring the result back
+    mirrored = _reverse_rows(rows)
+    right = _reverse_rows(left[mirrored])
+    # Python lists: indexing them with plain ints is much faster than indexing arrays
+    ROW_LEFT = left.tolist()
+    ROW_RIGHT = right.tolist()
+    ROW_LEFT_SCORE = score.tolist()
+    ROW_RIGHT_SCORE = score[mirrored].tolist()
+    ROW_LEFT_CHANGED = (left != rows).tolist()
+    ROW_RIGHT_CHANGED = (right != rows).tolist()
+
+
+def _compress(cells):
+    """Slide the non-zero nibbles of every row to the left, keeping their order."""
+    order = np.argsort(cells == 0, axis=1, kind="stable")
+    return np.take_along_axis(cells, order, axis=1)
+
+
+def _reverse_rows(rows):
+    return ((rows & 0xF) << 12) | ((rows & 0xF0) << 4) | ((rows >> 4) & 0xF0) | ((rows >> 12) & 0xF)
+
+
+def _tables():
+    if ROW_LEFT is None:
+        _build_tables()
+
+
+def to_bitboard(mat):
+    """Pack a 4x4 matrix of tile values into a 64-bit integer.
+    Raises ValueError for tiles above 32768, which don't fit in a nibble."""
+    board = 0
+    shift = 0
+    for value in np.asarray(mat).ravel().tolist():
+        if value:
+            rank = int(value).bit_length() - 1
+            if rank > MAX_RANK:
+                raise ValueError(f"Tile {value} is above the largest packable tile {1 << MAX_RANK}")
+            board |= rank << shift
+        shift += 4
+    return board
+
+
+def from_bitboard(board):
+    """Unpack a 64-bit integer into a 4x4 matrix of tile values."""
+    ranks = [(board >> (4 * i)) & 0xF for i in range(16)]
+    return np.array([1 << r if r else 0 for r in ranks], dtype=int).reshape(4, 4)
+
+
+def to_bitboards(boards):
+    """Batched to_bitboard: (N, 4, 4) tile values to an (N,) uint64 array.
+    Raises ValueError for tiles above 32768, like to_bitboard."""
+    boards = np.asarray(boards).reshape(-1, 16)
+    ranks = np.zeros(boards.shape, dtype=np.uint64)
+    nonzero = boards > 0
+    ranks[nonzero] = np.log2(boards[nonzero]).round().astype(np.uint64)
+    if ranks.size and ranks.max() > MAX_RANK:
+        raise ValueError(f"Tile {1 << int(ranks.max())} is above the largest packable tile {1 << MAX_RANK}")
+    return np.bitwise_or.reduce(ranks << (np.arange(16, dtype=np.uint64) * np.uint64(4)), axis=1)
+
+
+def from_bitboards(boards):
+    """Batched from_bitboard: (N,) packed boards to (N, 4, 4) tile values."""
+    boards = np.asarray(boards, dtype=np.uint64)
+    ranks = ((boards[:, None] >> (np.arange(16, dtype=np.uint64) * np.uint64(4))) & np.uint64(0xF)).astype(np.int64)
+    return np.where(ranks > 0, 1 << ranks, 0).reshape(-1, 4, 4)
+
+
+def to_ranks(boards):
+    """(N, 4, 4) tile values to int32 log2 ranks, 0 for an empty cell."""
+    # Tiles are powers of two, so their rank is the exponent of their float32 value
+    exponents = (np.asarray(boards, dtype=np.float32).view(np.int32) >> 23) - 127
+    return np.clip(exponents, 0, MAX_RANK).reshape(-1, 4, 4)
+
+
+def from_ranks(ranks):
+    """Rank boards back to tile values."""
+    return np.where(ranks > 0, 1 << ranks, 0)
+
+
+_NIBBLE_SHIFTS = np.arange(0, 16, 4, dtype=np.int32)
+
+
+def _row_arrays():
+    global _ROW_ARRAYS
+    if _ROW_ARRAYS is None:
+        _tables()
+        _ROW_ARRAYS = (np.array(ROW_LEFT, dtype=np.int32), np.array(ROW_RIGHT, dtype=np.int32),
+                       np.array(ROW_LEFT_SCORE, dtype=np.int64), np.array(ROW_RIGHT_SCORE, dtype=np.int64))
+    return _ROW_ARRAYS
+
+
+def move_ranks_all(ranks):
+    """All four moves of (N, 4, 4) rank boards at once, served from the row tables. Returns
+    the (N, 4, 4, 4) moved rank boards in action order L, U, R, D, (N, 4) changed flags and
+    (N, 4) merge scores."""
+    left, right, left_score, right_score = _row_arrays()
+    ranks = np.asarray(ranks, dtype=np.int32).reshape(-1, 4, 4)
+    # Rows and columns packed like the rows of a bitboard, leftmost / topmost cell lowest
+    rows = (ranks << _NIBBLE_SHIFTS).sum(axis=2)
+    columns = (ranks << _NIBBLE_SHIFTS[:, None]).sum(axis=1)
+    moved = np.empty((len(ranks), 4, 4, 4), dtype=np.int32)
+    scores = np.empty((len(ranks), 4), dtype=np.int64)
+    for action, (lines, table, score, transposed) in enumerate((
+            (rows, left, left_score, False), (columns, left, left_score, True),
+            (rows, right, right_score, False), (columns, right, right_score, True))):
+        cells = (table[lines][:, :, None] >> _NIBBLE_SHIFTS) & 0xF
+        moved[:, action] = cells.transpose(0, 2, 1) if transposed else cells
+        scores[:, action] = score[lines].sum(axis=1)
+    changed = (moved != ranks[:, None]).any(axis=(2, 3))
+    return moved, changed, scores
+
+
+def transpose(board):
+    """Swap rows and columns of a packed board."""
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def _move_rows(board, rows, scores):
+    """Apply a row table to all four rows. Returns new board and merge score."""
+    r0 = board & ROW_MASK
+    r1 = (board >> 16) & ROW_MASK
+    r2 = (board >> 32) & ROW_MASK
+    r3 = (board >> 48) & ROW_MASK
+    new = rows[r0] | (rows[r1] << 16) | (rows[r2] << 32) | (rows[r3] << 48)
+    return new, scores[r0] + scores[r1] + scores[r2] + scores[r3]
+
+
+def move_left(board):
+    _tables()
+    return _move_rows(board, ROW_LEFT, ROW_LEFT_SCORE)
+
+
+def move_right(board):
+    _tables()
+    return _move_rows(board, ROW_RIGHT, ROW_RIGHT_SCORE)
+
+
+def move_up(board):
+    _tables()
+    new, score = _move_rows(transpose(board), ROW_LEFT, ROW_LEFT_SCORE)
+    return transpose(new), score
+
+
+def move_down(board):
+    _tables()
+    new, score = _move_rows(transpose(board), ROW_RIGHT, ROW_RIGHT_SCORE)
+    return transpose(new), score
+
+
+# Same action order as model.INDEX_TO_ACTION: L, U, R, D
+MOVES = (move_left, move_up, move_right, move_down)
+
+
+def move(board, action):
+    """Returns (new board, merge score) for the encoded action on a packed board."""
+    return MOVES[action](board)
+
+
+def count_empty(board):
+    """Number of empty cells on a packed board."""
+    count = 0
+    for i in range(16):
+        if not (board >> (4 * i)) & 0xF:
+            count += 1
+    return count
+
+
+def max_rank(board):
+    """log2 of the biggest tile on a packed board."""
+    return max((board >> (4 * i)) & 0xF for i in range(16))
+
+
+def can_move(board):
+    """True if at least one of the four moves changes the board."""
+    _tables()
+    for b in (board, transpose(board)):
+        for shift in (0, 16, 32, 48):
+            row = (b >> shift) & ROW_MASK
+            if ROW_LEFT_CHANGED[row] or ROW_RIGHT_CHANGED[row]:
+                return True
+    return False
+
+
+# Drop-in replacements for logic.left/up/right/down with the same (board, done) contract,
+# timed under their own names so reports tell the two engines apart
+
+@timer(name="bitboard.left")
+def left(game):
+    board = to_bitboard(game)
+    new, _ = move_left(board)
+    return from_bitboard(new), new != board
+
+
+@timer(name="bitboard.up")
+def up(game):
+    board = to_bitboard(game)
+    new, _ = move_up(board)
+    return from_bitboard(new), new != board
+
+
+@timer(name="bitboard.right")
+def right(game):
+    board = to_bitboard(game)
+    new, _ = move_right(board)
+    return from_bitboard(new), new != board
+
+
+@timer(name="bitboard.down")
+def down(game):
+    board = to_bitboard(game)
+    new, _ = move_down(board)
+    return from_bitboard(new), new != board
@@ -0,0 +1,114 @@
+"""Training checkpoints written in the background.
+
+A checkpoint is one .npz file holding named arrays (weights, optimizer variables, replay
+buffer, ...) and a JSON state (counters, schedules, RNG states, run metrics). The training
+loop takes the snapshot itself, which only copies arrays in memory, and hands it to a
+Checkpointer, whose thread does the slow part: writing the file next to the previous ones,
+renaming it into place, and removing the oldest checkpoints beyond keep.
+"""
+import json
+import os
+import re
+import threading
+import numpy as np
+
+
+CHECKPOINT_VERSION = 1
+_CHECKPOINT_NAME = re.compile(r"^checkpoint_(\d+)\.npz$")
+# Key of the JSON state among the arrays of a checkpoint file
+_STATE_KEY = "__state__"
+
+
+def checkpoints(directory):
+    """Paths of the checkpoints in directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    numbered = [(int(match.group(1)), name) for name in os.listdir(directory)
+                for match in [_CHECKPOINT_NAME.match(name)] if match]
+    return [os.path.join(directory, name) for _, name in sorted(numbered)]
+
+
+def latest(directory):
+    """Path of the newest checkpoint in directory, or None."""
+    paths = checkpoints(directory)
+    return paths[-1] if paths else None
+
+
+def write(path, arrays, state):
+    """Write a checkpoint file, atomically: a crash while writing leaves the previous file."""
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        np.savez(f, **arrays, **{_STATE_KEY: np.array(json.dumps(dict(state, version=CHECKPOINT_VERSION)))})
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def load(path):
+    """(arrays, state) of a checkpoint file."""
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files if name != _STATE_KEY}
+        state = json.loads(str(data[_STATE_KEY]))
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} was written by another version of checkpoint")
+    return arrays, state
+
+
+class Checkpointer():
+    """Writes checkpoints to directory in a background thread, keeping the newest keep of them.
+    save() never waits for the disk: a snapshot handed over while the previous one is still
+    being written waits for its turn, replacing any older one that was still waiting.
+    Don't forget to call close() when done."""
+
+    def __init__(self, directory, keep=3):
+        if keep < 1:
+            raise ValueError("Keep at least one checkpoint")
+        self.directory = directory
+        self.keep = keep
+        self.error = None
+        self.written = 0
+        self.dropped = 0
+        self._pending = None
+        self._closing = False
+        self._condition = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name=f"checkpoint-writer {directory}", daemon=True)
+        self.thread.start()
+
+    def save(self, number, arrays, state):
+        """Queue checkpoint_{number}.npz. arrays must be copies the caller no longer changes."""
+        if self.error is not None:
+            raise self.error
+        with self._condition:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (number, arrays, state)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closing:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                (number, arrays, state), self._pending = self._pending, None
+            if self.error is not None:
+                continue
+            try:
+                write(os.path.join(self.directory, f"checkpoint_{number:09d}.npz"), arrays, state)
+                self.written += 1
+                for path in checkpoints(self.directory)[:-self.keep]:
+                    os.remove(path)
+            except Exception as error:
+                self.error = error
+
+    def close(self):
+        """Write the last queued snapshot and stop the thread.
+        Raises the first error the writer thread ran into, if any."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
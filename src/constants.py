@@ -4,6 +4,9 @@ GAME_GRID_HEIGHT = 400
 GRID_LEN = 4
 GRID_PADDING = 10
 
+# Chance of a new tile being a 4 instead of a 2
+FOUR_PROBABILITY = 0.1
+
 SCROLL_PANEL_WIDTH = 200
 SCROLL_PANEL_HEIGHT = 200
 
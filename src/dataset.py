@@ -0,0 +1,216 @@
+"""Training datasets compacted from history directories.
+
+export_dataset reads every history file of a directory (any format open_history knows) in
+parallel worker processes and writes the games into shards of a few big NumPy arrays:
+
+    shard_XXXXX_boards.npy   (M,) uint64   every board of every game, nibble-packed (see bitboard)
+    shard_XXXXX_moves.npy    (M,) int8     encoded action played from the board, -1 after the last board
+    shard_XXXXX_rewards.npy  (M,) float32  reward of that move, as VecEnv hands it out
+    shard_XXXXX_dones.npy    (M,) bool     the move ended the game (win or lose)
+    shard_XXXXX_games.npy    (G + 1,) int64  index of the first board of every game, then M
+
+plus a manifest.json listing the shards. Dataset memory-maps the shards, so training can
+stream shuffled minibatches from a dataset much bigger than RAM.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import struct
+import numpy as np
+import batch_logic as bl
+import bitboard as bb
+from env import INDEX_TO_ACTION, REWARDS
+from history import open_history, TEXT_EXTENSION, BINARY_EXTENSION, SEED_EXTENSION
+
+
+MANIFEST = "manifest.json"
+DATASET_VERSION = 1
+SHARD_ARRAYS = ("boards", "moves", "rewards", "dones", "games")
+NO_MOVE = -1
+
+MOVE_TO_INDEX = {move: index for index, move in INDEX_TO_ACTION.items()}
+
+
+def history_files(directory, prefix=None):
+    """Sorted history files of a directory, optionally only the ones starting with prefix."""
+    extensions = (TEXT_EXTENSION, BINARY_EXTENSION, SEED_EXTENSION)
+    return sorted(name for name in os.listdir(directory)
+                  if name.endswith(extensions) and (prefix is None or name.startswith(prefix)))
+
+
+def read_game(path):
+    """Packed boards and encoded moves of one history file. Moves that aren't one of L, U, R, D
+    end the game there. Returns None for a file that can't be read."""
+    try:
+        history = open_history("r", filename=path)
+    except (OSError, ValueError, AssertionError, struct.error) as error:
+        print(f"Skipping {path}: {error}")
+        return None
+    try:
+        moves = []
+        for move in history.readMoves():
+            if move not in MOVE_TO_INDEX:
+                break
+            moves.append(MOVE_TO_INDEX[move])
+        n_boards = min(history.n_of_matrices, len(moves) + 1)
+        boards = bb.to_bitboards([history.loadMatrix(i) for i in range(n_boards)])
+    finally:
+        history.close()
+    moves = np.array(moves[:n_boards - 1] + [NO_MOVE], dtype=np.int8)
+    return boards, moves
+
+
+def derive_rewards(boards, moves):
+    """Reward and done flag of every move of a game (the last board gets 0 and False)."""
+    rewards = np.zeros(len(boards), dtype=np.float32)
+    dones = np.zeros(len(boards), dtype=bool)
+    if len(boards) < 2:
+        return rewards, dones
+    states = bl.game_states(bb.from_bitboards(boards[1:]))
+    step_rewards = np.full(len(boards) - 1, REWARDS['CONTINUE'], dtype=np.float32)
+    step_rewards[boards[1:] == boards[:-1]] = REWARDS['NO_RESULT']
+    step_rewards[states == 1] = REWARDS['WIN']
+    step_rewards[states == -1] = REWARDS['LOSE']
+    rewards[:-1] = step_rewards
+    dones[:-1] = states != 0
+    return rewards, dones
+
+
+def shard_path(directory, shard, array):
+    return os.path.join(directory, f"shard_{shard:05d}_{array}.npy")
+
+
+def _write_shard(directory, shard, paths):
+    """Convert some history files into one shard. Runs in a worker process."""
+    boards, moves, rewards, dones, starts = [], [], [], [], [0]
+    for path in paths:
+        game = read_game(path)
+        if game is None or len(game[0]) == 0:
+            continue
+        game_rewards, game_dones = derive_rewards(*game)
+        boards.append(game[0])
+        moves.append(game[1])
+        rewards.append(game_rewards)
+        dones.append(game_dones)
+        starts.append(starts[-1] + len(game[0]))
+    arrays = {
+        "boards": np.concatenate(boards) if boards else np.zeros(0, dtype=np.uint64),
+        "moves": np.concatenate(moves) if moves else np.zeros(0, dtype=np.int8),
+        "rewards": np.concatenate(rewards) if rewards else np.zeros(0, dtype=np.float32),
+        "dones": np.concatenate(dones) if dones else np.zeros(0, dtype=bool),
+        "games": np.array(starts, dtype=np.int64),
+    }
+    for name, array in arrays.items():
+        np.save(shard_path(directory, shard, name), array)
+    return {"shard": shard, "games": len(starts) - 1, "boards": int(starts[-1]),
+            "transitions": int((arrays["moves"] != NO_MOVE).sum())}
+
+
+def export_dataset(history_dir, output_dir, prefix=None, games_per_shard=1000, workers=None):
+    """Compact the history files of history_dir (optionally only those starting with prefix) into
+    shards of games_per_shard games in output_dir, converting shards in workers processes
+    (all cores by default). Returns the manifest."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = [os.path.join(history_dir, name) for name in history_files(history_dir, prefix)]
+    chunks = [paths[start:start + games_per_shard] for start in range(0, len(paths), games_per_shard)]
+    if workers == 1:
+        shards = [_write_shard(output_dir, shard, chunk) for shard, chunk in enumerate(chunks)]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            shards = list(pool.map(_write_shard, [output_dir] * len(chunks), range(len(chunks)), chunks))
+    manifest = {
+        "version": DATASET_VERSION,
+        "source": os.path.abspath(history_dir),
+        "prefix": prefix,
+        "files": len(paths),
+        "games": sum(shard["games"] for shard in shards),
+        "transitions": sum(shard["transitions"] for shard in shards),
+        "shards": shards,
+    }
+    with open(os.path.join(output_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class Dataset():
+    """Memory-mapped view of an exported dataset. Only the shards being iterated are touched,
+    so the dataset can be much bigger than RAM."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest["version"] != DATASET_VERSION:
+            raise ValueError(f"Unsupported dataset version {self.manifest['version']} in {directory}")
+        self.shards = [shard["shard"] for shard in self.manifest["shards"] if shard["transitions"]]
+
+    def __len__(self):
+        """Number of transitions."""
+        return self.manifest["transitions"]
+
+    def load_shard(self, shard):
+        """Dict of the memory-mapped arrays of one shard."""
+        return {name: np.load(shard_path(self.directory, shard, name), mmap_mode="r") for name in SHARD_ARRAYS}
+
+    def batches(self, batch_size, shuffle=True, rng=None, shards_at_once=4, drop_last=False):
+        """Yield (states, actions, rewards, next_states, dones) minibatches, shaped like
+        ReplayBuffer.sample, over every transition once.
+
+        With shuffle, the shard order is shuffled and shards_at_once shards are mixed at a time,
+        so memory stays bounded by the index of shards_at_once shards while batches still mix games
+        from several shards."""
+        rng = np.random.default_rng() if rng is None else rng
+        shards = list(self.shards)
+        if shuffle:
+            rng.shuffle(shards)
+        for start in range(0, len(shards), shards_at_once):
+            group = [self.load_shard(shard) for shard in shards[start:start + shards_at_once]]
+            # (shard in group, board index) of every transition of the group
+            index = np.concatenate([
+                np.stack([np.full(len(positions), k), positions], axis=1)
+                for k, positions in enumerate(np.flatnonzero(arrays["moves"] != NO_MOVE) for arrays in group)
+            ])
+            if shuffle:
+                index = index[rng.permutation(len(index))]
+            for begin in range(0, len(index), batch_size):
+                batch = index[begin:begin + batch_size]
+                if drop_last and len(batch) < batch_size:
+                    break
+                yield self._gather(group, batch)
+
+    @staticmethod
+    def _gather(group, batch):
+        states = np.empty(len(batch), dtype=np.uint64)
+        next_states = np.empty(len(batch), dtype=np.uint64)
+        actions = np.empty(len(batch), dtype=np.int8)
+        rewards = np.empty(len(batch), dtype=np.float32)
+        dones = np.empty(len(batch), dtype=bool)
+        for k, arrays in enumerate(group):
+            rows = np.flatnonzero(batch[:, 0] == k)
+            if len(rows) == 0:
+                continue
+            # Sorted reads are sequential on the memory map
+            rows = rows[np.argsort(batch[rows, 1])]
+            positions = batch[rows, 1]
+            states[rows] = arrays["boards"][positions]
+            next_states[rows] = arrays["boards"][positions + 1]
+            actions[rows] = arrays["moves"][positions]
+            rewards[rows] = arrays["rewards"][positions]
+            dones[rows] = arrays["dones"][positions]
+        return (bb.from_bitboards(states).astype(np.int32), actions, rewards,
+                bb.from_bitboards(next_states).astype(np.int32), dones)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact a history directory into a sharded training dataset")
+    parser.add_argument("history_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--prefix", default=None, help="only files starting with this, e.g. a model nickname")
+    parser.add_argument("--games-per-shard", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, all cores by default")
+    args = parser.parse_args()
+    manifest = export_dataset(args.history_dir, args.output_dir, prefix=args.prefix,
+                              games_per_shard=args.games_per_shard, workers=args.workers)
+    print(f"{manifest['files']} files, {manifest['games']} games, {manifest['transitions']} transitions "
+          f"in {len(manifest['shards'])} shards")
@@ -0,0 +1,133 @@
+"""Vectorized training environment: K games stepped in lockstep with one batched call."""
+import numpy as np
+import batch_logic as bl
+import logic
+import profiler
+from history import open_history, HistoryWriter, TEXT_EXTENSION
+
+
+INDEX_TO_ACTION = {
+    0: 'L',
+    1: 'U',
+    2: 'R',
+    3: 'D',
+}
+
+REWARDS = {
+    'WIN': 5,
+    'LOSE': -5,
+    'NO_RESULT': -1,
+    'CONTINUE': 0,
+}
+
+
+class VecEnv():
+    """K games played side by side. Finished games are logged, closed and replaced by new ones
+    automatically, so every step always has K live states. Don't forget to call close() when done."""
+
+    def __init__(self, n_games, max_moves, history_prefix=None, history_dir="history", seed=None,
+                 history_extension=TEXT_EXTENSION, background_writes=False, first_game_id=0, max_games=None):
+        """Every game gets its own history named {history_prefix}_game_{id}{history_extension},
+        unless history_prefix is None.
+
+        Every game also gets its own random generator, seeded from a master generator seeded with
+        seed, so all tiles of a game follow from its seed alone and every run is reproducible.
+        Use history_extension=SEED_EXTENSION to record games as just their seed and moves.
+        With background_writes, histories are written by one background thread shared by all
+        games (see HistoryWriter), so finished games are closed without waiting for the disk.
+        Game ids start at first_game_id, e.g. next_game_id of the run being resumed.
+        With max_games, only the first max_games games get a history: the games started after
+        them just keep every slot live until the recorded ones are done."""
+        self.n_games = n_games
+        self.max_moves = max_moves
+        self.history_prefix = history_prefix
+        self.history_dir = history_dir
+        self.history_extension = history_extension
+        self.background_writes = background_writes
+        self.end_of_recording = None if max_games is None else first_game_id + max_games
+        self.writer = None
+        if background_writes and history_prefix is not None:
+            self.writer = HistoryWriter(name=f"history-writer {history_prefix}")
+
+        self.master_rng = np.random.default_rng(seed)
+        self.seeds = [self._new_seed() for _ in range(n_games)]
+        self.rngs = [np.random.default_rng(game_seed) for game_seed in self.seeds]
+        self.states = np.array([logic.new_game(4, rng) for rng in self.rngs])
+        self.game_ids = np.arange(first_game_id, first_game_id + n_games)
+        self.moves = np.zeros(n_games, dtype=int)
+        self.game_rewards = np.zeros(n_games, dtype=int)
+        self.next_game_id = first_game_id + n_games
+        self.finished = []
+        self.histories = [self._open_history(k) for k in range(n_games)]
+
+    def _new_seed(self):
+        return int(self.master_rng.integers(2**63))
+
+    def _open_history(self, k):
+        if self.history_prefix is None:
+            return None
+        if self.end_of_recording is not None and self.game_ids[k] >= self.end_of_recording:
+            return None
+        filename = f"{self.history_prefix}_game_{self.game_ids[k]}{self.history_extension}"
+        history = open_history("w", dir=self.history_dir, filename=filename, seed=self.seeds[k],
+                               background=self.background_writes, writer=self.writer)
+        history.saveMatrix(self.states[k])
+        return history
+
+    def step(self, actions):
+        """Play one action in every game.
+        Returns next states, rewards, game ended flags (win or lose) and finished flags (ended or out of moves).
+        Next states are the boards the actions led to, before finished games are reset."""
+        with profiler.span("step_batch"):
+            new_states, changed, _, game_states = bl.step_batch(self.states, actions, self.rngs)
+
+        rewards = np.full(self.n_games, REWARDS['CONTINUE'])
+        rewards[~changed] = REWARDS['NO_RESULT']
+        rewards[game_states == 1] = REWARDS['WIN']
+        rewards[game_states == -1] = REWARDS['LOSE']
+        game_ended = game_states != 0
+
+        self.moves += 1
+        self.game_rewards += rewards
+        finished = game_ended | (self.moves >= self.max_moves)
+
+        with profiler.span("history"):
+            for k, history in enumerate(self.histories):
+                if history is not None:
+                    history.saveMatrix(new_states[k])
+                    history.saveMove(INDEX_TO_ACTION[int(actions[k])])
+
+        self.states = new_states.copy()
+        with profiler.span("reset"):
+            for k in np.flatnonzero(finished):
+                self._reset(k)
+        return new_states, rewards, game_ended, finished
+
+    def _reset(self, k):
+        """Log the finished game in slot k and start a new one in its place."""
+        self.finished.append((int(self.game_ids[k]), int(self.game_rewards[k]), int(self.moves[k])))
+        if self.histories[k] is not None:
+            self.histories[k].close()
+        self.seeds[k] = self._new_seed()
+        self.rngs[k] = np.random.default_rng(self.seeds[k])
+        self.states[k] = logic.new_game(4, self.rngs[k])
+        self.game_ids[k] = self.next_game_id
+        self.next_game_id += 1
+        self.moves[k] = 0
+        self.game_rewards[k] = 0
+        self.histories[k] = self._open_history(k)
+
+    def pop_finished(self):
+        """List of (game id, total reward, moves) of the games finished since the last call."""
+        finished, self.finished = self.finished, []
+        return finished
+
+    def close(self):
+        """Close the histories of the games still in progress, waiting for background writes."""
+        for history in self.histories:
+            if history is not None:
+                history.close()
+        self.histories = [None] * self.n_games
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
@@ -0,0 +1,260 @@
+"""Expectimax search agent. Baseline to benchmark the Q-network against and teacher policy
+whose games can be used as training data.
+
+Max nodes try the four moves, chance nodes average over every empty cell and spawned tile.
+Search runs on packed bitboards, deepens iteratively until the time budget is spent and
+caches evaluated positions in a bounded transposition table keyed by canonical board.
+"""
+from collections import OrderedDict
+from time import perf_counter
+import numpy as np
+import bitboard as bb
+import constants as c
+import logic
+from env import INDEX_TO_ACTION
+
+
+# Spawned tile rank -> probability, matching logic.add_two
+SPAWN_PROBABILITIES = ((1, 1 - c.FOUR_PROBABILITY), (2, c.FOUR_PROBABILITY))
+
+# Chance branches less likely than this are not searched any deeper
+MIN_PROBABILITY = 0.0001
+
+# Added to every evaluation, so a lost position (value 0) is always the worst
+LOST_PENALTY = 200000.0
+
+
+def _row_features():
+    """Per-row empty count, monotonicity penalty and merge count for all 65536 rows."""
+    rows = np.arange(65536)
+    ranks = np.stack([(rows >> (4 * j)) & 0xF for j in range(4)], axis=1)
+    empty = (ranks == 0).sum(axis=1)
+
+    # Monotonicity: how much the row goes against its better direction, weighted by tile size
+    powers = ranks.astype(float) ** 4
+    rising = np.clip(powers[:, :-1] - powers[:, 1:], 0, None).sum(axis=1)
+    falling = np.clip(powers[:, 1:] - powers[:, :-1], 0, None).sum(axis=1)
+    monotonicity = -np.minimum(rising, falling)
+
+    # Merges: neighbouring equal tiles once empty cells are squeezed out
+    order = np.argsort(ranks == 0, axis=1, kind="stable")
+    packed = np.take_along_axis(ranks, order, axis=1)
+    merges = ((packed[:, :-1] == packed[:, 1:]) & (packed[:, :-1] != 0)).sum(axis=1)
+    return {
+        "empty": empty.astype(float).tolist(),
+        "monotonicity": monotonicity.tolist(),
+        "merges": merges.astype(float).tolist(),
+    }
+
+
+_ROW_FEATURES = None
+
+
+def row_features():
+    global _ROW_FEATURES
+    if _ROW_FEATURES is None:
+        _ROW_FEATURES = _row_features()
+    return _ROW_FEATURES
+
+
+DEFAULT_WEIGHTS = {
+    "empty": 270.0,
+    "monotonicity": 1.0,
+    "merges": 700.0,
+}
+
+
+class Heuristic():
+    """Weighted sum of row features over the 4 rows and 4 columns of a board.
+    Pass your own weights (feature name -> weight) or extra features (name -> list of 65536
+    per-row values) to plug in another evaluation."""
+
+    def __init__(self, weights=None, features=None):
+        weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        features = dict(row_features(), **(features or {}))
+        table = np.zeros(65536)
+        for name, weight in weights.items():
+            table += weight * np.asarray(features[name], dtype=float)
+        self.table = table.tolist()
+
+    def __call__(self, board):
+        table = self.table
+        columns = bb.transpose(board)
+        return LOST_PENALTY + (table[board & 0xFFFF] + table[(board >> 16) & 0xFFFF] +
+                               table[(board >> 32) & 0xFFFF] + table[(board >> 48) & 0xFFFF] +
+                               table[columns & 0xFFFF] + table[(columns >> 16) & 0xFFFF] +
+                               table[(columns >> 32) & 0xFFFF] + table[(columns >> 48) & 0xFFFF])
+
+
+def _mirror(board):
+    """Reverse the order of the cells in every row."""
+    return ((board & 0x000F000F000F000F) << 12) | ((board & 0x00F000F000F000F0) << 4) | \
+        ((board >> 4) & 0x00F000F000F000F0) | ((board >> 12) & 0x000F000F000F000F)
+
+
+def canonical(board):
+    """Smallest of the 8 rotations and reflections of a packed board."""
+    best = board
+    for b in (board, bb.transpose(board)):
+        for candidate in (b, _mirror(b)):
+            flipped = _flip(candidate)
+            best = min(best, candidate, flipped)
+    return best
+
+
+def _flip(board):
+    """Reverse the order of the rows."""
+    return ((board & 0xFFFF) << 48) | ((board & 0xFFFF0000) << 16) | \
+        ((board >> 16) & 0xFFFF0000) | ((board >> 48) & 0xFFFF)
+
+
+class TranspositionTable():
+    """Bounded cache of (depth, value) per canonical board, evicting the least recently used."""
+
+    def __init__(self, max_entries=1_000_000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, board, depth):
+        """Cached value of a board searched at least this deep, or None."""
+        entry = self.entries.get(canonical(board))
+        if entry is not None and entry[0] >= depth:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, board, depth, value):
+        key = canonical(board)
+        self.entries[key] = (depth, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class ExpectimaxAgent():
+    """Depth-limited, time-budgeted expectimax. choose_action has the same interface as
+    model.choose_action, so the agent can stand in for the Q-network anywhere."""
+
+    def __init__(self, max_depth=3, time_budget=0.05, heuristic=None, table_size=1_000_000,
+                 spawn_probabilities=SPAWN_PROBABILITIES):
+        """max_depth counts moves, time_budget is in seconds per move (None for no limit)."""
+        self.max_depth = max_depth
+        self.time_budget = time_budget
+        self.heuristic = heuristic if heuristic is not None else Heuristic()
+        self.table = TranspositionTable(table_size)
+        self.spawn_probabilities = spawn_probabilities
+        self.last_depth = 0
+
+    def choose_action(self, states, exploration_rate=0):
+        """Returns encoded actions, one per state. exploration_rate is accepted for compatibility
+        with model.choose_action; the search is always greedy."""
+        states = np.asarray(states)
+        if states.ndim == 2:
+            return self.best_action(bb.to_bitboard(states))
+        return np.array([self.best_action(bb.to_bitboard(state)) for state in states])
+
+    def best_action(self, board):
+        """Encoded action for a packed board, from the deepest search finished within the budget."""
+        deadline = None if self.time_budget is None else perf_counter() + self.time_budget
+        best = self._legal_fallback(board)
+        for depth in range(1, self.max_depth + 1):
+            try:
+                action = self._search_root(board, depth, deadline)
+            except _OutOfTime:
+                break
+            if action is not None:
+                best = action
+            self.last_depth = depth
+        return best
+
+    @staticmethod
+    def _legal_fallback(board):
+        for action in range(4):
+            if bb.move(board, action)[0] != board:
+                return action
+        return 0
+
+    def _search_root(self, board, depth, deadline):
+        best_action = None
+        best_value = float("-inf")
+        for action in range(4):
+            new, _ = bb.move(board, action)
+            if new == board:
+                continue
+            value = self._chance(new, depth, 1.0, deadline)
+            if value > best_value:
+                best_value = value
+                best_action = action
+        return best_action
+
+    def _max(self, board, depth, probability, deadline):
+        cached = self.table.get(board, depth)
+        if cached is not None:
+            return cached
+        if deadline is not None and perf_counter() > deadline:
+            raise _OutOfTime()
+        best = None
+        for action in range(4):
+            new, _ = bb.move(board, action)
+            if new == board:
+                continue
+            value = self._chance(new, depth, probability, deadline)
+            if best is None or value > best:
+                best = value
+        if best is None:
+            # No legal move: the game is lost here
+            best = 0.0
+        self.table.put(board, depth, best)
+        return best
+
+    def _chance(self, board, depth, probability, deadline):
+        """Average over every empty cell and spawned tile, then search one move less deep."""
+        if depth <= 1 or probability < MIN_PROBABILITY:
+            return self.heuristic(board)
+        empty = [i for i in range(16) if not (board >> (4 * i)) & 0xF]
+        if not empty:
+            return self.heuristic(board)
+        total = 0.0
+        cell_probability = probability / len(empty)
+        for i in empty:
+            for rank, tile_probability in self.spawn_probabilities:
+                child = board | (rank << (4 * i))
+                total += tile_probability * self._max(child, depth - 1, cell_probability * tile_probability, deadline)
+        return total / len(empty)
+
+
+def play_game(agent, max_moves=None, history=None):
+    """Play one game with agent.choose_action, optionally recording it to a History in write mode
+    so the game can be replayed or used as training data. Returns final board, moves and score.
+    With a SeedHistory, the tiles are spawned from its generator."""
+    rng = getattr(history, "rng", None)
+    state = logic.new_game(4, rng)
+    if history is not None:
+        history.saveMatrix(state)
+    moves = 0
+    score = 0
+    while logic.game_state(state) == 0 and (max_moves is None or moves < max_moves):
+        action = int(agent.choose_action(state))
+        board = bb.to_bitboard(state)
+        new, merged = bb.move(board, action)
+        state = bb.from_bitboard(new)
+        if new != board:
+            logic.add_two(state, rng)
+        moves += 1
+        score += merged
+        if history is not None:
+            history.saveMatrix(state)
+            history.saveMove(INDEX_TO_ACTION[action])
+    if history is not None:
+        history.close()
+    return state, moves, score
@@ -0,0 +1,114 @@
+"""Experience replay: a fixed-capacity ring buffer of transitions in preallocated NumPy arrays."""
+import numpy as np
+
+
+_rng = np.random.default_rng()
+
+
+class ReplayBuffer():
+    """Stores (state, action, reward, next state, game ended) transitions. Once full, the oldest
+    transitions are overwritten. Give either capacity (transitions) or max_bytes (memory cap)."""
+
+    def __init__(self, capacity=None, max_bytes=None, board_shape=(4, 4)):
+        if capacity is None and max_bytes is None:
+            raise ValueError("Give capacity or max_bytes")
+        self.board_shape = tuple(board_shape)
+        if max_bytes is not None:
+            capacity = min(capacity or max_bytes, max_bytes // self.transition_bytes(self.board_shape))
+        if capacity < 1:
+            raise ValueError("Buffer must hold at least one transition")
+        self.capacity = capacity
+        self.states = np.zeros((capacity, *self.board_shape), dtype=np.int32)
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, *self.board_shape), dtype=np.int32)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.position = 0
+        self.size = 0
+
+    @staticmethod
+    def transition_bytes(board_shape=(4, 4)):
+        """Memory used by one stored transition."""
+        board = int(np.prod(board_shape)) * np.dtype(np.int32).itemsize
+        return 2 * board + np.dtype(np.int8).itemsize + np.dtype(np.float32).itemsize + np.dtype(bool).itemsize
+
+    @property
+    def nbytes(self):
+        return self.states.nbytes + self.actions.nbytes + self.rewards.nbytes + self.next_states.nbytes + self.dones.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, done):
+        """Store one transition, O(1)."""
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        """Store a batch of transitions with one write per array."""
+        n = len(states)
+        if n > self.capacity:
+            # Only the newest transitions would survive anyway
+            states, actions, rewards, next_states, dones = (
+                a[-self.capacity:] for a in (states, actions, rewards, next_states, dones))
+            n = self.capacity
+        idx = (self.position + np.arange(n)) % self.capacity
+        self.states[idx] = states
+        self.actions[idx] = actions
+        self.rewards[idx] = rewards
+        self.next_states[idx] = next_states
+        self.dones[idx] = dones
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def sample(self, batch_size, rng=None):
+        """Uniformly sample a minibatch (with replacement) using a numpy.random.Generator.
+        Returns states, actions, rewards, next states and game ended flags."""
+        if self.size == 0:
+            raise ValueError("Cannot sample from an empty buffer")
+        rng = rng if rng is not None else _rng
+        idx = rng.integers(0, self.size, batch_size)
+        return self.states[idx], self.actions[idx], self.rewards[idx], self.next_states[idx], self.dones[idx]
+
+    def _ordered(self, array):
+        """Stored entries of array from oldest to newest."""
+        if self.size < self.capacity:
+            return array[:self.size]
+        return np.concatenate([array[self.position:], array[:self.position]])
+
+    def arrays(self):
+        """Copies of the stored transitions, oldest first, and the capacity, as saved by save()."""
+        return {
+            "capacity": np.array(self.capacity),
+            "states": np.array(self._ordered(self.states)),
+            "actions": np.array(self._ordered(self.actions)),
+            "rewards": np.array(self._ordered(self.rewards)),
+            "next_states": np.array(self._ordered(self.next_states)),
+            "dones": np.array(self._ordered(self.dones)),
+        }
+
+    def save(self, path):
+        """Save the stored transitions, oldest first, to a .npz file."""
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def from_arrays(cls, data, capacity=None, max_bytes=None):
+        """Buffer holding the transitions of arrays() (or of an opened save() file).
+        Capacity defaults to the saved one."""
+        if capacity is None and max_bytes is None:
+            capacity = int(data["capacity"])
+        buffer = cls(capacity=capacity, max_bytes=max_bytes, board_shape=data["states"].shape[1:])
+        buffer.add_batch(data["states"], data["actions"], data["rewards"], data["next_states"], data["dones"])
+        return buffer
+
+    @classmethod
+    def load(cls, path, capacity=None, max_bytes=None):
+        """Load a buffer saved with save(). Capacity defaults to the saved one."""
+        with np.load(path) as data:
+            return cls.from_arrays(data, capacity=capacity, max_bytes=max_bytes)
@@ -0,0 +1,177 @@
+"""Persistent metadata index of a history directory: move count, final max tile, score,
+outcome, moves per direction and wasted moves of every game, so games can be listed, sorted,
+filtered and analysed without opening their files.
+
+The index lives in a small SQLite database inside the directory. update() only reads the
+files that are new or changed (by size and mtime) since the last update and drops the rows of
+deleted files, so keeping it current is cheap even with tens of thousands of games.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sqlite3
+import batch_logic as bl
+import bitboard as bb
+from dataset import read_game, history_files
+
+
+INDEX_FILENAME = ".game_index.sqlite"
+INDEX_VERSION = 3
+SORT_COLUMNS = ("filename", "moves", "max_tile", "score", "outcome", "mtime")
+OUTCOMES = ("win", "lose", "unfinished")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    moves INTEGER NOT NULL,
+    max_tile INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    noop_moves INTEGER NOT NULL,
+    left_moves INTEGER NOT NULL,
+    up_moves INTEGER NOT NULL,
+    right_moves INTEGER NOT NULL,
+    down_moves INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS unreadable (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL
+)
+"""
+# Columns filled from summarize(), after filename, size and mtime
+SUMMARY_COLUMNS = ("moves", "max_tile", "score", "outcome", "noop_moves", "left_moves", "up_moves",
+                   "right_moves", "down_moves")
+
+
+def summarize(path):
+    """SUMMARY_COLUMNS of one history file as a dict, or None if it can't be read.
+    No-op moves are the moves that left the board unchanged."""
+    game = read_game(path)
+    if game is None or len(game[0]) == 0:
+        return None
+    boards, moves = game
+    final = bb.from_bitboards(boards[-1:])
+    score = 0
+    if len(boards) > 1:
+        _, _, scores = bl.move_batch(bb.from_bitboards(boards[:-1]), moves[:-1].astype(int))
+        score = int(scores.sum())
+    state = int(bl.game_states(final)[0])
+    # Encoded actions 0..3 are L, U, R, D
+    counts = [int((moves == action).sum()) for action in range(4)]
+    return dict(zip(SUMMARY_COLUMNS, [
+        len(boards) - 1,
+        int(final.max()),
+        score,
+        {1: "win", -1: "lose"}.get(state, "unfinished"),
+        int((boards[1:] == boards[:-1]).sum()),
+        *counts,
+    ]))
+
+
+class GameIndex():
+    """Metadata of the games of one history directory. Don't forget to call close() when done."""
+
+    def __init__(self, directory, index_filename=INDEX_FILENAME):
+        self.directory = directory
+        self.connection = sqlite3.connect(os.path.join(directory, index_filename))
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_VERSION:
+            # Written by another version: start over
+            self.connection.execute("DROP TABLE IF EXISTS games")
+            self.connection.execute("DROP TABLE IF EXISTS unreadable")
+            self.connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+    def update(self, progress=None, workers=1):
+        """Index new and changed files and forget deleted ones, reading them in workers processes.
+        Files that can't be read are remembered as unreadable (left out of every query) and only
+        read again once they change. progress, if given, is called with (done, total) while
+        files are read. Returns (indexed, removed) counts."""
+        known = {name: (size, mtime) for name, size, mtime in self.connection.execute(
+            "SELECT filename, size, mtime FROM games UNION ALL SELECT filename, size, mtime FROM unreadable")}
+        present = set()
+        changed = []
+        for name in history_files(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            present.add(name)
+            if known.get(name) != (stat.st_size, stat.st_mtime_ns):
+                changed.append((name, stat.st_size, stat.st_mtime_ns))
+
+        paths = [os.path.join(self.directory, name) for name, _, _ in changed]
+        pool = ProcessPoolExecutor(workers) if workers > 1 and len(paths) > 1 else None
+        summaries = map(summarize, paths) if pool is None else pool.map(summarize, paths, chunksize=64)
+        rows = []
+        unreadable = []
+        try:
+            for done, ((name, size, mtime), summary) in enumerate(zip(changed, summaries), 1):
+                if summary is None:
+                    unreadable.append((name, size, mtime))
+                else:
+                    rows.append((name, size, mtime, *(summary[column] for column in SUMMARY_COLUMNS)))
+                if progress is not None:
+                    progress(done, len(changed))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        removed = [(name,) for name in known if name not in present]
+        columns = ("filename", "size", "mtime") + SUMMARY_COLUMNS
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO games ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+            self.connection.executemany("DELETE FROM unreadable WHERE filename = ?", [row[:1] for row in rows])
+            self.connection.executemany("INSERT OR REPLACE INTO unreadable (filename, size, mtime) VALUES (?, ?, ?)",
+                                        unreadable)
+            self.connection.executemany("DELETE FROM games WHERE filename = ?", [row[:1] for row in unreadable])
+            self.connection.executemany("DELETE FROM games WHERE filename = ?", removed)
+            self.connection.executemany("DELETE FROM unreadable WHERE filename = ?", removed)
+        return len(rows), len(removed)
+
+    @staticmethod
+    def _where(name_contains=None, outcome=None, min_max_tile=None):
+        clauses, parameters = [], []
+        if name_contains:
+            clauses.append("instr(filename, ?) > 0")
+            parameters.append(name_contains)
+        if outcome is not None:
+            if outcome not in OUTCOMES:
+                raise ValueError(f"Unknown outcome {outcome!r}, expected one of {OUTCOMES}")
+            clauses.append("outcome = ?")
+            parameters.append(outcome)
+        if min_max_tile is not None:
+            clauses.append("max_tile >= ?")
+            parameters.append(int(min_max_tile))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), parameters
+
+    def count(self, **filters):
+        """Number of games matching the filters (see page)."""
+        where, parameters = self._where(**filters)
+        return self.connection.execute(f"SELECT COUNT(*) FROM games{where}", parameters).fetchone()[0]
+
+    def page(self, offset=0, limit=100, sort="filename", descending=False, **filters):
+        """limit rows of game metadata as dicts, starting at offset, in the given sort order.
+        Filters: name_contains (substring of the filename), outcome (one of OUTCOMES) and
+        min_max_tile."""
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort!r}, expected one of {SORT_COLUMNS}")
+        where, parameters = self._where(**filters)
+        order = f"{sort} {'DESC' if descending else 'ASC'}, filename"
+        cursor = self.connection.execute(
+            f"SELECT filename, moves, max_tile, score, outcome, mtime FROM games{where} ORDER BY {order} LIMIT ? OFFSET ?",
+            parameters + [limit, offset])
+        return [dict(zip(SORT_COLUMNS, row)) for row in cursor]
+
+    def rows(self, columns=("filename",) + SUMMARY_COLUMNS):
+        """Every indexed game as a tuple of the given columns."""
+        unknown = set(columns) - set(("filename", "size", "mtime") + SUMMARY_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown columns {sorted(unknown)}")
+        return self.connection.execute(f"SELECT {', '.join(columns)} FROM games ORDER BY filename").fetchall()
+
+    def close(self):
+        self.connection.close()
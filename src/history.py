@@ -1,35 +1,109 @@
 """Things that record the move history of the game for replay"""
+from collections import OrderedDict
 from datetime import datetime
+import mmap
 import os
+import queue
+import re
+import struct
+import threading
+from time import monotonic
 import numpy as np
-from logic import timer
+import bitboard as bb
+import constants as c
+import logic
+from metrics import timer
+
+
+TEXT_EXTENSION = ".txt"
+BINARY_EXTENSION = ".hist"
+
+# Sidecar of a text history: file size, mtime and the byte offset of every line
+INDEX_EXTENSION = ".idx"
+# Sidecar of a text history being written: its moves so far, removed on close
+MOVES_EXTENSION = ".moves"
+SEED_EXTENSION = ".seed"
+# Decoded boards kept per text history in read mode
+FRAME_CACHE_SIZE = 256
+
+# Binary format: header (magic, version, record size, reserved), then one record per board
+BINARY_MAGIC = b"2048HIST"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<8sHHI")
+# Nibble-packed board (see bitboard) and the ASCII code of the move that led to it, 0 for none
+BINARY_RECORD = struct.Struct("<QB")
+NO_MOVE = 0
+
+# Seed format: header (magic, version, spawn rule, seed), then one ASCII move byte per move
+SEED_MAGIC = b"2048SEED"
+SEED_VERSION = 1
+SEED_HEADER = struct.Struct("<8sHHQ")
+# Bumped whenever logic.new_game/add_two draw from the generator differently
+SPAWN_RULE = 2
+# Moves between two boards kept for seeking in a seed history
+KEYFRAME_INTERVAL = 64
+
+# Moves are saved as L/U/R/D; the human player saves the names of the keys it got
+KEY_TO_MOVE = {
+    c.KEY_UP: "U", c.KEY_UP_ALT1: "U", c.KEY_UP_ALT2: "U",
+    c.KEY_DOWN: "D", c.KEY_DOWN_ALT1: "D", c.KEY_DOWN_ALT2: "D",
+    c.KEY_LEFT: "L", c.KEY_LEFT_ALT1: "L", c.KEY_LEFT_ALT2: "L",
+    c.KEY_RIGHT: "R", c.KEY_RIGHT_ALT1: "R", c.KEY_RIGHT_ALT2: "R",
+}
+# One move of a moves line: a key name (longest first, so "Down" isn't read as "D"), L/U/R/D or
+# any other character
+_MOVE_TOKEN = re.compile("|".join(re.escape(key) for key in sorted(KEY_TO_MOVE, key=len, reverse=True)) + "|.",
+                         re.DOTALL)
+
+
+def normalize_moves(line):
+    """Moves line of a text history as L/U/R/D. Text histories used to store the key names the
+    human player got, without separators (e.g. "UpLeftw"); those are split back into moves."""
+    return "".join(KEY_TO_MOVE.get(token, token) for token in _MOVE_TOKEN.findall(line))
+
+
+def resolve_filename(filename, dir, extension):
+    """Full path of a history file. If no filename is given, use the current date and time."""
+    if filename is None:
+        filename = "history_" + History.date_filename()
+    if not filename.endswith(extension):
+        filename = filename + extension
+    if dir is not None:
+        filename = os.path.join(dir, filename)
+    return os.path.join(os.getcwd(), filename)
 
 
 class History():
     """File handling and writing down the moves and board states. Don't forget to call close() when done."""
 
     @timer
-    def __init__(self, mode, filename=None, dir=None):
-        """Create a file with the given filename. If no filename is given, use the current date and time."""
+    def __init__(self, mode, filename=None, dir=None, use_index_file=False, checkpoint_moves=False):
+        """Create a file with the given filename. If no filename is given, use the current date and time.
+        In read mode the byte offset of every line is found by scanning the file once. With
+        use_index_file, the offsets are loaded from a sidecar index file, or saved there after the
+        scan: worth it for readers that reopen the same files, like the replay viewer.
+        With checkpoint_moves, every flush() also appends the new moves to a sidecar file, so a game
+        that was never closed (e.g. after a crash) can still be read."""
         if mode not in ["r", "w"]:
             raise ValueError("Mode must be 'r' or 'w'")
         self.mode = mode
-        if filename is None:
-            filename = "history_" + self.date_filename()
-        if not filename.endswith(".txt"):
-            self.filename = filename + ".txt"
-        else:
-            self.filename = filename
-        if dir is not None:
-            self.filename = dir + "\\" + self.filename
-        self.filename = os.path.join(os.getcwd(), self.filename)
-        
+        self.filename = resolve_filename(filename, dir, TEXT_EXTENSION)
+        self.moves_filename = self.filename + MOVES_EXTENSION
+
         # Reading
         if mode == "r":
-            self.file = open(self.filename, "r")
-            self.moves = list(self.readMoves())
-            self.file.seek(0)
-            self.n_of_matrices = sum(1 for line in self.file.readlines()) - 1
+            self.file = open(self.filename, "rb")
+            self.offsets = self._line_offsets(use_index_file)
+            self.frames = OrderedDict()
+            # A moves checkpoint is only left behind by a game that wasn't closed: every line is a board
+            self.recovered = os.path.exists(self.moves_filename)
+            if self.recovered:
+                with open(self.moves_filename) as f:
+                    self.moves = list(normalize_moves(f.read()))
+                self.n_of_matrices = min(self._complete_lines(), len(self.moves) + 1)
+            else:
+                self.moves = list(self.readMoves())
+                self.n_of_matrices = len(self.offsets) - 2
             self.number_of_moves = len(self.moves)
             return
         # Writing
@@ -41,6 +115,8 @@ class History():
         self.n_of_matrices = 0
         self.number_of_moves = 0
         self.file = open(self.filename, "x")
+        self.moves_file = open(self.moves_filename, "w") if checkpoint_moves else None
+        self.checkpointed_moves = 0
     
     @timer
     def saveMatrix(self, matrix):
@@ -48,8 +124,8 @@ class History():
         # print(f"SaveMatrix: {str(matrix)}")
         if self.mode == "r":
             raise ValueError("Cannot save matrix in read mode")
-        matrix = np.matrix.flatten(matrix)
-        str_matrix = str(matrix).replace("[", "").replace("]", "").replace(",", "")
+        # One line per board; str() of an array wraps long rows over several lines
+        str_matrix = " ".join(str(num) for num in np.ravel(matrix).tolist())
         # print(f"StrMatrix: {str_matrix}")
         self.file.write(str_matrix + "\n")
         self.n_of_matrices += 1
@@ -62,38 +138,110 @@ class History():
         if index >= self.n_of_matrices:
             print(f"Number of matrices out of range: {index} out of {self.n_of_matrices}")
             return None
-        self.file.seek(0)
-        lines = self.file.readlines()
-        # Get the matrix at the given index
-        str_matrix = lines[index]
+        matrix = self.frames.get(index)
+        if matrix is not None:
+            self.frames.move_to_end(index)
+            return matrix.copy()
+        str_matrix = self._read_line(index)
         matrix = [int(num) for num in str_matrix.split()]
         # Convert to a 4x4 matrix
-        # print(f"Matrix: {str(matrix)}")
         matrix = np.array(matrix).reshape(4, 4)
-        return matrix
+        self.frames[index] = matrix
+        if len(self.frames) > FRAME_CACHE_SIZE:
+            self.frames.popitem(last=False)
+        return matrix.copy()
+
+    def _complete_lines(self):
+        """Number of lines ending with a newline; a crash may have cut the last one short."""
+        size = int(self.offsets[-1])
+        if size == 0:
+            return 0
+        self.file.seek(size - 1)
+        complete = self.file.read(1) == b"\n"
+        return len(self.offsets) - 1 - (not complete)
+
+    def _read_line(self, index):
+        """Line at the given index, without its newline."""
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        self.file.seek(start)
+        return self.file.read(end - start).decode().rstrip("\r\n")
+
+    def _line_offsets(self, use_index_file):
+        """Start offset of every line followed by the file size, from the sidecar index if it is up to date."""
+        stat = os.stat(self.filename)
+        index_filename = self.filename + INDEX_EXTENSION
+        if use_index_file and os.path.exists(index_filename):
+            try:
+                index = np.load(index_filename)
+                if index[0] == stat.st_size and index[1] == stat.st_mtime_ns:
+                    return index[2:]
+            except (OSError, ValueError):
+                pass
+        offsets = self._build_offsets(stat.st_size)
+        if use_index_file:
+            try:
+                with open(index_filename, "wb") as f:
+                    np.save(f, np.concatenate([[stat.st_size, stat.st_mtime_ns], offsets]).astype(np.int64))
+            except OSError:
+                pass
+        return offsets
+
+    def _build_offsets(self, size, chunk_size=1 << 20):
+        """Scan the file once for newlines."""
+        starts = [np.zeros(1, dtype=np.int64)]
+        self.file.seek(0)
+        position = 0
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                break
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+            starts.append(newlines.astype(np.int64) + position + 1)
+            position += len(chunk)
+        starts = np.concatenate(starts)
+        # A newline at the very end doesn't start another line
+        if starts[-1] == size:
+            starts = starts[:-1]
+        return np.append(starts, size)
     
     @timer
     def saveMove(self, move):
         """Add move to the list of moves. List will be save at the end."""
         if self.mode == "r":
             raise ValueError("Cannot save move in read mode")
-        self.moves.append(move)
+        # One character per move, so the moves line can be read back move by move
+        self.moves.append(KEY_TO_MOVE.get(move, move))
         self.number_of_moves += 1
 
     def readMoves(self):
-        """Static. Read the moves from the file."""
+        """Static. Read the moves from the file, as a string of L/U/R/D."""
         if self.mode == "w":
             raise ValueError("Cannot read moves in write mode")
+        if self.recovered:
+            return "".join(self.moves)
         # Moves are saved in the last line of the file
-        self.file.seek(0)
-        lines = self.file.readlines()
-        assert len(lines) > 0, f"No moves found in the file {self.filename}"
-        return lines[-1]
-        
+        assert len(self.offsets) > 1, f"No moves found in the file {self.filename}"
+        return normalize_moves(self._read_line(len(self.offsets) - 2))
+
+    def flush(self):
+        """Push the boards written so far to disk, and the new moves to the checkpoint if there is one."""
+        self.file.flush()
+        if self.moves_file is not None:
+            self.moves_file.write("".join(self.moves[self.checkpointed_moves:]))
+            self.moves_file.flush()
+            self.checkpointed_moves = len(self.moves)
+
     def close(self):
         """Close the file"""
         # Write the moves to the file
-        self.file.write("".join(self.moves))
+        if self.mode == "w":
+            self.file.write("".join(self.moves))
+            if self.moves_file is not None:
+                # The moves line is complete only once the file is closed
+                self.file.close()
+                self.moves_file.close()
+                os.remove(self.moves_filename)
+                return
         self.file.close()
 
     @staticmethod
@@ -104,6 +252,420 @@ class History():
         return datetime_string
 
 
+
+class BinaryHistory():
+    """Same API as History, in a compact binary format: a small header followed by one fixed-size
+    record per board, 9 bytes against about 35 for a line of a text history. Written append-only
+    and read through mmap, so loading any frame is O(1). Don't forget to call close() when done."""
+
+    @timer
+    def __init__(self, mode, filename=None, dir=None):
+        """Create a file with the given filename. If no filename is given, use the current date and time."""
+        if mode not in ["r", "w"]:
+            raise ValueError("Mode must be 'r' or 'w'")
+        self.mode = mode
+        self.filename = resolve_filename(filename, dir, BINARY_EXTENSION)
+
+        # Reading
+        if mode == "r":
+            self.file = open(self.filename, "rb")
+            size = os.fstat(self.file.fileno()).st_size
+            # A game that crashed before its first flush leaves an empty file: no boards, and
+            # nothing mmap could map
+            self.map = None
+            self.n_of_matrices = 0
+            if size > 0:
+                if size < BINARY_HEADER.size:
+                    self.file.close()
+                    raise ValueError(f"{self.filename} is not a binary history file")
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, record_size, _ = BINARY_HEADER.unpack_from(self.map, 0)
+                if magic != BINARY_MAGIC or record_size != BINARY_RECORD.size:
+                    self.close()
+                    raise ValueError(f"{self.filename} is not a binary history file")
+                if version != BINARY_VERSION:
+                    self.close()
+                    raise ValueError(f"Unsupported binary history version {version} in {self.filename}")
+                self.n_of_matrices = (size - BINARY_HEADER.size) // BINARY_RECORD.size
+            self.moves = self.readMoves()
+            self.number_of_moves = len(self.moves)
+            return
+        # Writing
+        if os.path.exists(self.filename):
+            print(f"File {self.filename} already exists. Overwriting.")
+            os.remove(self.filename)
+        self.moves = []
+        self.n_of_matrices = 0
+        self.number_of_moves = 0
+        self.file = open(self.filename, "xb")
+        self.file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_RECORD.size, 0))
+        # Board waiting for the move that led to it
+        self.pending = None
+
+    @timer
+    def saveMatrix(self, matrix):
+        """Save the matrix to the file"""
+        if self.mode == "r":
+            raise ValueError("Cannot save matrix in read mode")
+        self._write_pending(NO_MOVE)
+        self.pending = bb.to_bitboard(matrix)
+        self.n_of_matrices += 1
+
+    @timer
+    def saveMove(self, move):
+        """Save the move that led to the last saved matrix."""
+        if self.mode == "r":
+            raise ValueError("Cannot save move in read mode")
+        move = KEY_TO_MOVE.get(move, move)
+        if len(move) != 1:
+            raise ValueError(f"Cannot save move {move!r}, expected one of L, U, R, D")
+        self.moves.append(move)
+        self.number_of_moves += 1
+        self._write_pending(ord(move))
+
+    def _write_pending(self, move_code):
+        if self.pending is not None:
+            self.file.write(BINARY_RECORD.pack(self.pending, move_code))
+            self.pending = None
+
+    def flush(self):
+        """Push the records written so far to disk. The last board waits for its move."""
+        self.file.flush()
+
+    @timer
+    def loadMatrix(self, index):
+        """Load the matrix at the given index, O(1)."""
+        if self.mode == "w":
+            raise ValueError("Cannot load matrix in write mode")
+        if index >= self.n_of_matrices:
+            print(f"Number of matrices out of range: {index} out of {self.n_of_matrices}")
+            return None
+        board, _ = BINARY_RECORD.unpack_from(self.map, BINARY_HEADER.size + index * BINARY_RECORD.size)
+        return bb.from_bitboard(board)
+
+    def readMoves(self):
+        """Read the moves from the file. Boards saved without a move are skipped."""
+        if self.mode == "w":
+            raise ValueError("Cannot read moves in write mode")
+        if self.n_of_matrices == 0:
+            return []
+        records = np.frombuffer(self.map, dtype=np.uint8, offset=BINARY_HEADER.size,
+                                count=self.n_of_matrices * BINARY_RECORD.size)
+        codes = records.reshape(-1, BINARY_RECORD.size)[:, -1]
+        return [chr(code) for code in codes.tolist() if code != NO_MOVE]
+
+    def close(self):
+        """Close the file"""
+        if self.mode == "w":
+            self._write_pending(NO_MOVE)
+        elif self.map is not None:
+            self.map.close()
+        self.file.close()
+
+
+class SeedHistory():
+    """Same API as History, storing only the RNG seed of the game and its moves. Boards are
+    rebuilt on demand by replaying the moves, from the nearest keyframe kept every
+    KEYFRAME_INTERVAL moves. Don't forget to call close() when done.
+
+    For the boards to be reproducible the game has to be played with new_game() and
+    self.rng for every spawn, and spawn a tile only after moves that changed the board."""
+
+    @timer
+    def __init__(self, mode, filename=None, dir=None, seed=None):
+        """Create a file with the given filename. If no filename is given, use the current date and time.
+        In write mode a random seed is picked unless one is given."""
+        if mode not in ["r", "w"]:
+            raise ValueError("Mode must be 'r' or 'w'")
+        self.mode = mode
+        self.filename = resolve_filename(filename, dir, SEED_EXTENSION)
+
+        # Reading
+        if mode == "r":
+            with open(self.filename, "rb") as f:
+                data = f.read()
+            magic, version, spawn_rule, self.seed = SEED_HEADER.unpack_from(data, 0)
+            if magic != SEED_MAGIC:
+                raise ValueError(f"{self.filename} is not a seed history file")
+            if version != SEED_VERSION or spawn_rule != SPAWN_RULE:
+                raise ValueError(f"{self.filename} was written by an incompatible version ({version}, rule {spawn_rule})")
+            self.moves = [chr(code) for code in data[SEED_HEADER.size:]]
+            self.number_of_moves = len(self.moves)
+            self.n_of_matrices = self.number_of_moves + 1
+            self.rng = np.random.default_rng(self.seed)
+            board = bb.to_bitboard(logic.new_game(4, self.rng))
+            # index -> (packed board, generator state right after it)
+            self.keyframes = {0: (board, self.rng.bit_generator.state)}
+            self.cursor = 0
+            self.board = board
+            return
+        # Writing
+        if os.path.exists(self.filename):
+            print(f"File {self.filename} already exists. Overwriting.")
+            os.remove(self.filename)
+        self.seed = int(np.random.SeedSequence().entropy % 2**64) if seed is None else seed
+        self.rng = np.random.default_rng(self.seed)
+        self.moves = []
+        self.n_of_matrices = 0
+        self.number_of_moves = 0
+        self.file = open(self.filename, "xb")
+        self.file.write(SEED_HEADER.pack(SEED_MAGIC, SEED_VERSION, SPAWN_RULE, self.seed))
+
+    def new_game(self):
+        """Initial board of this game, drawn from self.rng."""
+        return logic.new_game(4, self.rng)
+
+    @timer
+    def saveMatrix(self, matrix):
+        """Only counted: boards follow from the seed and the moves."""
+        if self.mode == "r":
+            raise ValueError("Cannot save matrix in read mode")
+        self.n_of_matrices += 1
+
+    @timer
+    def saveMove(self, move):
+        """Append the move to the file."""
+        if self.mode == "r":
+            raise ValueError("Cannot save move in read mode")
+        move = KEY_TO_MOVE.get(move, move)
+        if move not in "LURD" or len(move) != 1:
+            raise ValueError(f"Cannot save move {move!r}, expected one of L, U, R, D")
+        self.file.write(move.encode())
+        self.moves.append(move)
+        self.number_of_moves += 1
+
+    @timer
+    def loadMatrix(self, index):
+        """Rebuild the matrix at the given index from the nearest earlier keyframe."""
+        if self.mode == "w":
+            raise ValueError("Cannot load matrix in write mode")
+        if index >= self.n_of_matrices:
+            print(f"Number of matrices out of range: {index} out of {self.n_of_matrices}")
+            return None
+        if not self.cursor <= index < self.cursor + KEYFRAME_INTERVAL:
+            start = max(k for k in range(0, index + 1, KEYFRAME_INTERVAL) if k in self.keyframes)
+            if not start <= self.cursor <= index:
+                self.board, state = self.keyframes[start]
+                self.rng.bit_generator.state = state
+                self.cursor = start
+        while self.cursor < index:
+            self._step()
+        return bb.from_bitboard(self.board)
+
+    def _step(self):
+        """Replay the move after the cursor, spawning a tile if it changed the board."""
+        new, _ = bb.move(self.board, "LURD".index(self.moves[self.cursor]))
+        if new != self.board:
+            new = bb.to_bitboard(logic.add_two(bb.from_bitboard(new), self.rng))
+        self.board = new
+        self.cursor += 1
+        if self.cursor % KEYFRAME_INTERVAL == 0 and self.cursor not in self.keyframes:
+            self.keyframes[self.cursor] = (self.board, self.rng.bit_generator.state)
+
+    def flush(self):
+        """Push the moves written so far to disk."""
+        self.file.flush()
+
+    def readMoves(self):
+        """The moves, as read when the file was opened."""
+        if self.mode == "w":
+            raise ValueError("Cannot read moves in write mode")
+        return "".join(self.moves)
+
+    def close(self):
+        """Close the file"""
+        if self.mode == "w":
+            self.file.close()
+
+
+# Queue entry telling the writer thread to finish, or, as operation, to close one history
+_CLOSE = object()
+# Operation flushing one history right away
+_FLUSH = object()
+
+
+class HistoryWriter():
+    """Background thread writing the records of any number of AsyncHistory wrappers, so a
+    VecEnv needs one thread for all its games. Histories with written records are flushed to
+    disk once flush_size records are waiting or the oldest of them is flush_interval seconds
+    old, whichever comes first. Don't forget to call close() when done."""
+
+    def __init__(self, flush_interval=1.0, flush_size=256, name="history-writer"):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.error = None
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def put(self, history, operation, value=None):
+        """Queue operation(value) on the wrapped history (or _FLUSH / _CLOSE of it).
+        Raises the first error the writer thread ran into, if any."""
+        if self.error is not None:
+            raise self.error
+        self.queue.put((history, operation, value))
+
+    def _run(self):
+        """Writer thread: write records as they come, flush whenever enough are waiting or the
+        oldest has waited long enough."""
+        # Histories with unflushed records, in order of their first one
+        dirty = {}
+        pending = 0
+        first_pending = monotonic()
+        while True:
+            if pending:
+                # Wake up in time to flush what is waiting
+                try:
+                    record = self.queue.get(timeout=max(0.0, first_pending + self.flush_interval - monotonic()))
+                except queue.Empty:
+                    record = None
+            else:
+                # Nothing to flush: sleep until the next record
+                record = self.queue.get()
+            if record is _CLOSE:
+                for history in dirty:
+                    self._call(history.flush)
+                return
+            if record is not None:
+                history, operation, value = record
+                if operation is _CLOSE:
+                    dirty.pop(history, None)
+                    self._call(history.close)
+                elif operation is _FLUSH:
+                    dirty.pop(history, None)
+                    self._call(history.flush)
+                    value.set()
+                else:
+                    self._call(operation, value)
+                    if not pending:
+                        first_pending = monotonic()
+                    dirty[history] = None
+                    pending += 1
+            if pending and (pending >= self.flush_size or monotonic() - first_pending >= self.flush_interval):
+                for history in dirty:
+                    self._call(history.flush)
+                dirty.clear()
+                pending = 0
+
+    def _call(self, function, *args):
+        # After an error nothing is written anymore, the error is raised on the next put or close
+        if self.error is None:
+            try:
+                function(*args)
+            except Exception as error:
+                self.error = error
+
+    def close(self):
+        """Write and flush everything queued so far and stop the thread.
+        Raises the first error the writer thread ran into, if any."""
+        self.queue.put(_CLOSE)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class AsyncHistory():
+    """Write-only wrapper around a History, BinaryHistory or SeedHistory in write mode.
+    saveMatrix and saveMove only queue a record; a HistoryWriter thread writes the records to
+    the wrapped history and flushes it to disk (see HistoryWriter). Without a shared writer,
+    the history gets a writer of its own. Don't forget to call close() when done.
+
+    Wrap a History created with checkpoint_moves=True, so the moves are flushed along with the
+    boards and a game interrupted by a crash is readable up to its last flush."""
+
+    def __init__(self, history, flush_interval=1.0, flush_size=256, writer=None):
+        if history.mode != "w":
+            raise ValueError("Only histories in write mode can be written in the background")
+        self.history = history
+        self.mode = "w"
+        self.filename = history.filename
+        self.n_of_matrices = history.n_of_matrices
+        self.number_of_moves = history.number_of_moves
+        self.owns_writer = writer is None
+        if writer is None:
+            writer = HistoryWriter(flush_interval, flush_size,
+                                   name=f"history-writer {os.path.basename(self.filename)}")
+        self.writer = writer
+
+    @property
+    def rng(self):
+        """Generator of a wrapped SeedHistory, to play the game with."""
+        return self.history.rng
+
+    def new_game(self):
+        return self.history.new_game()
+
+    @timer
+    def saveMatrix(self, matrix):
+        """Queue a copy of the matrix: the caller may keep changing its board in place."""
+        self.writer.put(self.history, self.history.saveMatrix, np.array(matrix))
+        self.n_of_matrices += 1
+
+    @timer
+    def saveMove(self, move):
+        """Queue the move."""
+        self.writer.put(self.history, self.history.saveMove, move)
+        self.number_of_moves += 1
+
+    def flush(self):
+        """Wait until everything queued so far is written and flushed."""
+        done = threading.Event()
+        self.writer.put(self.history, _FLUSH, done)
+        while not done.wait(0.1):
+            if self.writer.error is not None:
+                raise self.writer.error
+
+    def close(self):
+        """Queue closing the wrapped history. With a writer of its own, also wait for it to
+        write everything and stop; a shared writer closes the history in the background.
+        Raises the first error the writer thread ran into, if any."""
+        try:
+            self.writer.put(self.history, _CLOSE)
+        finally:
+            if self.owns_writer:
+                self.writer.close()
+
+
+def open_history(mode, filename=None, dir=None, seed=None, background=False, writer=None, use_index_file=False):
+    """History, BinaryHistory or SeedHistory, depending on the extension of filename (text by default).
+    seed is only used by seed histories in write mode, use_index_file only by text histories in
+    read mode (see History). With background, a writer is wrapped in an AsyncHistory (text
+    histories then checkpoint their moves), written by writer if given, a HistoryWriter shared
+    with other histories."""
+    if filename is not None and filename.endswith(BINARY_EXTENSION):
+        history = BinaryHistory(mode, filename=filename, dir=dir)
+    elif filename is not None and filename.endswith(SEED_EXTENSION):
+        history = SeedHistory(mode, filename=filename, dir=dir, seed=seed)
+    else:
+        history = History(mode, filename=filename, dir=dir, use_index_file=use_index_file,
+                          checkpoint_moves=background and mode == "w")
+    if background and mode == "w":
+        return AsyncHistory(history, writer=writer)
+    return history
+
+
+def convert_history(source, destination):
+    """Copy a history file into the other format, picked by the extension of each path.
+    Seed histories can only be converted from, their seed can't be recovered from the boards."""
+    if destination.endswith(SEED_EXTENSION):
+        raise ValueError("Cannot convert to a seed history")
+    reader = open_history("r", filename=source)
+    writer = open_history("w", filename=destination)
+    moves = reader.moves
+    # Text files of the human player hold key names, so moves only map to boards when the counts match
+    moves_match = len(moves) == reader.n_of_matrices - 1
+    for index in range(reader.n_of_matrices):
+        writer.saveMatrix(reader.loadMatrix(index))
+        if index > 0 and moves_match:
+            writer.saveMove(moves[index - 1])
+    if not moves_match and isinstance(writer, History):
+        for move in moves:
+            writer.saveMove(move)
+    writer.close()
+    reader.close()
+    return writer.filename
+
+
 if __name__ == "__main__":
     # Testing
     matrix = [[2, 4, 8, 16], [32, 64, 128, 256], [512, 1024, 2048, 2], [4, 8, 16, 32]]
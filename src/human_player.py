@@ -1,15 +1,16 @@
 from tkinter import Frame, Label, CENTER
 import random
 import logic
+import bitboard
 import constants as c
-from history import History
+from history import open_history
 
 def gen():
     return random.randint(0, c.GRID_LEN - 1)
 
 class GameGrid(Frame):
     def __init__(self):
-        self.history = History("w", dir="history")
+        self.history = open_history("w", dir="history", background=True)
 
         Frame.__init__(self)
 
@@ -19,18 +20,18 @@ class GameGrid(Frame):
         self.master.protocol('WM_DELETE_WINDOW', self.on_closing)
 
         self.commands = {
-            c.KEY_UP: logic.up,
-            c.KEY_DOWN: logic.down,
-            c.KEY_LEFT: logic.left,
-            c.KEY_RIGHT: logic.right,
-            c.KEY_UP_ALT1: logic.up,
-            c.KEY_DOWN_ALT1: logic.down,
-            c.KEY_LEFT_ALT1: logic.left,
-            c.KEY_RIGHT_ALT1: logic.right,
-            c.KEY_UP_ALT2: logic.up,
-            c.KEY_DOWN_ALT2: logic.down,
-            c.KEY_LEFT_ALT2: logic.left,
-            c.KEY_RIGHT_ALT2: logic.right,
+            c.KEY_UP: bitboard.up,
+            c.KEY_DOWN: bitboard.down,
+            c.KEY_LEFT: bitboard.left,
+            c.KEY_RIGHT: bitboard.right,
+            c.KEY_UP_ALT1: bitboard.up,
+            c.KEY_DOWN_ALT1: bitboard.down,
+            c.KEY_LEFT_ALT1: bitboard.left,
+            c.KEY_RIGHT_ALT1: bitboard.right,
+            c.KEY_UP_ALT2: bitboard.up,
+            c.KEY_DOWN_ALT2: bitboard.down,
+            c.KEY_LEFT_ALT2: bitboard.left,
+            c.KEY_RIGHT_ALT2: bitboard.right,
         }
 
         self.grid_cells = []
@@ -122,4 +123,5 @@ class GameGrid(Frame):
         self.history.close()
         self.master.destroy()
 
-game_grid = GameGrid()
\ No newline at end of file
+if __name__ == "__main__":
+    game_grid = GameGrid()
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""Inference cache: model outputs keyed by board content, so the same board is never sent
+through the network twice while the weights stay the same."""
+import numpy as np
+import symmetry
+
+
+class InferenceCache():
+    """Wraps a batched predict function (boards -> one row of outputs per board).
+    Only the boards that aren't cached yet are predicted, in a single call.
+    Call clear() whenever the weights change, at the latest after every fit.
+
+    With symmetric=True, boards are keyed by their canonical orientation, so all 8 rotations
+    and reflections of a board share one entry. The outputs must then be one value per
+    encoded action: they are predicted for the canonical board and remapped to each board's
+    own orientation."""
+
+    def __init__(self, predict, symmetric=False):
+        self.predict_fn = predict
+        self.symmetric = symmetric
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.forward_passes = 0
+
+    @staticmethod
+    def _normalize(boards):
+        # Same dtype everywhere, so equal boards always give equal keys
+        return np.ascontiguousarray(boards, dtype=np.int32).reshape(-1, 4, 4)
+
+    def _fill(self, boards):
+        """Predict the boards that aren't cached yet. Returns their keys and how many were missing."""
+        keys = [board.tobytes() for board in boards]
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in self.cache and key not in missing:
+                missing[key] = i
+        if missing:
+            outputs = self.predict_fn(boards[list(missing.values())])
+            self.forward_passes += 1
+            self.misses += len(missing)
+            for key, output in zip(missing, outputs):
+                self.cache[key] = output
+        return keys, len(missing)
+
+    def predict(self, boards):
+        """Outputs for every board, stacked in the same order."""
+        boards = self._normalize(boards)
+        if self.symmetric:
+            boards, transforms = symmetry.canonicalize(boards)
+        keys, n_missing = self._fill(boards)
+        self.hits += len(keys) - n_missing
+        outputs = np.stack([self.cache[key] for key in keys])
+        if self.symmetric:
+            # Output for action a of a board is the canonical board's output for the same move
+            outputs = np.take_along_axis(outputs, symmetry.ACTIONS[transforms].astype(np.intp), axis=1)
+        return outputs
+
+    def prefetch(self, boards):
+        """Predict boards that will be asked for later in the step, in the same forward pass.
+        Only the later lookups count as hits."""
+        boards = self._normalize(boards)
+        if self.symmetric:
+            boards = symmetry.canonicalize(boards)[0]
+        self._fill(boards)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "forward_passes": self.forward_passes,
+        }
@@ -1,33 +1,29 @@
-import random
 import constants as c
 import numpy as np
-from time import perf_counter_ns
+from metrics import timer
 
-# timer decorator
-def timer(func):
-    def wrapper(*args, **kwargs):
-        start = perf_counter_ns()
-        result = func(*args, **kwargs)
-        end = perf_counter_ns()
-        print(f"{func.__name__.upper():<9} took {(end-start):<7} ns == {(end-start)/1_000_000:.8f} ms")
-        return result
-    return wrapper
 
+# Used when no per-game generator is given
+_rng = np.random.default_rng()
 
-def new_game(n):
+
+def new_game(n, rng=None):
     matrix = np.zeros((n, n), dtype=int)
-    matrix = add_two(matrix)
-    matrix = add_two(matrix)
+    matrix = add_two(matrix, rng)
+    matrix = add_two(matrix, rng)
     return matrix
 
 
-def add_two(mat):
-    a = random.randint(0, len(mat)-1)
-    b = random.randint(0, len(mat)-1)
-    while mat[a][b] != 0:
-        a = random.randint(0, len(mat)-1)
-        b = random.randint(0, len(mat)-1)
-    mat[a][b] = 2
+def add_two(mat, rng=None, four_probability=c.FOUR_PROBABILITY):
+    """Put a new tile on a random empty cell: a 4 with probability four_probability, else a 2.
+    The cell is drawn straight from the empty ones, so the cost doesn't depend on how full the
+    board is. Pass a numpy.random.Generator per game as rng to make its spawns reproducible."""
+    rng = _rng if rng is None else rng
+    empty = np.flatnonzero(np.asarray(mat) == 0)
+    if len(empty) == 0:
+        return mat
+    a, b = divmod(int(empty[rng.integers(len(empty))]), len(mat[0]))
+    mat[a][b] = 4 if rng.random() < four_probability else 2
     return mat
 
 
@@ -106,7 +102,6 @@ def merge(mat, done):
 
 @timer
 def up(game):
-    print("up")
     # return matrix after shifting up
     game = transpose(game)
     game, done = cover_up(game)
@@ -117,7 +112,6 @@ def up(game):
 
 @timer
 def down(game):
-    print("down")
     # return matrix after shifting down
     game = reverse(transpose(game))
     game, done = cover_up(game)
@@ -128,7 +122,6 @@ def down(game):
 
 @timer
 def left(game):
-    print("left")
     # return matrix after shifting left
     game, done = cover_up(game)
     game, done = merge(game, done)
@@ -137,7 +130,6 @@ def left(game):
 
 @timer
 def right(game):
-    print("right")
     # return matrix after shifting right
     game = reverse(game)
     game, done = cover_up(game)
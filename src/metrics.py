@@ -0,0 +1,199 @@
+"""In-memory instrumentation. Functions decorated with @timer keep call counts, totals and
+latency histograms here instead of printing a line per call.
+
+Collection is off by default (or on with METRICS=1 in the environment) and can be switched
+at runtime with enable()/disable(). While it is off a timed call costs one flag check.
+"""
+import csv
+import functools
+import json
+import os
+import sys
+import threading
+from time import perf_counter_ns
+
+
+enabled = os.environ.get("METRICS", "0") == "1"
+
+# Latency histogram: exact buckets below 16 ns, then 8 buckets per power of two
+EXACT_BUCKETS = 16
+BUCKETS_PER_OCTAVE = 8
+N_BUCKETS = EXACT_BUCKETS + BUCKETS_PER_OCTAVE * 60
+
+_registry = {}
+# Guards the registry and the counters of every stat in it: histories written in a background
+# thread record their calls while the main thread records its own and reports
+_registry_lock = threading.Lock()
+
+
+class Stat():
+    """Counters and latency histogram of one timed function."""
+    __slots__ = ("name", "count", "total", "min", "max", "buckets")
+
+    def __init__(self, name):
+        self.name = name
+        self._clear()
+
+    def _clear(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.buckets = [0] * N_BUCKETS
+
+    def reset(self):
+        with _registry_lock:
+            self._clear()
+
+    def add(self, ns):
+        bucket = _bucket(ns)
+        with _registry_lock:
+            self.count += 1
+            self.total += ns
+            if self.min is None or ns < self.min:
+                self.min = ns
+            if ns > self.max:
+                self.max = ns
+            self.buckets[bucket] += 1
+
+    def percentile(self, q):
+        """Approximate q-th percentile (0-100) in ns, accurate to about 6%."""
+        if self.count == 0:
+            return 0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(max(_bucket_middle(index), self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """Dict of the numbers worth reporting, times in ns."""
+        with _registry_lock:
+            return self._summary()
+
+    def _summary(self):
+        return {
+            "name": self.name,
+            "count": self.count,
+            "total_ns": self.total,
+            "mean_ns": self.total / self.count if self.count else 0,
+            "min_ns": self.min or 0,
+            "max_ns": self.max,
+            "p50_ns": self.percentile(50),
+            "p95_ns": self.percentile(95),
+            "p99_ns": self.percentile(99),
+        }
+
+
+def _bucket(ns):
+    if ns < EXACT_BUCKETS:
+        return max(ns, 0)
+    bits = ns.bit_length()
+    index = EXACT_BUCKETS + (bits - 5) * BUCKETS_PER_OCTAVE + ((ns >> (bits - 4)) & 7)
+    return min(index, N_BUCKETS - 1)
+
+
+def _bucket_middle(index):
+    if index < EXACT_BUCKETS:
+        return index
+    octave, sub = divmod(index - EXACT_BUCKETS, BUCKETS_PER_OCTAVE)
+    shift = octave + 1
+    return ((8 + sub) << shift) + (1 << (shift - 1))
+
+
+def get(name):
+    """Stat registered under name, created on first use."""
+    stat = _registry.get(name)
+    if stat is None:
+        with _registry_lock:
+            stat = _registry.setdefault(name, Stat(name))
+    return stat
+
+
+def record(name, ns):
+    """Record one duration for name by hand, for code that isn't a single function call."""
+    if enabled:
+        get(name).add(ns)
+
+
+def timer(func=None, name=None):
+    """Decorator recording the duration of every call while metrics are enabled, under the
+    qualified name of the function or under name: @timer(name="bitboard.left")."""
+    if func is None:
+        return functools.partial(timer, name=name)
+    stat = get(name or getattr(func, "__qualname__", func.__name__))
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        start = perf_counter_ns()
+        result = func(*args, **kwargs)
+        stat.add(perf_counter_ns() - start)
+        return result
+    return wrapper
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Zero every registered stat."""
+    for stat in list(_registry.values()):
+        stat.reset()
+
+
+def stats():
+    """Summaries of every stat that has been called at least once, busiest first."""
+    with _registry_lock:
+        summaries = [s._summary() for s in _registry.values() if s.count]
+    return sorted(summaries, key=lambda s: s["total_ns"], reverse=True)
+
+
+def summary():
+    """Human-readable table of stats(), times in ms."""
+    lines = [f"{'NAME':<32} {'CALLS':>9} {'TOTAL ms':>11} {'MEAN ms':>10} {'P50 ms':>10} {'P95 ms':>10} {'P99 ms':>10}"]
+    for s in stats():
+        lines.append(
+            f"{s['name']:<32} {s['count']:>9} {s['total_ns']/1e6:>11.3f} {s['mean_ns']/1e6:>10.4f} "
+            f"{s['p50_ns']/1e6:>10.4f} {s['p95_ns']/1e6:>10.4f} {s['p99_ns']/1e6:>10.4f}"
+        )
+    return "\n".join(lines)
+
+
+def print_summary(file=None):
+    print(summary(), file=file or sys.stdout)
+
+
+def to_json(path):
+    with open(path, "w") as f:
+        json.dump(stats(), f, indent=2)
+
+
+def to_csv(path):
+    rows = stats()
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(Stat("").summary().keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def start_reporter(interval, file=None):
+    """Print summary() every interval seconds from a daemon thread. Returns an Event, set it to stop."""
+    stop = threading.Event()
+
+    def report():
+        while not stop.wait(interval):
+            if enabled:
+                print_summary(file)
+    threading.Thread(target=report, name="metrics-reporter", daemon=True).start()
+    return stop
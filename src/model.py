@@ -1,48 +1,129 @@
-"""Model definition and training code."""
+"""Model training, evaluation and play.
+
+    python model.py train --config configs/long_run.json --learning-rate 0.0005
+    python model.py evaluate --games 100
+    python model.py play --agent expectimax --games 10
+
+Every key of DEFAULT_CONFIG can be set in a JSON config file (--config) and overridden with a
+flag of the same name (--number-of-games for number_of_games). Keras is only imported once a
+network is built or loaded, so importing this module is cheap.
+"""
+import argparse
+import json
+import os
+import re
 import numpy as np
-import keras as kr
-from keras import layers
 import logic as lgc
-from logic import timer
-from history import History
+import bitboard as bb
+import checkpoint
+import metrics
+import profiler
+import symmetry
+from metrics import timer
+from env import VecEnv, REWARDS
+from experience import ReplayBuffer
+from inference import InferenceCache
+from network import MODEL_NICKNAME, NumpyNetwork, build_model, load_model, epsilon_greedy, q_targets, \
+    optimizer_state, set_optimizer_state
 
 
-INDEX_TO_ACTION = {
-    0: 'L',
-    1: 'U',
-    2: 'R',
-    3: 'D',
-}
-
 INDEX_TO_ACTION_FUNCTION = {
-    0: lgc.left,
-    1: lgc.up,
-    2: lgc.right,
-    3: lgc.down,
+    0: bb.left,
+    1: bb.up,
+    2: bb.right,
+    3: bb.down,
 }
 
-REWARDS = {
-    'WIN': 5,
-    'LOSE': -5,
-    'NO_RESULT': -1,
-    'CONTINUE': 0,
+# Hyperparameters and run settings, see load_config()
+DEFAULT_CONFIG = {
+    "number_of_games": 1,
+    "max_moves": 100,
+    # Games played in lockstep, sharing one forward pass per move
+    "number_of_envs": 8,
+    # Seed of the games' tile spawns, None for a random one
+    "seed": None,
+
+    "learning_rate": 0.001,
+    "discount_rate": 0.99,
+
+    "max_exploration_rate": 1.0,
+    "min_exploration_rate": 0.01,
+    "exploration_decay_rate": 0.01,
+
+    # "numpy" runs the forward passes of acting and Q-targets with NumpyNetwork, resynced after
+    # every fit; "keras" calls model.predict
+    "inference_backend": "numpy",
+
+    # Train on the 8 rotations and reflections of every sampled transition (8x batch_size)
+    "augment_symmetries": False,
+    # Key the inference cache on canonical boards, sharing one forward pass between the 8
+    # orientations of a board
+    "canonical_inference": False,
+
+    # Experience replay
+    "replay_max_bytes": 64 * 2**20,
+    "batch_size": 64,
+    # Env steps between two minibatch updates
+    "train_every": 4,
+    # Continue from the transitions saved by the previous run
+    "load_replay_buffer": False,
+    "replay_buffer_file": f"models/{MODEL_NICKNAME}_replay.npz",
+
+    # Trained weights are saved here, and loaded from here to evaluate and play
+    "model_file": f"models/{MODEL_NICKNAME}.keras",
+    # Continue training the saved model instead of a fresh one
+    "load_model": False,
+    # Trained n-tuple network of the ntuple agent, see ntuple.py
+    "ntuple_dir": "models/ntuple",
+    # Snapshot of the run every checkpoint_every finished games (0: never), written in the
+    # background; the newest checkpoint_keep are kept
+    "checkpoint_every": 100,
+    "checkpoint_dir": f"models/{MODEL_NICKNAME}_checkpoints",
+    "checkpoint_keep": 3,
+    "checkpoint_replay_buffer": True,
+    # Continue the run of the newest checkpoint in checkpoint_dir; games in progress when it
+    # was taken are started over, and their histories deleted
+    "resume": False,
+    # Games are recorded as {history_prefix}_game_{id} unless history_prefix is empty
+    "history_prefix": MODEL_NICKNAME,
+    "history_dir": "history",
+
+    # Keep per-call timings in memory and print a summary at the end
+    "metrics": True,
+    # Per-phase profiling of one step out of profile_sample_every, exported as a Chrome trace
+    "profile": False,
+    "profile_sample_every": 10,
+    "profile_trace_file": f"models/{MODEL_NICKNAME}_trace.json",
 }
 
-@timer
-def choose_action(state, exploration_rate):
-    """Returns encoded action"""
-    if np.random.uniform(0, 1) > exploration_rate:
-        batch_state = state.reshape(1, 4, 4)
-        action = np.argmax(model.predict(batch_state)[0, 0, :])
-    else:
-        action = np.random.randint(0, 4)
-    return action
+
+def load_config(path=None, **overrides):
+    """DEFAULT_CONFIG, updated from a JSON file if given, then with the overrides that aren't None."""
+    config = dict(DEFAULT_CONFIG)
+    if path is not None:
+        with open(path) as f:
+            values = json.load(f)
+        unknown = set(values) - set(config)
+        if unknown:
+            raise ValueError(f"Unknown settings in {path}: {', '.join(sorted(unknown))}")
+        config.update(values)
+    config.update((key, value) for key, value in overrides.items() if value is not None)
+    return config
+
+
+def exploration_rate(config, finished_games):
+    """Exploration rate after finished_games games, decaying from max to min."""
+    return config["min_exploration_rate"] + (config["max_exploration_rate"] - config["min_exploration_rate"]) * \
+        np.exp(-config["exploration_decay_rate"] * finished_games)
+
 
 @timer
 def do_action(state, action):
     """Returns new state and evaluates reward and game state"""
     new_state, done = INDEX_TO_ACTION_FUNCTION[action](state)
-    lgc.add_two(new_state)
+    # A tile only spawns when the move did something, like in the real game
+    if done:
+        lgc.add_two(new_state)
     if np.array_equal(state, new_state):
         return new_state, REWARDS['NO_RESULT'], False
     game_state = lgc.game_state(new_state)
@@ -52,86 +133,357 @@ def do_action(state, action):
         return new_state, REWARDS['LOSE'], True
     return new_state, REWARDS['CONTINUE'], False
 
-@timer
-def update_qtable(state, action, reward, new_state):
-    """Updates Q-table"""
-    batch_state = state.reshape(1, 4, 4)
-    batch_new_state = new_state.reshape(1, 4, 4)
-    if game_ended:
-        target_action_qvalue = reward
+
+class Trainer():
+    """The network, its inference cache and the Q-learning update."""
+
+    def __init__(self, config, model=None):
+        self.config = config
+        if model is None:
+            model = load_model(config["model_file"]) if config["load_model"] else build_model()
+        self.model = model
+        self.fit = timer(model.fit)
+        self.network = None
+        if config["inference_backend"] == "numpy":
+            self.network = NumpyNetwork.from_keras(model)
+            forward = self.network.predict
+        elif config["inference_backend"] == "keras":
+            forward = lambda boards: self.model.predict(boards, verbose=False)
+        else:
+            raise ValueError(f"Unknown inference backend {config['inference_backend']!r}, expected numpy or keras")
+        self.inference = InferenceCache(lambda boards: forward(boards)[:, 0, :],
+                                        symmetric=config["canonical_inference"])
+
+    @timer
+    def choose_action(self, states, exploration_rate):
+        """Returns encoded actions, one per state, using a single batched forward pass"""
+        return epsilon_greedy(self.inference.predict, states, exploration_rate)
+
+    @timer
+    def update_qtable(self, states, actions, rewards, new_states, games_ended):
+        """Updates Q-table on a minibatch of transitions"""
+        # One forward pass for states and new states, usually already prefetched this step
+        with profiler.span("predict"):
+            qvalues = self.inference.predict(np.concatenate([states, new_states]))
+        state_qvalues, new_state_qvalues = qvalues[:len(states)], qvalues[len(states):]
+        with profiler.span("targets"):
+            target_qvalues = q_targets(state_qvalues, new_state_qvalues, actions, rewards, games_ended,
+                                       self.config["learning_rate"], self.config["discount_rate"])
+        with profiler.span("fit"):
+            self.fit(states, target_qvalues, epochs=1, verbose=0)
+        # Weights changed, cached outputs are stale
+        if self.network is not None:
+            self.network.set_weights(self.model.get_weights())
+        self.inference.clear()
+
+
+def _make_env(config, history_prefix, rng=None, first_game_id=0, max_games=None):
+    """VecEnv of the config. rng, if given, replaces the seed as master generator. With
+    max_games, no more envs than that are played and only the first max_games games are recorded."""
+    if history_prefix:
+        os.makedirs(config["history_dir"], exist_ok=True)
+    n_envs = config["number_of_envs"] if max_games is None else max(min(config["number_of_envs"], max_games), 1)
+    return VecEnv(n_envs, config["max_moves"], history_prefix=history_prefix or None,
+                  history_dir=config["history_dir"], seed=config["seed"] if rng is None else rng,
+                  background_writes=True, first_game_id=first_game_id, max_games=max_games)
+
+
+def _generator(state):
+    rng = np.random.default_rng()
+    rng.bit_generator.state = state
+    return rng
+
+
+def _numbered(arrays, prefix):
+    return [arrays[f"{prefix}_{i}"] for i in range(sum(name.startswith(prefix + "_") for name in arrays))]
+
+
+def _snapshot(trainer, replay_buffer, replay_rng, env, rewards_all_games, step, current_exploration_rate):
+    """In-memory copy of everything train() needs to resume: (arrays, state) for checkpoint."""
+    config = trainer.config
+    arrays = {}
+    for i, weights in enumerate(trainer.model.get_weights()):
+        arrays[f"weights_{i}"] = np.array(weights)
+    for i, variable in enumerate(optimizer_state(trainer.model)):
+        arrays[f"optimizer_{i}"] = variable
+    if config["checkpoint_replay_buffer"]:
+        arrays.update((f"replay_{name}", array) for name, array in replay_buffer.arrays().items())
+    numpy_random = np.random.get_state(legacy=False)
+    arrays["numpy_random_key"] = numpy_random["state"]["key"].copy()
+    state = {
+        "finished_games": len(rewards_all_games),
+        "step": step,
+        "exploration_rate": float(current_exploration_rate),
+        "rewards": {str(game): int(reward) for game, reward in rewards_all_games.items()},
+        "next_game_id": int(env.next_game_id),
+        "games_in_progress": env.game_ids.tolist(),
+        "env_rng": env.master_rng.bit_generator.state,
+        "replay_rng": replay_rng.bit_generator.state,
+        "numpy_random": {"pos": numpy_random["state"]["pos"], "has_gauss": numpy_random["has_gauss"],
+                         "gauss": numpy_random["gauss"]},
+        "metrics": metrics.stats(),
+        "config": config,
+    }
+    return arrays, state
+
+
+def _restore_model(arrays):
+    model = build_model()
+    model.set_weights(_numbered(arrays, "weights"))
+    set_optimizer_state(model, _numbered(arrays, "optimizer"))
+    return model
+
+
+def _restore_numpy_random(arrays, state):
+    np.random.set_state({"bit_generator": "MT19937",
+                         "state": {"key": arrays["numpy_random_key"], "pos": state["numpy_random"]["pos"]},
+                         "has_gauss": state["numpy_random"]["has_gauss"], "gauss": state["numpy_random"]["gauss"]})
+
+
+def _discard_interrupted_games(state):
+    """Delete the histories, with their sidecars, of the games the run resumed from state won't
+    finish: the ones in progress when the checkpoint was taken, and the ones started after it,
+    whose ids the resumed run hands out again. Their files are partial or belong to a run that
+    was thrown away. Returns how many files were deleted."""
+    prefix, directory = state["config"]["history_prefix"], state["config"]["history_dir"]
+    if not prefix or not os.path.isdir(directory):
+        return 0
+    in_progress = set(state.get("games_in_progress", []))
+    game_file = re.compile(rf"^{re.escape(prefix)}_game_(\d+)\.")
+    deleted = 0
+    for name in os.listdir(directory):
+        match = game_file.match(name)
+        if match and (int(match.group(1)) in in_progress or int(match.group(1)) >= state["next_game_id"]):
+            os.remove(os.path.join(directory, name))
+            deleted += 1
+    return deleted
+
+
+def train(config):
+    """Train the network for number_of_games games. Returns {game id: total reward}."""
+    if config["metrics"]:
+        metrics.enable()
+    if config["profile"]:
+        profiler.enable(config["profile_sample_every"])
+    arrays, state = None, None
+    if config["resume"]:
+        path = checkpoint.latest(config["checkpoint_dir"])
+        if path is None:
+            print(f"No checkpoint in {config['checkpoint_dir']}, starting a new run")
+        else:
+            arrays, state = checkpoint.load(path)
+            print(f"Resuming from {path} after {state['finished_games']} games")
+            print(f"Deleted {_discard_interrupted_games(state)} history files of interrupted games")
+    trainer = Trainer(config, None if arrays is None else _restore_model(arrays))
+    trainer.model.summary()
+    inference = trainer.inference
+    batch_size = config["batch_size"]
+
+    if state is None:
+        rewards_all_games = {}
+        current_exploration_rate = exploration_rate(config, 0)
+        step = 0
+        env = _make_env(config, config["history_prefix"])
+        replay_rng = np.random.default_rng()
+    else:
+        rewards_all_games = {int(game): reward for game, reward in state["rewards"].items()}
+        current_exploration_rate = state["exploration_rate"]
+        step = state["step"]
+        env = _make_env(config, config["history_prefix"], rng=_generator(state["env_rng"]),
+                        first_game_id=state["next_game_id"])
+        replay_rng = _generator(state["replay_rng"])
+        _restore_numpy_random(arrays, state)
+    if arrays is not None and "replay_states" in arrays:
+        replay_buffer = ReplayBuffer.from_arrays({name[len("replay_"):]: array for name, array in arrays.items()
+                                                  if name.startswith("replay_")},
+                                                 max_bytes=config["replay_max_bytes"])
+    elif config["load_replay_buffer"]:
+        replay_buffer = ReplayBuffer.load(config["replay_buffer_file"], max_bytes=config["replay_max_bytes"])
+    else:
+        replay_buffer = ReplayBuffer(max_bytes=config["replay_max_bytes"])
+    checkpointer = None
+    if config["checkpoint_every"] > 0:
+        checkpointer = checkpoint.Checkpointer(config["checkpoint_dir"], keep=config["checkpoint_keep"])
+        next_checkpoint = (len(rewards_all_games) // config["checkpoint_every"] + 1) * config["checkpoint_every"]
+
+    while len(rewards_all_games) < config["number_of_games"]:
+        with profiler.step():
+            states = env.states
+            step += 1
+            inference.clear()
+            minibatch = None
+            if step % config["train_every"] == 0 and len(replay_buffer) >= batch_size:
+                with profiler.span("replay.sample"):
+                    minibatch = replay_buffer.sample(batch_size, replay_rng)
+                if config["augment_symmetries"]:
+                    with profiler.span("augment"):
+                        minibatch = symmetry.augment(*minibatch)
+                # Everything this step needs from the model in a single forward pass
+                with profiler.span("prefetch"):
+                    inference.prefetch(np.concatenate([states, minibatch[0], minibatch[3]]))
+
+            # Choose actions for all games at once
+            with profiler.span("choose_action"):
+                actions = trainer.choose_action(states, current_exploration_rate)
+            with profiler.span("env.step"):
+                new_states, rewards, games_ended, _ = env.step(actions)
+
+            # Update Q-table on a minibatch of past transitions
+            with profiler.span("replay.add"):
+                replay_buffer.add_batch(states, actions, rewards, new_states, games_ended)
+            if minibatch is not None:
+                with profiler.span("update_qtable"):
+                    trainer.update_qtable(*minibatch)
+
+            for game, rewards_current_game, moves in env.pop_finished():
+                print(f"---------------GAME {game} ended after {moves} moves---------------")
+                profiler.end_game(game)
+                rewards_all_games[game] = rewards_current_game
+                current_exploration_rate = exploration_rate(config, len(rewards_all_games))
+
+            if checkpointer is not None and len(rewards_all_games) >= next_checkpoint:
+                # Only copies in memory here, the checkpointer's thread writes them
+                with profiler.span("checkpoint"):
+                    checkpointer.save(len(rewards_all_games), *_snapshot(
+                        trainer, replay_buffer, replay_rng, env, rewards_all_games, step, current_exploration_rate))
+                next_checkpoint = (len(rewards_all_games) // config["checkpoint_every"] + 1) * config["checkpoint_every"]
+    if checkpointer is not None:
+        checkpointer.save(len(rewards_all_games), *_snapshot(
+            trainer, replay_buffer, replay_rng, env, rewards_all_games, step, current_exploration_rate))
+        checkpointer.close()
+    env.close()
+
+    for game, rewards in sorted(rewards_all_games.items()):
+        print(f"Game {game} avg. reward: {rewards} ")
+    if config["metrics"]:
+        metrics.print_summary()
+    if config["profile"]:
+        profiler.print_summary()
+        profiler.save_trace(config["profile_trace_file"])
+    print(f"Inference cache: {inference.stats()}")
+
+    # Updated model weights
+    _make_parent_dir(config["model_file"])
+    trainer.model.save(config["model_file"])
+    _make_parent_dir(config["replay_buffer_file"])
+    replay_buffer.save(config["replay_buffer_file"])
+    # Print them
+    print(trainer.model.get_weights())
+    return rewards_all_games
+
+
+def _make_parent_dir(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def run_games(choose_action, config, history_prefix=None):
+    """Play number_of_games games with choose_action(states) -> actions, no training.
+    Returns one (total reward, moves, max tile, won) tuple per game."""
+    n_games = config["number_of_games"]
+    env = _make_env(config, history_prefix, max_games=n_games)
+    results = []
+    try:
+        while len(results) < n_games:
+            new_states, rewards, _, finished = env.step(choose_action(env.states))
+            # New states are the boards before the reset, so the final boards of the finished games,
+            # which pop_finished() lists in the same order
+            slots = np.flatnonzero(finished)
+            for (game_id, reward, moves), k in zip(env.pop_finished(), slots):
+                # Games past the requested ones only keep the other envs busy and aren't recorded
+                if game_id < n_games:
+                    results.append((reward, moves, int(new_states[k].max()), bool(rewards[k] == REWARDS['WIN'])))
+    finally:
+        env.close()
+    return results
+
+
+def print_results(results):
+    rewards, moves, tiles, won = (np.array(column) for column in zip(*results))
+    print(f"{len(results)} games: avg. reward {rewards.mean():.1f}, avg. moves {moves.mean():.1f}, "
+          f"win rate {100 * won.mean():.1f}%")
+    values, counts = np.unique(tiles, return_counts=True)
+    print("Max tiles: " + ", ".join(f"{value}: {count}" for value, count in zip(values, counts)))
+
+
+def evaluate(config):
+    """Play with the saved model, greedily and without training. Returns run_games() results."""
+    trainer = Trainer(config, load_model(config["model_file"]))
+    results = run_games(lambda states: trainer.choose_action(states, 0), config)
+    print_results(results)
+    return results
+
+
+AGENTS = ("model", "expectimax", "montecarlo", "ntuple", "random")
+
+
+def play(config, agent="model"):
+    """Play and record games with the saved model or one of the search agents.
+    Games are recorded as {history_prefix or agent}_game_{id}. Returns run_games() results."""
+    if agent == "model":
+        trainer = Trainer(config, load_model(config["model_file"]))
+        choose_action = lambda states: trainer.choose_action(states, 0)
+    elif agent == "expectimax":
+        from expectimax import ExpectimaxAgent
+        choose_action = ExpectimaxAgent().choose_action
+    elif agent == "montecarlo":
+        from montecarlo import MonteCarloAgent
+        choose_action = MonteCarloAgent(seed=config["seed"]).choose_action
+    elif agent == "ntuple":
+        from ntuple import NTupleNetwork
+        choose_action = NTupleNetwork.load(config["ntuple_dir"], mmap_mode="r").choose_action
+    elif agent == "random":
+        choose_action = lambda states: np.random.randint(0, 4, size=len(states))
     else:
-        target_action_qvalue = np.max(model.predict(batch_state, verbose=False)[0, 0, :]) * (1 - learning_rate) + \
-                learning_rate * (reward + discount_rate * np.max(model.predict(batch_new_state, verbose=False)[0, 0, :]))
-    target_qvalues = model.predict(batch_state, verbose=False)
-    target_qvalues[0, 0, action] = target_action_qvalue
-    timed_fit = timer(model.fit)
-    timed_fit(batch_state, target_qvalues, epochs=1, verbose=0)
-
-
-MODEL_NICKNAME = "ProtoOrganism"
-model = kr.models.Sequential([
-    layers.Input(shape=(4, 4)),
-    layers.Conv1D(16, (3, ), activation='relu'),
-    layers.Conv1D(4, (2, ), activation='relu'),
-    layers.Dense(4, activation='softmax'),
-])
-
-model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
-model.summary()
-
-# Hyperparameters
-number_of_games = 1
-max_moves = 100
-
-learning_rate = 0.001
-discount_rate = 0.99
-
-exploration_rate = 1
-max_exploration_rate = 1
-min_exploration_rate = 0.01
-exploration_decay_rate = 0.01
-
-rewards_all_games = []
-for game in range(number_of_games):
-    print(f"---------------GAME {game}---------------")
-    state = lgc.new_game(n=4)
-    done = False
-    rewards_current_game = 0
-
-    history = History(mode="w", dir="history", filename=f"{MODEL_NICKNAME}_game_{game}")
-    history.saveMatrix(state)
-
-    for move in range(max_moves):
-        print(f"-----Move {move}-----")
-        # Choose action
-        action = choose_action(state, exploration_rate)
-        new_state, reward, game_ended = do_action(state, action)
-
-        print(f"Action: {INDEX_TO_ACTION[action]}")
-
-        # Save history
-        history.saveMatrix(new_state)
-        history.saveMove(INDEX_TO_ACTION[action])
-
-        # Update Q-table
-        update_qtable(state, action, reward, new_state)
-
-        state = new_state
-        rewards_current_game += reward
-
-        if game_ended:
-            history.close()
-            break
-
-    exploration_rate = min_exploration_rate + \
-        (max_exploration_rate - min_exploration_rate) * np.exp(-exploration_decay_rate * game)
-    
-    rewards_all_games.append(rewards_current_game)
-
-for game, rewards in enumerate(rewards_all_games):
-    print(f"Game {game} avg. reward: {rewards} ")
-
-# Updated model weights
-model.save(f"models/{MODEL_NICKNAME}.keras")
-# Print them
-print(model.get_weights())
\ No newline at end of file
+        raise ValueError(f"Unknown agent {agent!r}, expected one of {AGENTS}")
+    prefix = config["history_prefix"] if agent == "model" else agent
+    results = run_games(choose_action, config, history_prefix=prefix)
+    print_results(results)
+    return results
+
+
+def _flag_type(default):
+    if isinstance(default, bool):
+        return lambda value: value.lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int
+    if isinstance(default, float):
+        return float
+    if default is None:
+        return lambda value: None if value.lower() == "none" else int(value)
+    return str
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=f"Train, evaluate or play with {MODEL_NICKNAME}")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command in ("train", "evaluate", "play"):
+        subparser = commands.add_parser(command)
+        subparser.add_argument("--config", default=None, help="JSON file of settings, see model.DEFAULT_CONFIG")
+        if command == "play":
+            subparser.add_argument("--agent", choices=AGENTS, default="model")
+        subparser.add_argument("--games", dest="number_of_games", type=int, default=None)
+        for key, default in DEFAULT_CONFIG.items():
+            if key == "number_of_games":
+                continue
+            subparser.add_argument("--" + key.replace("_", "-"), dest=key, type=_flag_type(default), default=None,
+                                   help=f"default: {default}")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = vars(parse_args(argv))
+    command = args.pop("command")
+    agent = args.pop("agent", None)
+    config = load_config(args.pop("config"), **args)
+    if command == "train":
+        train(config)
+    elif command == "evaluate":
+        evaluate(config)
+    else:
+        play(config, agent)
+
+
+if __name__ == "__main__":
+    main()
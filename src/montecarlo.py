@@ -0,0 +1,112 @@
+"""Monte Carlo rollout agent. Every legal move is scored by playing many games on from its
+afterstate and averaging the score they reach. Rollouts are vectorized over boards with
+batch_logic and can be split over a process pool, so quality scales with the cores given."""
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import numpy as np
+import batch_logic as bl
+
+
+def random_policy(boards, legal, rng):
+    """A random legal action for every board, drawn from the generator rng."""
+    keys = np.where(legal, rng.random(legal.shape), -1.0)
+    return np.argmax(keys, axis=1)
+
+
+def rollout(board, action, n_rollouts, max_depth, policy=None, seed=None):
+    """Mean score of n_rollouts games played from board after action, at most max_depth moves each.
+    The score counts the merges of action itself plus everything merged during the rollout.
+    Spawns and policy(boards, legal, rng) draw from the generator of seed (an int, or a
+    np.random.Generator used as is), never from the global np.random."""
+    rng = np.random.default_rng(seed)
+    policy = policy or random_policy
+    boards = np.repeat(np.asarray(board)[None], n_rollouts, axis=0)
+    boards, changed, scores, _ = bl.step_batch(boards, np.full(n_rollouts, action), rng)
+    if not changed[0]:
+        return None
+    alive = np.ones(n_rollouts, dtype=bool)
+    for _ in range(max_depth):
+        idx = np.flatnonzero(alive)
+        if len(idx) == 0:
+            break
+        legal = bl.legal_moves(boards[idx])
+        playing = legal.any(axis=1)
+        alive[idx[~playing]] = False
+        idx = idx[playing]
+        if len(idx) == 0:
+            break
+        actions = policy(boards[idx], legal[playing], rng)
+        new_boards, _, merged, _ = bl.step_batch(boards[idx], actions, rng)
+        boards[idx] = new_boards
+        scores[idx] += merged
+    return float(scores.mean())
+
+
+class MonteCarloAgent():
+    """Picks the move whose rollouts score best on average. choose_action has the same interface
+    as model.choose_action. Don't forget to call close() when using workers."""
+
+    def __init__(self, rollouts_per_move=400, max_depth=50, workers=1, policy=None, stats_hook=None, seed=None):
+        """rollouts_per_move is split evenly over the legal moves. With workers > 1 the rollouts
+        of every move are split in chunks over a process pool (policy must then be picklable).
+        stats_hook, if given, is called after every move with a dict of rollout statistics.
+        All rollouts draw from the agent's own generator, seeded with seed."""
+        self.rng = np.random.default_rng(seed)
+        self.rollouts_per_move = rollouts_per_move
+        self.max_depth = max_depth
+        self.policy = policy
+        self.stats_hook = stats_hook
+        self.pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        self.workers = workers
+        self.total_rollouts = 0
+        self.total_seconds = 0.0
+
+    def choose_action(self, states, exploration_rate=0):
+        """Returns encoded actions, one per state. exploration_rate is accepted for compatibility
+        with model.choose_action; the agent is always greedy."""
+        states = np.asarray(states)
+        if states.ndim == 2:
+            return self.best_action(states)
+        return np.array([self.best_action(state) for state in states])
+
+    def best_action(self, board):
+        start = perf_counter()
+        legal = np.flatnonzero(bl.legal_moves(np.asarray(board)[None])[0])
+        if len(legal) == 0:
+            return 0
+        n_rollouts = max(1, self.rollouts_per_move // len(legal))
+        if self.pool is None:
+            values = [rollout(board, a, n_rollouts, self.max_depth, self.policy, self.rng) for a in legal]
+        else:
+            values = self._pooled_values(board, legal, n_rollouts)
+        best = int(legal[int(np.argmax(values))])
+
+        seconds = perf_counter() - start
+        rollouts = n_rollouts * len(legal)
+        self.total_rollouts += rollouts
+        self.total_seconds += seconds
+        if self.stats_hook is not None:
+            self.stats_hook({
+                "rollouts": rollouts,
+                "seconds": seconds,
+                "rollouts_per_second": rollouts / seconds if seconds else 0.0,
+                "total_rollouts": self.total_rollouts,
+                "mean_rollouts_per_second": self.total_rollouts / self.total_seconds if self.total_seconds else 0.0,
+                "values": dict(zip(legal.tolist(), values)),
+            })
+        return best
+
+    def _pooled_values(self, board, legal, n_rollouts):
+        """Mean rollout score per legal move, with every move split in one chunk per worker."""
+        chunks = [len(c) for c in np.array_split(np.arange(n_rollouts), self.workers) if len(c)]
+        seeds = self.rng.integers(0, 2**31, size=(len(legal), len(chunks)))
+        futures = [[self.pool.submit(rollout, board, a, size, self.max_depth, self.policy, seed)
+                    for size, seed in zip(chunks, action_seeds)]
+                   for a, action_seeds in zip(legal, seeds)]
+        return [sum(size * f.result() for size, f in zip(chunks, action_futures)) / sum(chunks)
+                for action_futures in futures]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,168 @@
+"""ProtoOrganism network definition and Q-learning targets, importable without starting a training run.
+Keras is imported on first use, so importing this module stays cheap.
+
+NumpyNetwork evaluates the same architecture with a few NumPy matrix products, without the
+per-call overhead of Keras predict, from weights exported with save_weights:
+
+    python network.py export models/ProtoOrganism.keras models/ProtoOrganism_weights.npz
+    python network.py parity models/ProtoOrganism.keras
+"""
+import argparse
+import numpy as np
+
+
+MODEL_NICKNAME = "ProtoOrganism"
+
+
+def build_model():
+    """Fresh, compiled ProtoOrganism network. Output shape is (batch, 1, 4)."""
+    import keras as kr
+    from keras import layers
+    model = kr.models.Sequential([
+        layers.Input(shape=(4, 4)),
+        layers.Conv1D(16, (3, ), activation='relu'),
+        layers.Conv1D(4, (2, ), activation='relu'),
+        layers.Dense(4, activation='softmax'),
+    ])
+    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def load_model(path):
+    """Saved network, e.g. by model.train."""
+    import keras as kr
+    return kr.models.load_model(path)
+
+
+def optimizer_state(model):
+    """Copies of the variables of the optimizer of a compiled model (step count, moments, ...)."""
+    return [np.array(variable) for variable in model.optimizer.variables]
+
+
+def set_optimizer_state(model, state):
+    """Restore optimizer_state(), building the optimizer first if the model was never fit."""
+    optimizer = model.optimizer
+    if len(optimizer.variables) != len(state) and not optimizer.built:
+        optimizer.build(model.trainable_variables)
+    if len(optimizer.variables) != len(state):
+        raise ValueError(f"Expected {len(optimizer.variables)} optimizer variables, got {len(state)}")
+    for variable, value in zip(optimizer.variables, state):
+        variable.assign(value)
+
+
+# (kernel, bias) shapes of the layers, in Keras get_weights() order
+WEIGHT_SHAPES = (
+    ((3, 4, 16), (16,)),
+    ((2, 16, 4), (4,)),
+    ((4, 4), (4,)),
+)
+
+
+def save_weights(path, weights):
+    """Save a get_weights() list (of a Keras model or a NumpyNetwork) to an npz file."""
+    np.savez(path, **{f"w{i}": np.asarray(w, dtype=np.float32) for i, w in enumerate(weights)})
+
+
+def _conv1d_relu(x, kernel, bias):
+    """Valid 1D convolution over axis 1 of (N, steps, channels), then relu."""
+    width = kernel.shape[0]
+    steps = x.shape[1] - width + 1
+    # (N, steps, width * channels) windows against the flattened kernel
+    windows = np.concatenate([x[:, k:k + steps] for k in range(width)], axis=2)
+    return np.maximum(windows @ kernel.reshape(-1, kernel.shape[2]) + bias, 0)
+
+
+class NumpyNetwork():
+    """ProtoOrganism forward pass in NumPy. predict() matches Keras model.predict: (N, 4, 4)
+    boards (or a single (4, 4) board) to (N, 1, 4) softmax outputs."""
+
+    def __init__(self, weights):
+        self.set_weights(weights)
+
+    @classmethod
+    def from_keras(cls, model):
+        return cls(model.get_weights())
+
+    @classmethod
+    def load(cls, path):
+        """From an npz file written by save_weights."""
+        with np.load(path) as data:
+            return cls([data[f"w{i}"] for i in range(len(data.files))])
+
+    def set_weights(self, weights):
+        """Take new weights, e.g. model.get_weights() after a fit."""
+        weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        expected = [shape for layer in WEIGHT_SHAPES for shape in layer]
+        if [w.shape for w in weights] != expected:
+            raise ValueError(f"Expected weights shaped {expected}, got {[w.shape for w in weights]}")
+        self.weights = weights
+
+    def get_weights(self):
+        return [w.copy() for w in self.weights]
+
+    def predict(self, boards, verbose=False):
+        """verbose is accepted for compatibility with Keras predict."""
+        x = np.asarray(boards, dtype=np.float32).reshape(-1, 4, 4)
+        kernel1, bias1, kernel2, bias2, dense, dense_bias = self.weights
+        x = _conv1d_relu(x, kernel1, bias1)
+        x = _conv1d_relu(x, kernel2, bias2)
+        logits = x @ dense + dense_bias
+        logits -= logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def parity(model, boards=None, n=1000, seed=0):
+    """Largest absolute difference between Keras and NumpyNetwork outputs of model, on the given
+    boards or n random ones."""
+    if boards is None:
+        rng = np.random.default_rng(seed)
+        ranks = rng.integers(0, 12, size=(n, 4, 4))
+        boards = np.where(ranks > 0, 1 << ranks, 0)
+    expected = model.predict(boards, verbose=False)
+    actual = NumpyNetwork.from_keras(model).predict(boards)
+    return float(np.abs(expected - actual).max())
+
+
+def epsilon_greedy(predict, states, exploration_rate):
+    """Encoded actions, one per state: random with probability exploration_rate, otherwise the
+    action with the highest Q-value. predict maps a batch of boards to (batch, 4) Q-values and is
+    called at most once, only for the exploiting states."""
+    batch_states = states.reshape(-1, 4, 4)
+    actions = np.random.randint(0, 4, size=len(batch_states))
+    exploit = np.random.uniform(0, 1, size=len(batch_states)) > exploration_rate
+    if exploit.any():
+        actions[exploit] = np.argmax(predict(batch_states[exploit]), axis=1)
+    return actions
+
+
+def q_targets(state_qvalues, new_state_qvalues, actions, rewards, games_ended, learning_rate, discount_rate):
+    """Training targets shaped like the model output: the predicted Q-values of the states,
+    with the Q-value of the taken action moved towards reward + discounted best next Q-value."""
+    target_action_qvalues = np.max(state_qvalues, axis=1) * (1 - learning_rate) + \
+            learning_rate * (rewards + discount_rate * np.max(new_state_qvalues, axis=1))
+    target_action_qvalues = np.where(games_ended, rewards, target_action_qvalues)
+    target_qvalues = state_qvalues[:, None, :].copy()
+    target_qvalues[np.arange(len(actions)), 0, actions] = target_action_qvalues
+    return target_qvalues
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export ProtoOrganism weights for NumpyNetwork or check its parity")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write the weights of a saved Keras model to an npz file")
+    export.add_argument("model_file")
+    export.add_argument("weights_file")
+    check = commands.add_parser("parity", help="compare Keras and NumPy outputs on random boards")
+    check.add_argument("model_file", nargs="?", default=None, help="saved model, a fresh one if not given")
+    check.add_argument("--boards", type=int, default=1000)
+    check.add_argument("--tolerance", type=float, default=1e-5)
+    args = parser.parse_args()
+    if args.command == "export":
+        save_weights(args.weights_file, load_model(args.model_file).get_weights())
+    else:
+        model = build_model() if args.model_file is None else load_model(args.model_file)
+        difference = parity(model, n=args.boards)
+        print(f"Max abs. difference over {args.boards} boards: {difference:.2e}")
+        if difference > args.tolerance:
+            raise SystemExit(1)
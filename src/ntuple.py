@@ -0,0 +1,251 @@
+"""N-tuple network agent, trained by TD(0) on afterstates.
+
+The value of an afterstate (the board right after a move, before the new tile spawns) is the
+sum of lookup table entries, one per n-tuple of cells and per orientation of the board: the
+ranks of the tuple's cells form the index into the tuple's table. A move is chosen by merge
+score plus afterstate value, and after every move the previous afterstate's value is pulled
+towards the reward and value of the next one (Szubert & Jaskowski, 2014).
+
+Games are played in lockstep: every step computes the 4 afterstates of all games with the
+bitboard row tables (the same moves and merge scores as logic), evaluates them in one gather
+and applies all updates at once. Weights live in one preallocated float32 array saved as .npy,
+which load() can memory-map:
+
+    python ntuple.py train models/ntuple --games 100000 --envs 1024
+    python ntuple.py evaluate models/ntuple --games 1000
+"""
+import argparse
+import json
+import os
+from time import perf_counter
+import numpy as np
+import batch_logic as bl
+import bitboard as bb
+import symmetry
+
+
+MANIFEST = "manifest.json"
+WEIGHTS_FILE = "weights.npy"
+NTUPLE_VERSION = 1
+# Cell ranks are 4 bits, as in bitboard: up to 32768
+MAX_RANK = bb.MAX_RANK
+
+# Two straight 6-tuples and two 2x3 rectangles, cells numbered row by row
+DEFAULT_PATTERNS = (
+    (0, 1, 2, 3, 4, 5),
+    (4, 5, 6, 7, 8, 9),
+    (0, 1, 2, 4, 5, 6),
+    (4, 5, 6, 8, 9, 10),
+)
+
+
+class NTupleNetwork():
+    """Lookup tables of a set of n-tuples, shared by the 8 orientations of the board."""
+
+    def __init__(self, patterns=DEFAULT_PATTERNS, weights=None):
+        self.patterns = tuple(tuple(int(cell) for cell in pattern) for pattern in patterns)
+        sizes = [(MAX_RANK + 1) ** len(pattern) for pattern in self.patterns]
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        if weights is None:
+            weights = np.zeros(offsets[-1], dtype=np.float32)
+        if weights.shape != (offsets[-1],):
+            raise ValueError(f"Expected {offsets[-1]} weights for these patterns, got {weights.shape}")
+        self.weights = weights
+        # Per pattern: the cells of its 8 orientations, (8, n), and the offset of its table
+        self._features = [(symmetry.PERMUTATIONS[:, list(pattern)], offset)
+                          for pattern, offset in zip(self.patterns, offsets)]
+        self.n_features = symmetry.N_TRANSFORMS * len(self.patterns)
+
+    def indices(self, ranks):
+        """(N, n_features) weight indices of (N, 4, 4) rank boards (see bitboard.to_ranks)."""
+        cell_ranks = np.asarray(ranks, dtype=np.int32).reshape(-1, 16)
+        columns = []
+        for cells, offset in self._features:
+            index = cell_ranks[:, cells[:, 0]]
+            for k in range(1, cells.shape[1]):
+                index = (index << 4) | cell_ranks[:, cells[:, k]]
+            columns.append(index + offset)
+        return np.concatenate(columns, axis=1)
+
+    def value(self, boards):
+        """(N,) values of (N, 4, 4) afterstates, in tile values."""
+        return self.weights[self.indices(bb.to_ranks(boards))].sum(axis=1)
+
+    def update(self, indices, errors, learning_rate):
+        """Move the values of the boards with these indices by learning_rate * errors, spread
+        over their features. A feature shared by several boards gets the mean of their updates:
+        summing them diverges once many games are played in lockstep."""
+        flat = indices.ravel()
+        step = np.repeat((learning_rate / self.n_features * np.asarray(errors)).astype(np.float32), indices.shape[1])
+        _, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+        np.add.at(self.weights, flat, step / counts[inverse])
+
+    def _greedy(self, ranks):
+        """Greedy actions of rank boards by merge score plus afterstate value. Returns actions,
+        their afterstates (rank boards), merge scores, feature indices and values, and a mask of
+        the boards that can still move."""
+        after, legal, scores = bb.move_ranks_all(ranks)
+        n = len(after)
+        indices = self.indices(after).reshape(n, 4, -1)
+        values = self.weights[indices].sum(axis=2)
+        actions = np.argmax(np.where(legal, scores + values, -np.inf), axis=1)
+        rows = np.arange(n)
+        return (actions, after[rows, actions], scores[rows, actions], indices[rows, actions],
+                values[rows, actions], legal.any(axis=1))
+
+    def best_actions(self, boards):
+        """Greedy actions of (N, 4, 4) boards, their afterstates, merge scores and a mask of the
+        boards that can still move."""
+        actions, after, scores, _, _, alive = self._greedy(bb.to_ranks(boards))
+        return actions, bb.from_ranks(after), scores, alive
+
+    def choose_action(self, states, exploration_rate=0):
+        """Same interface as model.choose_action; boards without a legal move get action 0."""
+        actions = self._greedy(bb.to_ranks(states))[0]
+        if exploration_rate > 0:
+            explore = np.random.random(len(actions)) < exploration_rate
+            actions[explore] = np.random.randint(0, 4, size=explore.sum())
+        return actions
+
+    def save(self, directory):
+        """Write the weights and patterns to directory. Weights memory-mapped from there are
+        flushed in place instead."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, WEIGHTS_FILE)
+        if isinstance(self.weights, np.memmap) and os.path.abspath(self.weights.filename) == os.path.abspath(path):
+            self.weights.flush()
+        else:
+            np.save(path, self.weights)
+        with open(os.path.join(directory, MANIFEST), "w") as f:
+            json.dump({"version": NTUPLE_VERSION, "patterns": self.patterns, "max_rank": MAX_RANK}, f, indent=1)
+
+    @classmethod
+    def create(cls, directory, patterns=DEFAULT_PATTERNS):
+        """Fresh network whose zero weights are preallocated in directory and memory-mapped."""
+        os.makedirs(directory, exist_ok=True)
+        size = sum((MAX_RANK + 1) ** len(pattern) for pattern in patterns)
+        weights = np.lib.format.open_memmap(os.path.join(directory, WEIGHTS_FILE), mode="w+",
+                                            dtype=np.float32, shape=(size,))
+        network = cls(patterns, weights)
+        network.save(directory)
+        return network
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        """Network saved in directory. mmap_mode "r" shares read-only weights between processes,
+        "r+" trains them in place; None reads them into memory."""
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest["version"] != NTUPLE_VERSION or manifest["max_rank"] != MAX_RANK:
+            raise ValueError(f"{directory} was written by another version of ntuple")
+        weights = np.load(os.path.join(directory, WEIGHTS_FILE), mmap_mode=mmap_mode)
+        return cls(manifest["patterns"], weights)
+
+
+def train(network, n_games, n_envs=1024, learning_rate=0.1, seed=None, checkpoint_dir=None,
+          checkpoint_every=10000, progress=None):
+    """TD(0) on afterstates over n_games games, n_envs at a time. Games go on past 2048 until no
+    move is left. Saves network to checkpoint_dir every checkpoint_every games and at the end.
+    progress, if given, is called with (games, updates, seconds) about every 1000 games.
+    Returns (score, max tile) per game, in order of completion."""
+    rng = np.random.default_rng(seed)
+    boards = bl.new_games(n_envs, rng=rng)
+    # Feature indices of every game's previous afterstate
+    previous = np.zeros((n_envs, network.n_features), dtype=np.int32)
+    has_previous = np.zeros(n_envs, dtype=bool)
+    game_scores = np.zeros(n_envs, dtype=np.int64)
+    results = []
+    updates = 0
+    start = perf_counter()
+    next_checkpoint = checkpoint_every
+    next_progress = 1000
+    while len(results) < n_games:
+        _, after, scores, indices, values, alive = network._greedy(bb.to_ranks(boards))
+
+        # The previous afterstate leads to this one, or to the end of the game
+        idx = np.flatnonzero(has_previous)
+        if len(idx):
+            targets = np.where(alive[idx], scores[idx] + values[idx], 0.0)
+            errors = targets - network.weights[previous[idx]].sum(axis=1)
+            network.update(previous[idx], errors, learning_rate)
+            updates += len(idx)
+
+        game_scores[alive] += scores[alive]
+        ended = np.flatnonzero(~alive)
+        results.extend((int(game_scores[k]), int(boards[k].max())) for k in ended)
+        previous[alive] = indices[alive]
+        has_previous = alive
+        boards[alive] = bb.from_ranks(after[alive])
+        bl.add_two_batch(boards, alive, rng)
+        if len(ended):
+            boards[ended] = bl.new_games(len(ended), rng=rng)
+            game_scores[ended] = 0
+
+        if checkpoint_dir is not None and len(results) >= next_checkpoint:
+            network.save(checkpoint_dir)
+            next_checkpoint += checkpoint_every
+        if progress is not None and len(results) >= next_progress:
+            progress(len(results), updates, perf_counter() - start)
+            next_progress += 1000
+    if checkpoint_dir is not None:
+        network.save(checkpoint_dir)
+    return results[:n_games]
+
+
+def evaluate(network, n_games, n_envs=256, seed=None):
+    """Greedy play without learning. Returns (score, max tile) per game."""
+    rng = np.random.default_rng(seed)
+    boards = bl.new_games(min(n_envs, n_games), rng=rng)
+    scores = np.zeros(len(boards), dtype=np.int64)
+    results = []
+    while len(results) < n_games:
+        _, after, merged, alive = network.best_actions(boards)
+        scores[alive] += merged[alive]
+        ended = np.flatnonzero(~alive)
+        results.extend((int(scores[k]), int(boards[k].max())) for k in ended)
+        boards[alive] = after[alive]
+        bl.add_two_batch(boards, alive, rng)
+        if len(ended):
+            boards[ended] = bl.new_games(len(ended), rng=rng)
+            scores[ended] = 0
+    return results[:n_games]
+
+
+def print_results(results):
+    scores, tiles = (np.array(column) for column in zip(*results))
+    print(f"{len(results)} games: avg. score {scores.mean():.0f}, max score {scores.max()}, "
+          f"reached 2048 {100 * (tiles >= 2048).mean():.1f}%")
+    values, counts = np.unique(tiles, return_counts=True)
+    print("Max tiles: " + ", ".join(f"{value}: {count}" for value, count in zip(values, counts)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train or evaluate an n-tuple network")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train_parser = commands.add_parser("train", help="train a network, continuing from the one in directory if any")
+    train_parser.add_argument("directory")
+    train_parser.add_argument("--games", type=int, default=100000)
+    train_parser.add_argument("--envs", type=int, default=1024)
+    train_parser.add_argument("--learning-rate", type=float, default=0.1)
+    train_parser.add_argument("--checkpoint-every", type=int, default=10000)
+    train_parser.add_argument("--seed", type=int, default=None)
+    evaluate_parser = commands.add_parser("evaluate", help="greedy games with a trained network")
+    evaluate_parser.add_argument("directory")
+    evaluate_parser.add_argument("--games", type=int, default=1000)
+    evaluate_parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "train":
+        if os.path.exists(os.path.join(args.directory, MANIFEST)):
+            network = NTupleNetwork.load(args.directory, mmap_mode="r+")
+        else:
+            network = NTupleNetwork.create(args.directory)
+
+        def report(games, updates, seconds):
+            print(f"{games} games, {updates / seconds:,.0f} updates/s")
+        results = train(network, args.games, n_envs=args.envs, learning_rate=args.learning_rate,
+                        seed=args.seed, checkpoint_dir=args.directory, checkpoint_every=args.checkpoint_every,
+                        progress=report)
+        print_results(results[-1000:])
+    else:
+        print_results(evaluate(NTupleNetwork.load(args.directory, mmap_mode="r"), args.games, seed=args.seed))
@@ -0,0 +1,221 @@
+"""Per-phase profiler for the training loop. Code marks its phases with nested spans,
+
+    with profiler.step():
+        with profiler.span("choose_action"):
+            ...
+
+and the profiler aggregates them per phase (by path, e.g. "step/env.step/history"), per game
+and per run, prints a summary table and exports a Chrome trace (chrome://tracing or
+https://ui.perfetto.dev).
+
+Profiling is off by default (or on with PROFILE=1 in the environment, sampling one step out
+of PROFILE_SAMPLE_EVERY). Only sampled steps are recorded, so it can stay on in long runs:
+outside a sampled step a span costs one flag check. Spans are meant for one thread, the one
+running the training loop.
+"""
+import json
+import os
+import threading
+from time import perf_counter_ns
+
+
+enabled = os.environ.get("PROFILE", "0") == "1"
+sample_every = int(os.environ.get("PROFILE_SAMPLE_EVERY", "1"))
+# Trace events kept for export; aggregates keep counting past it
+max_events = 1_000_000
+
+_steps = 0
+# True inside a sampled step
+_recording = False
+# Paths of the open spans and the time spent in their finished children
+_stack = []
+_child_ns = []
+# path -> [count, total ns, self ns], for the run and since the last end_game()
+_run_totals = {}
+_game_totals = {}
+_games = {}
+_events = []
+_dropped_events = 0
+
+
+class _Span():
+    __slots__ = ("name", "args", "path", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.path = f"{_stack[-1]}/{self.name}" if _stack else self.name
+        _stack.append(self.path)
+        _child_ns.append(0)
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        global _dropped_events
+        duration = perf_counter_ns() - self.start
+        _stack.pop()
+        own = duration - _child_ns.pop()
+        if _child_ns:
+            _child_ns[-1] += duration
+        for totals in (_run_totals, _game_totals):
+            entry = totals.get(self.path)
+            if entry is None:
+                totals[self.path] = [1, duration, own]
+            else:
+                entry[0] += 1
+                entry[1] += duration
+                entry[2] += own
+        if len(_events) < max_events:
+            _events.append((self.name, self.start, duration, self.args))
+        else:
+            _dropped_events += 1
+        return False
+
+
+class _NullSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **args):
+    """Context manager timing one phase, nested in the spans open around it. args end up in the trace."""
+    if not _recording:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+class _Step():
+    __slots__ = ("span",)
+
+    def __enter__(self):
+        global _steps, _recording
+        _steps += 1
+        _recording = enabled and _steps % sample_every == 0
+        self.span = _Span("step", {"step": _steps}).__enter__() if _recording else None
+        return self
+
+    def __exit__(self, *exc):
+        global _recording
+        if self.span is not None:
+            self.span.__exit__(*exc)
+        _recording = False
+        return False
+
+
+def step():
+    """Context manager around one iteration of the training loop; decides whether it is sampled."""
+    return _Step()
+
+
+def end_game(game):
+    """Assign what was recorded since the previous call to this game. With games played in
+    lockstep that is everything since the previous game finished."""
+    global _game_totals
+    if enabled:
+        _games[game] = _game_totals
+        _game_totals = {}
+
+
+def enable(every=None):
+    """Start profiling, sampling one step out of every (default: keep the current setting)."""
+    global enabled, sample_every
+    if every is not None:
+        sample_every = max(int(every), 1)
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    global _steps, _game_totals, _dropped_events
+    _steps = 0
+    _run_totals.clear()
+    _game_totals = {}
+    _games.clear()
+    _events.clear()
+    _dropped_events = 0
+
+
+def _summarize(totals):
+    return {path: {"count": count, "total_ns": total, "self_ns": own, "mean_ns": total / count}
+            for path, (count, total, own) in sorted(totals.items())}
+
+
+def run_summary():
+    """path -> count, total, self and mean ns over the sampled steps of the run."""
+    return _summarize(_run_totals)
+
+
+def game_summaries():
+    """game -> the same as run_summary(), for what end_game() assigned to each game."""
+    return {game: _summarize(totals) for game, totals in _games.items()}
+
+
+def print_summary(file=None):
+    """Table of the phases of the run as a tree, slowest first among siblings, with their share of
+    the sampled step time."""
+    summary = run_summary()
+    if not summary:
+        print("No profiled steps", file=file)
+        return
+    step_total = sum(entry["total_ns"] for path, entry in summary.items() if "/" not in path) or 1
+    print(f"Profiled {summary.get('step', {}).get('count', 0)} of {_steps} steps "
+          f"(1 in {sample_every}), {len(_games)} games", file=file)
+    header = f"{'phase':<44}{'count':>8}{'total ms':>11}{'self ms':>10}{'mean us':>10}{'share':>8}"
+    print(header, file=file)
+    print("-" * len(header), file=file)
+    for path in _tree_order(summary):
+        entry = summary[path]
+        indent = "  " * path.count("/")
+        print(f"{indent + path.rsplit('/', 1)[-1]:<44}{entry['count']:>8}{entry['total_ns'] / 1e6:>11.1f}"
+              f"{entry['self_ns'] / 1e6:>10.1f}{entry['mean_ns'] / 1e3:>10.1f}"
+              f"{100 * entry['total_ns'] / step_total:>7.1f}%", file=file)
+    if _dropped_events:
+        print(f"{_dropped_events} spans not kept for the trace (max_events={max_events})", file=file)
+
+
+def _tree_order(summary):
+    """Paths depth first, children right after their parent, slowest first."""
+    children = {}
+    for path in summary:
+        children.setdefault(path.rpartition("/")[0], []).append(path)
+    ordered = []
+    pending = sorted(children.get("", []), key=lambda path: summary[path]["total_ns"])
+    while pending:
+        path = pending.pop()
+        ordered.append(path)
+        pending.extend(sorted(children.get(path, []), key=lambda child: summary[child]["total_ns"]))
+    return ordered
+
+
+def to_chrome_trace():
+    """The recorded spans as a Chrome trace / Perfetto JSON object (complete events, times in us)."""
+    pid = os.getpid()
+    tid = threading.main_thread().ident
+    events = [{"name": name, "cat": "train", "ph": "X", "ts": start / 1e3, "dur": duration / 1e3,
+               "pid": pid, "tid": tid, "args": args}
+              for name, start, duration, args in _events]
+    return {"traceEvents": events, "displayTimeUnit": "ms",
+            "otherData": {"sample_every": sample_every, "steps": _steps}}
+
+
+def save_trace(path):
+    """Write to_chrome_trace() to a file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(to_chrome_trace(), f)
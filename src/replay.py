@@ -1,17 +1,24 @@
 """Take history file and replay the game using Tkinter interface"""
 import os
 import tkinter as tk
-from tkinter import Frame, Label, CENTER, Listbox, Scrollbar
+from tkinter import Frame, Label, CENTER, Listbox, Scrollbar, Entry, OptionMenu, Checkbutton, StringVar, BooleanVar, Scale
+from time import perf_counter
 import random
 import logic
+import bitboard
 import constants as c
 from copy import deepcopy
-from history import History
+from history import open_history
+from game_index import GameIndex, SORT_COLUMNS, OUTCOMES
 import numpy as np
 
 
 REPLAY_DIR = "history"
-REPLAY_SPEED = 0.1  # Every _ seconds make a move
+REPLAY_SPEEDS = (1, 2, 5, 10, 30, 100, 300, 1000, 3000, 10000)  # Moves per second to pick from
+REPLAY_SPEED = 10  # Moves per second at startup
+MAX_FRAMES_PER_SECOND = 60  # Faster playback skips frames instead of drawing each one
+PAGE_SIZE = 200  # Games loaded into the list at a time
+ANY_OUTCOME = "any"
 
 class GameGrid(Frame):
     
@@ -20,32 +27,75 @@ class GameGrid(Frame):
         self.init_commands()
         self.get_files()
         self.replay_speed = REPLAY_SPEED
-        self.ms_per_frame = round(1000*self.replay_speed)
         self.grid()
         self.master.title('2048')
 
         self.create_left_panel()
         self.create_grid_panel()
+        self.create_playback_panel()
 
         self.history = None
         # Matrix on 0
-        self.matrix = np.zeros((c.GRID_LEN, c.GRID_LEN))
+        self.matrix = np.zeros((c.GRID_LEN, c.GRID_LEN), dtype=int)
+        # What the labels show right now, -1 for cells showing something else than a tile
+        self.shown = np.full((c.GRID_LEN, c.GRID_LEN), -1)
         self.current_matrix = 0
-        self.history_matrixs = []
 
         self.playing = False
-        self.master.bind("<space>", self.toggle_pause)
+        # Moves earned by the elapsed time but not played yet
+        self.move_credit = 0.0
+        self.last_tick = perf_counter()
+        self.bind_playback_key("<space>", self.toggle_pause)
         # Binds
-        self.master.bind("<a>", self.back)
-        self.master.bind("<d>", self.forward)
+        self.bind_playback_key("<a>", self.back)
+        self.bind_playback_key("<d>", self.forward)
+        self.bind_playback_key("<w>", self.faster)
+        self.bind_playback_key("<s>", self.slower)
         # Same for arrows
-        self.master.bind("<Left>", self.back)
-        self.master.bind("<Right>", self.forward)
+        self.bind_playback_key("<Left>", self.back)
+        self.bind_playback_key("<Right>", self.forward)
+        self.bind_playback_key("<Up>", self.faster)
+        self.bind_playback_key("<Down>", self.slower)
         self.update_grid_cells()
         self.update_logic()
 
+    def bind_playback_key(self, key, handler):
+        """Bind a playback shortcut on the whole window, except while typing in a filter Entry."""
+        def on_key(event):
+            if not isinstance(event.widget, Entry):
+                handler(event)
+        self.master.bind(key, on_key)
+
     def toggle_pause(self, event):
         self.playing = not self.playing
+        self.move_credit = 0.0
+        self.last_tick = perf_counter()
+
+    def create_playback_panel(self):
+        # Scrubber over the moves of the game and the playback speed
+        self.playback_panel = Frame(self)
+        self.playback_panel.grid(row=1, column=1, sticky="ew")
+        self.scrubber = Scale(self.playback_panel, from_=0, to=0, orient=tk.HORIZONTAL, showvalue=True,
+                              command=lambda value: self.seek(int(float(value))))
+        self.scrubber.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.speed_label = Label(self.playback_panel, width=14)
+        self.speed_label.pack(side=tk.LEFT)
+        self.update_speed_label()
+
+    def update_speed_label(self):
+        self.speed_label.configure(text=f"{self.replay_speed} moves/s")
+
+    def faster(self, event):
+        self.change_speed(1)
+
+    def slower(self, event):
+        self.change_speed(-1)
+
+    def change_speed(self, step):
+        speeds = [speed for speed in REPLAY_SPEEDS if (speed > self.replay_speed if step > 0 else speed < self.replay_speed)]
+        if speeds:
+            self.replay_speed = min(speeds) if step > 0 else max(speeds)
+            self.update_speed_label()
 
     def create_grid_panel(self):
         # Frame for the game grid
@@ -69,8 +119,22 @@ class GameGrid(Frame):
         self.left_panel = Frame(self, width=c.SCROLL_PANEL_WIDTH, height=c.SCROLL_PANEL_HEIGHT)
         self.left_panel.grid(row=0, column=0, sticky="ns")
         
+        # Filter and sort controls, all answered by the index without opening any game
+        self.controls = Frame(self.left_panel)
+        self.controls.pack(side=tk.TOP, fill=tk.X)
+        self.name_filter = StringVar()
+        self.sort_column = StringVar(value="filename")
+        self.descending = BooleanVar(value=False)
+        self.outcome_filter = StringVar(value=ANY_OUTCOME)
+        Entry(self.controls, textvariable=self.name_filter, width=12).pack(side=tk.LEFT)
+        OptionMenu(self.controls, self.sort_column, *SORT_COLUMNS).pack(side=tk.LEFT)
+        Checkbutton(self.controls, text="desc", variable=self.descending).pack(side=tk.LEFT)
+        OptionMenu(self.controls, self.outcome_filter, ANY_OUTCOME, *OUTCOMES).pack(side=tk.LEFT)
+        for variable in (self.name_filter, self.sort_column, self.descending, self.outcome_filter):
+            variable.trace_add("write", lambda *args: self.reload_list())
+
         # Listbox to display the list of filenames or other data
-        self.listbox = Listbox(self.left_panel)
+        self.listbox = Listbox(self.left_panel, width=48)
         # self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.listbox.pack(side=tk.LEFT)
 
@@ -80,22 +144,48 @@ class GameGrid(Frame):
         self.scrollbar.pack(side=tk.LEFT, fill=tk.Y)
         self.scrollbar.config(command=self.listbox.yview)
 
-        # Configure Listbox to work with the Scrollbar
-        self.listbox.config(yscrollcommand=self.scrollbar.set)
-        
-        # Example list items, replace with actual filenames or data
-        for filename in self.history_files:
-            self.listbox.insert(tk.END, filename)
+        # Configure Listbox to work with the Scrollbar, loading more games when it nears the end
+        self.listbox.config(yscrollcommand=self.on_list_scroll)
+
+        self.reload_list()
 
         # Bind the <<ListboxSelect>> event to the item_selected method
         self.listbox.bind("<ButtonRelease>", self.item_selected)
 
+    def list_filters(self):
+        outcome = self.outcome_filter.get()
+        return {
+            "name_contains": self.name_filter.get() or None,
+            "outcome": None if outcome == ANY_OUTCOME else outcome,
+        }
+
+    def reload_list(self):
+        """Start the list over with the current sort and filters."""
+        self.listbox.delete(0, tk.END)
+        self.listed_files = []
+        self.n_listed_games = self.index.count(**self.list_filters())
+        self.load_page()
+
+    def load_page(self):
+        """Append the next PAGE_SIZE games to the list."""
+        rows = self.index.page(len(self.listed_files), PAGE_SIZE, sort=self.sort_column.get(),
+                               descending=self.descending.get(), **self.list_filters())
+        for row in rows:
+            self.listbox.insert(tk.END, f"{row['filename']}  {row['moves']} moves  {row['max_tile']}  "
+                                        f"{row['score']}  {row['outcome']}")
+            self.listed_files.append(row["filename"])
+
+    def on_list_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if float(last) > 0.9 and len(self.listed_files) < self.n_listed_games:
+            self.load_page()
+
     def item_selected(self, event):
             # Get the selected item index
             selected_index = self.listbox.curselection()
             
             if selected_index:
-                selected_item = self.listbox.get(selected_index)
+                selected_item = self.listed_files[selected_index[0]]
                 # Execute your logic here
                 print(f"Selected item: {selected_item}")
                 # Example logic: Load a specific matrix based on the selection
@@ -103,12 +193,15 @@ class GameGrid(Frame):
     
     def loadHistory(self, filename):
         print("Loading history")
-        self.history = History("r", filename=filename, dir=REPLAY_DIR)
-        self.matrix = self.history.loadMatrix(0)
-        self.current_matrix = 0
-        self.history_matrixs = []
+        # Binary histories hold a file and a memory map open until closed
+        if self.history is not None:
+            self.history.close()
+        # Games get reopened as the user browses: keep their line offsets next to them
+        self.history = open_history("r", filename=filename, dir=REPLAY_DIR, use_index_file=True)
         self.playing = False
-        self.update_grid_cells()
+        self.current_matrix = None
+        self.scrubber.configure(to=max(self.history.n_of_matrices - 1, 0))
+        self.seek(0)
 
     def init_grid(self):
         background = self.grid_panel
@@ -141,82 +234,94 @@ class GameGrid(Frame):
             self.grid_cells.append(grid_row)
 
     def update_grid_cells(self):
-        print("Updating grid cells")
-        for i in range(c.GRID_LEN):
-            for j in range(c.GRID_LEN):
-                new_number = self.matrix[i][j]
-                if new_number == 0:
-                    self.grid_cells[i][j].configure(text="",bg=c.BACKGROUND_COLOR_CELL_EMPTY)
-                else:
-                    self.grid_cells[i][j].configure(
-                        text=str(new_number),
-                        bg=c.BACKGROUND_COLOR_DICT[new_number],
-                        fg=c.CELL_COLOR_DICT[new_number]
-                    )
+        """Reconfigure only the labels whose tile changed since the last update."""
+        for i, j in np.argwhere(self.matrix != self.shown).tolist():
+            new_number = int(self.matrix[i][j])
+            if new_number == 0:
+                self.grid_cells[i][j].configure(text="",bg=c.BACKGROUND_COLOR_CELL_EMPTY)
+            else:
+                self.grid_cells[i][j].configure(
+                    text=str(new_number),
+                    bg=c.BACKGROUND_COLOR_DICT[new_number],
+                    fg=c.CELL_COLOR_DICT[new_number]
+                )
+            self.shown[i][j] = new_number
         self.update_idletasks()
 
+    def show_message(self, first, second):
+        """Write two words over the middle of the board until those cells are redrawn."""
+        self.grid_cells[1][1].configure(text=first, bg=c.BACKGROUND_COLOR_CELL_EMPTY)
+        self.grid_cells[1][2].configure(text=second, bg=c.BACKGROUND_COLOR_CELL_EMPTY)
+        self.shown[1][1] = self.shown[1][2] = -1
+
     def update_logic(self):
-        # print("Updating logic")
-        if not self.playing:
-            self.after(self.ms_per_frame, self.update_logic)
+        """Playback tick. Plays as many moves as the speed asks for since the last tick but only
+        draws the last one, so the display never runs faster than MAX_FRAMES_PER_SECOND."""
+        ms_per_frame = max(round(1000 / min(self.replay_speed, MAX_FRAMES_PER_SECOND)), 1)
+        now = perf_counter()
+        elapsed, self.last_tick = now - self.last_tick, now
+        if self.playing and self.history is not None:
+            self.move_credit += elapsed * self.replay_speed
+            moves = int(self.move_credit)
+            self.move_credit -= moves
+            if moves:
+                self.seek(min(self.current_matrix + moves, self.history.n_of_matrices - 1))
+        self.after(ms_per_frame, self.update_logic)
+
+    def seek(self, index):
+        """Show the board at the given index straight away, without drawing the ones in between."""
+        if self.history is None or index == self.current_matrix:
             return
-        self.matrix = self.history.loadMatrix(self.current_matrix + 1)
-        self.current_matrix += 1
-        if self.matrix is None:
-            # Game has ended
-            self.grid_cells[1][1].configure(text="Game", bg=c.BACKGROUND_COLOR_CELL_EMPTY)
-            self.grid_cells[1][2].configure(text="Ended", bg=c.BACKGROUND_COLOR_CELL_EMPTY)
-            self.playing = False
-            self.after(self.ms_per_frame, self.update_logic)
+        matrix = self.history.loadMatrix(index)
+        if matrix is None:
             return
-        # record last move
-        self.history_matrixs.append(self.matrix)
+        self.matrix = matrix
+        self.current_matrix = index
         self.update_grid_cells()
-        if logic.game_state(self.matrix) == 1:
-            self.grid_cells[1][1].configure(text="You", bg=c.BACKGROUND_COLOR_CELL_EMPTY)
-            self.grid_cells[1][2].configure(text="Win!", bg=c.BACKGROUND_COLOR_CELL_EMPTY)
-            self.update_grid_cells()
-            self.playing = False
-        if logic.game_state(self.matrix) == -1:
-            self.grid_cells[1][1].configure(text="You", bg=c.BACKGROUND_COLOR_CELL_EMPTY)
-            self.grid_cells[1][2].configure(text="Lose!", bg=c.BACKGROUND_COLOR_CELL_EMPTY)
-            self.update_grid_cells()
+        if self.scrubber.get() != index:
+            self.scrubber.set(index)
+        if index == self.history.n_of_matrices - 1:
             self.playing = False
-        
-        self.after(self.ms_per_frame, self.update_logic)
-        
+            state = logic.game_state(self.matrix)
+            if state == 1:
+                self.show_message("You", "Win!")
+            elif state == -1:
+                self.show_message("You", "Lose!")
+            else:
+                self.show_message("Game", "Ended")
+
     def back(self, event):
-        if self.current_matrix == 0:
+        if self.history is None or self.current_matrix == 0:
             return
-        self.matrix = self.history.loadMatrix(self.current_matrix - 1)
-        self.current_matrix -= 1
-        self.update_grid_cells()
+        self.seek(self.current_matrix - 1)
 
     def forward(self, event):
-        if self.current_matrix == self.history.n_of_matrices - 1:
+        if self.history is None or self.current_matrix == self.history.n_of_matrices - 1:
             return
-        self.matrix = self.history.loadMatrix(self.current_matrix + 1)
-        self.current_matrix += 1
-        self.update_grid_cells()
+        self.seek(self.current_matrix + 1)
 
     def init_commands(self):
         self.commands = {
-            c.KEY_UP: logic.up,
-            c.KEY_DOWN: logic.down,
-            c.KEY_LEFT: logic.left,
-            c.KEY_RIGHT: logic.right,
-            c.KEY_UP_ALT1: logic.up,
-            c.KEY_DOWN_ALT1: logic.down,
-            c.KEY_LEFT_ALT1: logic.left,
-            c.KEY_RIGHT_ALT1: logic.right,
-            c.KEY_UP_ALT2: logic.up,
-            c.KEY_DOWN_ALT2: logic.down,
-            c.KEY_LEFT_ALT2: logic.left,
-            c.KEY_RIGHT_ALT2: logic.right,
+            c.KEY_UP: bitboard.up,
+            c.KEY_DOWN: bitboard.down,
+            c.KEY_LEFT: bitboard.left,
+            c.KEY_RIGHT: bitboard.right,
+            c.KEY_UP_ALT1: bitboard.up,
+            c.KEY_DOWN_ALT1: bitboard.down,
+            c.KEY_LEFT_ALT1: bitboard.left,
+            c.KEY_RIGHT_ALT1: bitboard.right,
+            c.KEY_UP_ALT2: bitboard.up,
+            c.KEY_DOWN_ALT2: bitboard.down,
+            c.KEY_LEFT_ALT2: bitboard.left,
+            c.KEY_RIGHT_ALT2: bitboard.right,
         }
 
     def get_files(self):
-        self.history_files = [f for f in os.listdir(REPLAY_DIR) if f.endswith(".txt")]
+        """Bring the metadata index of the replay directory up to date, reading only new and changed games."""
+        self.index = GameIndex(REPLAY_DIR)
+        indexed, removed = self.index.update()
+        print(f"Indexed {indexed} new or changed games, forgot {removed} deleted ones")
 
-game_grid = GameGrid()
-game_grid.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    game_grid = GameGrid()
+    game_grid.mainloop()
\ No newline at end of file
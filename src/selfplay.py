@@ -0,0 +1,275 @@
+"""Distributed self-play. Worker processes play games with a periodically synced copy of the
+weights and ship transitions through shared memory to one learner process, which trains on
+them and broadcasts new weights.
+
+Every worker owns queue_depth slots of slot_size transitions in shared memory. A worker fills
+a slot, announces it on the filled queue and takes its next free slot, so a slow learner
+throttles the workers instead of growing an unbounded queue.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import queue
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter
+import numpy as np
+from env import VecEnv
+from experience import ReplayBuffer
+
+
+# name, dtype, shape of one transition
+TRANSITION_FIELDS = (
+    ("states", np.int32, (4, 4)),
+    ("actions", np.int8, ()),
+    ("rewards", np.float32, ()),
+    ("next_states", np.int32, (4, 4)),
+    ("dones", np.bool_, ()),
+)
+
+
+class TransitionSlots():
+    """Shared-memory arrays shaped (workers, queue_depth, slot_size, ...), one per transition field.
+    Created by the learner, attached to by name in the workers. Don't forget to call close()."""
+
+    def __init__(self, n_workers, queue_depth, slot_size, names=None):
+        self.shape = (n_workers, queue_depth, slot_size)
+        self.shms = {}
+        self.arrays = {}
+        for field, dtype, shape in TRANSITION_FIELDS:
+            if names is None:
+                size = int(np.prod(self.shape + shape)) * np.dtype(dtype).itemsize
+                shm = SharedMemory(create=True, size=size)
+            else:
+                shm = SharedMemory(name=names[field])
+            self.shms[field] = shm
+            self.arrays[field] = np.ndarray(self.shape + shape, dtype=dtype, buffer=shm.buf)
+
+    def names(self):
+        return {field: shm.name for field, shm in self.shms.items()}
+
+    def read(self, worker, slot, n):
+        """Copies of the first n transitions of a slot, in TRANSITION_FIELDS order."""
+        return tuple(self.arrays[field][worker, slot, :n].copy() for field, _, _ in TRANSITION_FIELDS)
+
+    def close(self, unlink=False):
+        # Arrays hold views of the shared buffers and must go first
+        self.arrays = {}
+        for shm in self.shms.values():
+            shm.close()
+            if unlink:
+                shm.unlink()
+
+
+class SharedWeights():
+    """Flat float32 copy of the model weights in shared memory plus a version counter."""
+
+    def __init__(self, shapes, name=None, version=None, lock=None):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.sizes = [int(np.prod(shape)) for shape in self.shapes]
+        size = max(sum(self.sizes), 1) * np.dtype(np.float32).itemsize
+        self.shm = SharedMemory(create=True, size=size) if name is None else SharedMemory(name=name)
+        self.flat = np.ndarray(sum(self.sizes), dtype=np.float32, buffer=self.shm.buf)
+        self.version = version if version is not None else mp.Value("q", 0, lock=False)
+        self.lock = lock if lock is not None else mp.Lock()
+
+    def publish(self, weights):
+        with self.lock:
+            self.flat[:] = np.concatenate([np.ravel(w) for w in weights])
+            self.version.value += 1
+
+    def load(self):
+        """Returns (version, list of weight arrays)."""
+        with self.lock:
+            flat = self.flat.copy()
+            version = self.version.value
+        weights = []
+        offset = 0
+        for shape, size in zip(self.shapes, self.sizes):
+            weights.append(flat[offset:offset + size].reshape(shape))
+            offset += size
+        return version, weights
+
+    def close(self, unlink=False):
+        self.flat = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def worker_exploration_rate(worker_id, n_workers, base=0.4, alpha=7):
+    """Fixed exploration rate per worker, from base down to almost greedy, so the workers
+    together cover both exploring and exploiting play."""
+    if n_workers == 1:
+        return base
+    return base ** (1 + alpha * worker_id / (n_workers - 1))
+
+
+def _worker(worker_id, config, slot_names, weight_args, free_slots, filled_slots, stop):
+    """Self-play loop of one worker process."""
+    # NumPy forward passes: workers never import Keras
+    from network import NumpyNetwork, epsilon_greedy
+    np.random.seed(config["seed"] + worker_id)
+    slots = TransitionSlots(config["n_workers"], config["queue_depth"], config["slot_size"], names=slot_names)
+    weights = SharedWeights(*weight_args)
+    version, initial = weights.load()
+    network = NumpyNetwork(initial)
+
+    exploration_rate = worker_exploration_rate(worker_id, config["n_workers"])
+    history_prefix = None
+    if config["history_prefix"] is not None:
+        history_prefix = f"{config['history_prefix']}_worker_{worker_id}"
+    env = VecEnv(config["games_per_worker"], config["max_moves"], history_prefix=history_prefix,
+                 history_dir=config["history_dir"], seed=config["seed"] + worker_id)
+    predict = lambda boards: network.predict(boards)[:, 0, :]
+    slot_size = config["slot_size"]
+
+    slot = free_slots.get()
+    filled = 0
+    try:
+        while not stop.is_set():
+            if weights.version.value != version:
+                version, latest = weights.load()
+                network.set_weights(latest)
+
+            states = env.states
+            actions = epsilon_greedy(predict, states, exploration_rate)
+            new_states, rewards, games_ended, _ = env.step(actions)
+            env.pop_finished()
+
+            # Copy the step into the current slot, moving on to a new slot when it is full
+            start = 0
+            while start < len(states):
+                n = min(slot_size - filled, len(states) - start)
+                chunk = slice(start, start + n)
+                for field, values in zip(slots.arrays, (states, actions, rewards, new_states, games_ended)):
+                    slots.arrays[field][worker_id, slot, filled:filled + n] = values[chunk]
+                filled += n
+                start += n
+                if filled == slot_size:
+                    filled_slots.put((worker_id, slot, filled))
+                    slot = _next_free_slot(free_slots, stop)
+                    filled = 0
+                    if slot is None:
+                        return
+    finally:
+        env.close()
+        slots.close()
+        weights.close()
+
+
+def _next_free_slot(free_slots, stop):
+    while not stop.is_set():
+        try:
+            return free_slots.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def run_selfplay(n_workers=4, games_per_worker=8, max_moves=100, weight_sync_interval=10, queue_depth=4,
+                 slot_size=256, total_transitions=100_000, batch_size=64, updates_per_slot=4,
+                 learning_rate=0.001, discount_rate=0.99, replay_max_bytes=64 * 2**20,
+                 history_prefix=None, history_dir="history", model_file=None, seed=0):
+    """Train with n_workers self-play processes feeding this (learner) process.
+
+    weight_sync_interval: learner updates between two weight broadcasts.
+    queue_depth: transition slots per worker that may be waiting for the learner.
+    updates_per_slot: minibatch updates run for every slot received.
+    history_prefix: if set, workers write their games to history_dir.
+    Returns the trained model."""
+    from network import MODEL_NICKNAME, build_model, q_targets
+    model = build_model()
+    ctx = mp.get_context("spawn")
+    config = {
+        "n_workers": n_workers,
+        "games_per_worker": games_per_worker,
+        "max_moves": max_moves,
+        "queue_depth": queue_depth,
+        "slot_size": slot_size,
+        "history_prefix": history_prefix,
+        "history_dir": history_dir,
+        "seed": seed,
+    }
+    if history_prefix is not None:
+        os.makedirs(history_dir, exist_ok=True)
+    slots = TransitionSlots(n_workers, queue_depth, slot_size)
+    weights = SharedWeights([w.shape for w in model.get_weights()], version=ctx.Value("q", 0, lock=False),
+                            lock=ctx.Lock())
+    weights.publish(model.get_weights())
+    weight_args = (weights.shapes, weights.shm.name, weights.version, weights.lock)
+
+    free_slots = [ctx.Queue() for _ in range(n_workers)]
+    for worker_queue in free_slots:
+        for slot in range(queue_depth):
+            worker_queue.put(slot)
+    filled_slots = ctx.Queue()
+    stop = ctx.Event()
+    workers = [
+        ctx.Process(target=_worker, name=f"selfplay-{i}", daemon=True,
+                    args=(i, config, slots.names(), weight_args, free_slots[i], filled_slots, stop))
+        for i in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    replay_buffer = ReplayBuffer(max_bytes=replay_max_bytes)
+    rng = np.random.default_rng(seed)
+    received = 0
+    updates = 0
+    start = last_report = perf_counter()
+    try:
+        while received < total_transitions:
+            try:
+                worker_id, slot, n = filled_slots.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError("All self-play workers died")
+                continue
+            replay_buffer.add_batch(*slots.read(worker_id, slot, n))
+            free_slots[worker_id].put(slot)
+            received += n
+
+            if len(replay_buffer) < batch_size:
+                continue
+            for _ in range(updates_per_slot):
+                states, actions, rewards, new_states, games_ended = replay_buffer.sample(batch_size, rng)
+                qvalues = model.predict(np.concatenate([states, new_states]), verbose=False)[:, 0, :]
+                target_qvalues = q_targets(qvalues[:batch_size], qvalues[batch_size:], actions, rewards,
+                                           games_ended, learning_rate, discount_rate)
+                model.fit(states, target_qvalues, epochs=1, verbose=0)
+                updates += 1
+                if updates % weight_sync_interval == 0:
+                    weights.publish(model.get_weights())
+            now = perf_counter()
+            if now - last_report >= 1:
+                last_report = now
+                print(f"{received} transitions, {updates} updates, {received / (now - start):.0f} transitions/s")
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        slots.close(unlink=True)
+        weights.close(unlink=True)
+
+    model.save(model_file or f"models/{MODEL_NICKNAME}_selfplay.keras")
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train with multi-process self-play")
+    parser.add_argument("--workers", type=int, default=mp.cpu_count() - 1 or 1)
+    parser.add_argument("--games-per-worker", type=int, default=8)
+    parser.add_argument("--max-moves", type=int, default=100)
+    parser.add_argument("--weight-sync-interval", type=int, default=10, help="learner updates between weight broadcasts")
+    parser.add_argument("--queue-depth", type=int, default=4, help="transition slots per worker")
+    parser.add_argument("--slot-size", type=int, default=256, help="transitions per slot")
+    parser.add_argument("--transitions", type=int, default=100_000, help="stop after this many transitions")
+    parser.add_argument("--history-prefix", default=None, help="write worker games to the history directory")
+    parser.add_argument("--history-dir", default="history")
+    args = parser.parse_args()
+    run_selfplay(n_workers=args.workers, games_per_worker=args.games_per_worker, max_moves=args.max_moves,
+                 weight_sync_interval=args.weight_sync_interval, queue_depth=args.queue_depth,
+                 slot_size=args.slot_size, total_transitions=args.transitions, history_prefix=args.history_prefix,
+                 history_dir=args.history_dir)
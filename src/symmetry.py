@@ -0,0 +1,110 @@
+"""The 8 rotations and reflections of the board (the dihedral group of the square).
+
+Transform t transposes the board if t >= 4, then rotates it t % 4 quarter turns
+counterclockwise; transform 0 is the identity. Moves commute with the transforms once the
+action is remapped (left becomes up after a quarter turn, ...), and tile spawns are uniform
+over empty cells, so a transition stays valid in all 8 orientations.
+
+The canonical form of a board is the orientation with the smallest packed bitboard, the same
+order expectimax.canonical uses, so all 8 orientations of a board share one cache key.
+"""
+import numpy as np
+
+
+N_TRANSFORMS = 8
+SIZE = 4
+
+# Encoded actions 0..3 are L, U, R, D, as (row, column) steps
+_DIRECTIONS = ((0, -1), (-1, 0), (0, 1), (1, 0))
+
+
+def _transform_cell(t, row, column):
+    """Where transform t sends a cell."""
+    if t >= 4:
+        row, column = column, row
+    for _ in range(t % 4):
+        # A counterclockwise quarter turn, like np.rot90
+        row, column = SIZE - 1 - column, row
+    return row, column
+
+
+def _tables():
+    # PERMUTATIONS[t][cell] is the cell of the original board that ends up at cell after t
+    permutations = np.zeros((N_TRANSFORMS, SIZE * SIZE), dtype=np.intp)
+    actions = np.zeros((N_TRANSFORMS, 4), dtype=np.int8)
+    for t in range(N_TRANSFORMS):
+        for row in range(SIZE):
+            for column in range(SIZE):
+                new_row, new_column = _transform_cell(t, row, column)
+                permutations[t, new_row * SIZE + new_column] = row * SIZE + column
+        # Directions transform like the difference of two cells
+        origin = _transform_cell(t, 1, 1)
+        for action, (row_step, column_step) in enumerate(_DIRECTIONS):
+            moved = _transform_cell(t, 1 + row_step, 1 + column_step)
+            actions[t, action] = _DIRECTIONS.index((moved[0] - origin[0], moved[1] - origin[1]))
+    inverses = np.array([next(u for u in range(N_TRANSFORMS)
+                              if (permutations[t][permutations[u]] == np.arange(SIZE * SIZE)).all())
+                         for t in range(N_TRANSFORMS)])
+    return permutations, actions, inverses
+
+
+# ACTIONS[t][action] is the action on the transformed board, INVERSES[t] undoes transform t
+PERMUTATIONS, ACTIONS, INVERSES = _tables()
+_NIBBLE_SHIFTS = np.arange(SIZE * SIZE, dtype=np.uint64) * np.uint64(4)
+
+
+def transform(boards, transforms):
+    """Boards, one (4, 4) board or (N, 4, 4), after transform ids (one int or one per board)."""
+    boards = np.asarray(boards)
+    single = boards.ndim == 2
+    flat = boards.reshape(-1, SIZE * SIZE)
+    indices = PERMUTATIONS[np.broadcast_to(transforms, (len(flat),))]
+    result = np.take_along_axis(flat, indices, axis=1).reshape(-1, SIZE, SIZE)
+    return result[0] if single else result
+
+
+def transform_actions(actions, transforms):
+    """Encoded actions on the original boards to the same moves on the transformed boards."""
+    return ACTIONS[transforms, actions]
+
+
+def inverse_actions(actions, transforms):
+    """Encoded actions on transformed boards back to the same moves on the original boards."""
+    return ACTIONS[INVERSES[transforms], actions]
+
+
+def all_transforms(boards):
+    """(N, 8, 4, 4): every board in its 8 orientations, in transform order."""
+    flat = np.asarray(boards).reshape(-1, SIZE * SIZE)
+    return flat[:, PERMUTATIONS].reshape(-1, N_TRANSFORMS, SIZE, SIZE)
+
+
+def canonicalize(boards):
+    """(canonical boards, transform ids) such that transform(boards, ids) == canonical boards.
+    Takes one (4, 4) board, giving one board and an int, or (N, 4, 4)."""
+    boards = np.asarray(boards)
+    single = boards.ndim == 2
+    flat = boards.reshape(-1, SIZE * SIZE)
+    # Packed bitboards (as bb.to_bitboards) of the 8 orientations, from the ranks of the cells
+    ranks = np.zeros(flat.shape, dtype=np.uint64)
+    nonzero = flat > 0
+    ranks[nonzero] = np.log2(flat[nonzero]).round().astype(np.uint64)
+    keys = (ranks[:, PERMUTATIONS] << _NIBBLE_SHIFTS).sum(axis=2)
+    transforms = keys.argmin(axis=1)
+    variants = all_transforms(flat)
+    canonical = variants[np.arange(len(variants)), transforms]
+    if single:
+        return canonical[0], int(transforms[0])
+    return canonical, transforms
+
+
+def augment(states, actions, rewards, next_states, dones):
+    """Expand a batch of transitions into their 8 orientations each, 8x as many transitions,
+    the copies of a transition next to each other."""
+    n = len(states)
+    transforms = np.tile(np.arange(N_TRANSFORMS), n)
+    return (all_transforms(states).reshape(-1, SIZE, SIZE),
+            transform_actions(np.repeat(actions, N_TRANSFORMS), transforms).astype(np.asarray(actions).dtype),
+            np.repeat(rewards, N_TRANSFORMS),
+            all_transforms(next_states).reshape(-1, SIZE, SIZE),
+            np.repeat(dones, N_TRANSFORMS))
@@ -0,0 +1,16 @@
+import batch_logic as bl
+import benchmark
+import experience
+import logic
+
+
+def test_benchmarks_start_from_seeded_global_generators(monkeypatch):
+    draws = []
+
+    def setup(rng):
+        draws.append((logic._rng.random(), bl._rng.random(), experience._rng.random(), rng.random()))
+        return (lambda: None), 1
+    monkeypatch.setitem(benchmark.BENCHMARKS, "test.seeded", ("test", setup))
+    for _ in range(2):
+        benchmark.run_benchmark("test.seeded", warmup=0, repeats=1, min_time=0)
+    assert draws[0] == draws[1]
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+import bitboard as bb
+import logic
+import metrics
+
+
+def test_tiles_above_32768_are_rejected():
+    board = np.zeros((4, 4), dtype=int)
+    board[0, 0] = 1 << 15
+    assert (bb.from_bitboard(bb.to_bitboard(board)) == board).all()
+    board[0, 0] = 1 << 16
+    with pytest.raises(ValueError):
+        bb.to_bitboard(board)
+    with pytest.raises(ValueError):
+        bb.to_bitboards(board[None])
+
+
+def test_drop_in_moves_are_timed_apart_from_logic_moves():
+    board = np.array([[2, 2, 0, 0], [0, 4, 4, 0], [0, 0, 0, 0], [8, 0, 0, 8]])
+    metrics.reset()
+    metrics.enable()
+    try:
+        for move in (bb.left, bb.up, bb.right, bb.down):
+            new, done = move(board)
+            expected, expected_done = getattr(logic, move.__name__)(board)
+            assert (new == np.asarray(expected)).all() and done == expected_done
+        counts = {stat["name"]: stat["count"] for stat in metrics.stats()}
+    finally:
+        metrics.disable()
+        metrics.reset()
+    for name in ("left", "up", "right", "down"):
+        assert counts[name] == 1 and counts["bitboard." + name] == 1
@@ -0,0 +1,31 @@
+import numpy as np
+import bitboard as bb
+import dataset
+from history import History
+
+
+BOARDS = [np.full((4, 4), 2 ** (k + 1)) for k in range(5)]
+KEYS = ["Up", "Left", "w", "Down"]
+
+
+def test_human_history_round_trip(tmp_path):
+    history = History("w", filename="human", dir=str(tmp_path))
+    history.saveMatrix(BOARDS[0])
+    for board, key in zip(BOARDS[1:], KEYS):
+        history.saveMatrix(board)
+        history.saveMove(key)
+    history.close()
+
+    boards, moves = dataset.read_game(str(tmp_path / "human.txt"))
+    assert (boards == bb.to_bitboards(BOARDS)).all()
+    assert moves.tolist() == [1, 0, 1, 3, dataset.NO_MOVE]
+
+
+def test_key_names_of_older_human_histories(tmp_path):
+    # Written before moves were normalized: the key names, concatenated
+    path = tmp_path / "human.txt"
+    path.write_text("".join(" ".join(map(str, board.ravel())) + "\n" for board in BOARDS) + "".join(KEYS))
+
+    boards, moves = dataset.read_game(str(path))
+    assert len(boards) == 5
+    assert moves.tolist() == [1, 0, 1, 3, dataset.NO_MOVE]
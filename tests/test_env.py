@@ -0,0 +1,23 @@
+import os
+import threading
+import numpy as np
+from env import VecEnv
+from history import open_history
+
+
+def test_background_histories_share_one_writer_thread(tmp_path):
+    threads = threading.active_count()
+    env = VecEnv(16, 5, history_prefix="test", history_dir=str(tmp_path), seed=0, background_writes=True)
+    rng = np.random.default_rng(0)
+    try:
+        for _ in range(12):
+            env.step(rng.integers(0, 4, 16))
+            assert threading.active_count() == threads + 1
+    finally:
+        env.close()
+    assert threading.active_count() == threads
+
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == env.next_game_id
+    finished = open_history("r", filename="test_game_0.txt", dir=str(tmp_path))
+    assert finished.n_of_matrices == 6
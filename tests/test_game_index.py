@@ -0,0 +1,39 @@
+import os
+import numpy as np
+import game_index
+from env import VecEnv
+from game_index import GameIndex
+
+
+def _play(directory, n_games=3):
+    env = VecEnv(n_games, 8, history_prefix="test", history_dir=str(directory), seed=1)
+    rng = np.random.default_rng(1)
+    for _ in range(8):
+        env.step(rng.integers(0, 4, n_games))
+    env.close()
+
+
+def test_unreadable_files_are_only_read_again_once_changed(tmp_path, monkeypatch):
+    _play(tmp_path)
+    broken = tmp_path / "broken_game_0.hist"
+    broken.write_bytes(b"not a history")
+    index = GameIndex(str(tmp_path))
+    try:
+        readable = index.update()[0]
+        assert index.count() == readable
+        assert "broken_game_0.hist" not in [row[0] for row in index.rows()]
+
+        read = []
+        summarize = game_index.summarize
+        monkeypatch.setattr(game_index, "summarize", lambda path: read.append(os.path.basename(path)) or summarize(path))
+        assert index.update() == (0, 0)
+        assert read == []
+
+        broken.write_bytes(b"still not a history, but changed")
+        index.update()
+        assert read == ["broken_game_0.hist"]
+
+        broken.unlink()
+        assert index.update() == (0, 1)
+    finally:
+        index.close()
@@ -0,0 +1,54 @@
+import os
+import time
+import numpy as np
+from history import open_history, BINARY_EXTENSION, INDEX_EXTENSION, TEXT_EXTENSION
+
+
+def test_async_history_writer_sleeps_while_idle(tmp_path):
+    history = open_history("w", dir=str(tmp_path), filename="idle" + TEXT_EXTENSION, background=True)
+    history.writer.flush_interval = 0.01
+    try:
+        history.saveMatrix(np.full((4, 4), 2))
+        history.flush()
+        # Well past flush_interval with nothing queued
+        start = time.process_time()
+        time.sleep(0.5)
+        assert time.process_time() - start < 0.1
+    finally:
+        history.close()
+
+
+def test_index_file_only_on_request(tmp_path):
+    history = open_history("w", dir=str(tmp_path), filename="game" + TEXT_EXTENSION)
+    history.saveMatrix(np.full((4, 4), 2))
+    history.saveMatrix(np.full((4, 4), 4))
+    history.saveMove("U")
+    history.close()
+    index = str(tmp_path / ("game" + TEXT_EXTENSION + INDEX_EXTENSION))
+
+    open_history("r", dir=str(tmp_path), filename="game" + TEXT_EXTENSION).close()
+    assert not os.path.exists(index)
+    for _ in range(2):
+        history = open_history("r", dir=str(tmp_path), filename="game" + TEXT_EXTENSION, use_index_file=True)
+        assert history.n_of_matrices == 2 and (history.loadMatrix(1) == 4).all()
+        history.close()
+        assert os.path.exists(index)
+
+
+def test_binary_history_never_flushed_reads_as_empty(tmp_path):
+    # The header is still in the writer's buffer, as after a crash before the first flush
+    writer = open_history("w", dir=str(tmp_path), filename="crashed" + BINARY_EXTENSION)
+    writer.saveMatrix(np.full((4, 4), 2))
+    try:
+        history = open_history("r", dir=str(tmp_path), filename="crashed" + BINARY_EXTENSION)
+        assert history.n_of_matrices == 0 and history.readMoves() == []
+        history.close()
+        writer.flush()
+        history = open_history("r", dir=str(tmp_path), filename="crashed" + BINARY_EXTENSION)
+        assert history.n_of_matrices == 0 and history.readMoves() == []
+        history.close()
+    finally:
+        writer.close()
+    history = open_history("r", dir=str(tmp_path), filename="crashed" + BINARY_EXTENSION)
+    assert history.n_of_matrices == 1 and (history.loadMatrix(0) == 2).all()
+    history.close()
@@ -0,0 +1,28 @@
+import sys
+import threading
+import metrics
+
+
+def test_stats_recorded_from_several_threads_add_up():
+    metrics.enable()
+    interval = sys.getswitchinterval()
+    # Switch threads as often as possible, so unguarded counters would lose updates
+    sys.setswitchinterval(1e-6)
+    try:
+        stat = metrics.get("test.threads")
+        stat.reset()
+
+        def record():
+            for ns in range(20000):
+                metrics.record("test.threads", ns)
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+        metrics.disable()
+    summary = stat.summary()
+    assert summary["count"] == 80000 and sum(stat.buckets) == 80000
+    assert summary["total_ns"] == 4 * sum(range(20000))
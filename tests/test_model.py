@@ -0,0 +1,25 @@
+import os
+import numpy as np
+import pytest
+import model
+
+
+@pytest.mark.parametrize("n_envs, n_games", [(8, 3), (4, 10)])
+def test_run_games_records_only_the_requested_games(tmp_path, n_envs, n_games):
+    config = dict(model.DEFAULT_CONFIG, number_of_envs=n_envs, number_of_games=n_games, max_moves=20,
+                  history_dir=str(tmp_path), seed=0)
+    rng = np.random.default_rng(0)
+    results = model.run_games(lambda states: rng.integers(0, 4, len(states)), config, history_prefix="random")
+    assert len(results) == n_games
+    assert sorted(os.listdir(tmp_path)) == sorted(f"random_game_{i}.txt" for i in range(n_games))
+
+
+def test_resume_deletes_histories_of_interrupted_games(tmp_path):
+    for game in range(10):
+        (tmp_path / f"run_game_{game}.txt").write_text("")
+    (tmp_path / "run_game_5.txt.moves").write_text("LU")
+    (tmp_path / "other_game_5.txt").write_text("")
+    state = {"config": dict(model.DEFAULT_CONFIG, history_prefix="run", history_dir=str(tmp_path)),
+             "games_in_progress": [3, 5, 6], "next_game_id": 7}
+    assert model._discard_interrupted_games(state) == 7
+    assert sorted(os.listdir(tmp_path)) == ["other_game_5.txt"] + [f"run_game_{game}.txt" for game in (0, 1, 2, 4)]
@@ -0,0 +1,23 @@
+import numpy as np
+import montecarlo
+
+
+BOARD = np.array([[2, 2, 4, 0], [0, 4, 8, 2], [0, 0, 2, 0], [0, 0, 0, 4]])
+
+
+def test_rollouts_leave_the_global_generator_alone():
+    np.random.seed(0)
+    expected = np.random.random_sample(4)
+    np.random.seed(0)
+    first = montecarlo.rollout(BOARD, 0, 64, 20, seed=1)
+    assert montecarlo.rollout(BOARD, 0, 64, 20, seed=1) == first
+    assert (np.random.random_sample(4) == expected).all()
+
+
+def test_seeded_agents_agree():
+    values = []
+    for _ in range(2):
+        agent = montecarlo.MonteCarloAgent(rollouts_per_move=64, max_depth=10, seed=3,
+                                           stats_hook=lambda stats: values.append(stats["values"]))
+        agent.choose_action(BOARD[None])
+    assert values[0] == values[1]
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from network import NumpyNetwork, WEIGHT_SHAPES, save_weights
+
+
+def _random_boards(rng, n):
+    ranks = rng.integers(0, 12, size=(n, 4, 4))
+    return np.where(ranks > 0, 1 << ranks, 0)
+
+
+def test_numpy_network_matches_keras():
+    pytest.importorskip("keras")
+    from network import build_model
+    model = build_model()
+    rng = np.random.default_rng(0)
+    # Scaled down so the softmax isn't saturated by the raw tile values
+    model.set_weights([rng.normal(0, 0.05, w.shape).astype(np.float32) for w in model.get_weights()])
+    boards = _random_boards(rng, 256)
+    network = NumpyNetwork.from_keras(model)
+    np.testing.assert_allclose(network.predict(boards), model.predict(boards, verbose=False), rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(network.predict(boards[0]), model.predict(boards[:1], verbose=False),
+                               rtol=1e-4, atol=1e-6)
+
+
+def test_numpy_network_weights_round_trip(tmp_path):
+    rng = np.random.default_rng(1)
+    weights = [rng.normal(0, 0.1, shape) for layer in WEIGHT_SHAPES for shape in layer]
+    network = NumpyNetwork(weights)
+    save_weights(str(tmp_path / "weights.npz"), network.get_weights())
+    loaded = NumpyNetwork.load(str(tmp_path / "weights.npz"))
+    boards = _random_boards(rng, 8)
+    assert network.predict(boards).shape == (8, 1, 4)
+    np.testing.assert_array_equal(loaded.predict(boards), network.predict(boards))
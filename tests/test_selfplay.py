@@ -0,0 +1,46 @@
+import os
+import queue
+import threading
+import numpy as np
+import pytest
+import selfplay
+from history import open_history
+from network import WEIGHT_SHAPES
+
+
+def test_worker_writes_histories_to_history_dir(tmp_path):
+    config = {"n_workers": 1, "games_per_worker": 4, "max_moves": 5, "queue_depth": 2, "slot_size": 16,
+              "history_prefix": "selfplay", "history_dir": str(tmp_path), "seed": 0}
+    rng = np.random.default_rng(0)
+    slots = selfplay.TransitionSlots(1, 2, 16)
+    weights = selfplay.SharedWeights([shape for layer in WEIGHT_SHAPES for shape in layer])
+    weights.publish([rng.normal(size=shape) for shape in weights.shapes])
+    free_slots, filled_slots, stop = queue.Queue(), queue.Queue(), threading.Event()
+    for slot in range(2):
+        free_slots.put(slot)
+    worker = threading.Thread(target=selfplay._worker, args=(0, config, slots.names(), (
+        weights.shapes, weights.shm.name, weights.version, weights.lock), free_slots, filled_slots, stop))
+    worker.start()
+    try:
+        # 4 slots of 16 transitions: 16 steps of 4 games, at least 12 of them finished
+        for _ in range(4):
+            filled_slots.get(timeout=10)
+            free_slots.put(0)
+    finally:
+        stop.set()
+        worker.join()
+        slots.close(unlink=True)
+        weights.close(unlink=True)
+
+    names = sorted(os.listdir(tmp_path))
+    assert len(names) >= 12 and all(name.startswith("selfplay_worker_0_game_") for name in names)
+    assert open_history("r", filename="selfplay_worker_0_game_0.txt", dir=str(tmp_path)).n_of_matrices == 6
+
+
+def test_selfplay_creates_history_dir(tmp_path):
+    pytest.importorskip("keras")
+    history_dir = tmp_path / "history"
+    selfplay.run_selfplay(n_workers=1, games_per_worker=4, max_moves=5, slot_size=16, total_transitions=64,
+                          batch_size=16, updates_per_slot=1, history_prefix="selfplay",
+                          history_dir=str(history_dir), model_file=str(tmp_path / "model.keras"))
+    assert any(name.startswith("selfplay_worker_0_game_") for name in os.listdir(history_dir))